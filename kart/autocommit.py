@@ -0,0 +1,123 @@
+from typing import Dict, Set
+
+from qgis.utils import iface
+from qgis.core import Qgis
+
+from qgis.PyQt.QtCore import QTimer
+
+from kart.kartapi import KartException, runInBackground
+from kart.utils import setting, AUTOCOMMITDELAY
+
+# Seconds to wait for more saves before committing, if not set in settings
+DEFAULT_AUTOCOMMIT_DELAY = 2
+
+
+def autoCommitDelay():
+    delay = setting(AUTOCOMMITDELAY)
+    return DEFAULT_AUTOCOMMIT_DELAY if delay is None else delay
+
+
+def autoCommitMessage(datasets):
+    names = ", ".join(f"'{dataset}'" for dataset in sorted(datasets))
+    if len(datasets) == 1:
+        return f"Changed dataset {names}"
+    return f"Changed datasets {names}"
+
+
+class AutoCommitQueue:
+    """
+    Collects the datasets saved while auto commit is enabled and commits
+    them once no more saves have happened for a while.
+
+    All datasets saved in the same repo within that window go into a single
+    commit, which runs in a background task. Datasets saved while a commit
+    of their repo is running are committed when it finishes.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def instance():
+        if AutoCommitQueue.__instance is None:
+            AutoCommitQueue()
+        return AutoCommitQueue.__instance
+
+    def __init__(self):
+        if AutoCommitQueue.__instance is not None:
+            raise Exception("Singleton class")
+
+        AutoCommitQueue.__instance = self
+
+        self.repos = {}
+        self.pending: Dict[str, Set[str]] = {}
+        self.running = {}
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, repo, dataset):
+        """
+        Queues a dataset to be committed, restarting the wait
+        """
+        self.repos[repo.path] = repo
+        self.pending.setdefault(repo.path, set()).add(dataset)
+        self.timer.start(int(autoCommitDelay() * 1000))
+
+    def flush(self):
+        """
+        Commits all queued datasets without waiting any longer
+        """
+        self.timer.stop()
+        for path in list(self.pending):
+            if path not in self.running:
+                self._commit(path)
+
+    def _commit(self, path):
+        repo = self.repos[path]
+        # asks for the user name and email if needed, which can't be done
+        # from the background task. If they are not given, the datasets are
+        # kept for the next flush
+        if not repo.checkUserConfigured():
+            return
+        datasets = self.pending.pop(path)
+        self.running[path] = runInBackground(
+            "Committing changes",
+            repo.commit,
+            autoCommitMessage(datasets),
+            datasets=sorted(datasets),
+            onResult=lambda _: self._committed(path),
+            onError=lambda ex: self._committed(path, ex),
+        )
+
+    def _committed(self, path, ex=None):
+        del self.running[path]
+        if ex is None:
+            iface.messageBar().pushMessage(
+                "Commit", "Changes correctly committed", level=Qgis.Info
+            )
+        else:
+            iface.messageBar().pushMessage(
+                "Commit", f"Changes could not be committed: {ex}", level=Qgis.Warning
+            )
+        if path in self.pending and not self.timer.isActive():
+            self._commit(path)
+
+    def stop(self):
+        """
+        Commits the queued datasets right away, waiting for it to finish.
+
+        The user is not asked for a name and email, as QGIS might be closing.
+        Datasets of repos that would need them are not committed
+        """
+        self.timer.stop()
+        for task in list(self.running.values()):
+            task.waitForFinished()
+        for path, datasets in list(self.pending.items()):
+            repo = self.repos[path]
+            try:
+                if repo.isUserConfigured():
+                    repo.commit(autoCommitMessage(datasets), datasets=sorted(datasets))
+            except KartException:
+                pass
+        self.pending.clear()
@@ -0,0 +1,70 @@
+import os
+import threading
+
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Maximum number of Kart processes that can run at the same time
+MAX_CONCURRENT_COMMANDS = 4
+
+
+class KartCommandLimiter:
+    """
+    Bounds the number of Kart processes that background tasks run
+    concurrently, and counts the commands run for each repository.
+
+    Commands run from the main thread never wait for a slot, so the UI is
+    not blocked by background work. Each command is still a new Kart
+    process. Setting HELPERMODE makes Kart forward them to its own long
+    lived helper process
+    """
+
+    _instance: Optional["KartCommandLimiter"] = None
+
+    @staticmethod
+    def instance() -> "KartCommandLimiter":
+        """
+        Returns the command limiter instance
+        """
+        if KartCommandLimiter._instance is None:
+            KartCommandLimiter._instance = KartCommandLimiter()
+
+        return KartCommandLimiter._instance
+
+    def __init__(self, maxConcurrent: int = MAX_CONCURRENT_COMMANDS):
+        self._commands: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxConcurrent)
+
+    @staticmethod
+    def _key(path: Optional[str]) -> str:
+        return os.path.normpath(path) if path else ""
+
+    def commandCount(self, path: Optional[str]) -> int:
+        """
+        Returns the number of commands run for a repository path
+        """
+        with self._lock:
+            return self._commands.get(self._key(path), 0)
+
+    def clear(self):
+        with self._lock:
+            self._commands.clear()
+
+    @contextmanager
+    def slot(self, path: Optional[str]):
+        """
+        Waits until a Kart command for the given repository path can run.
+        Commands from the main thread run right away
+        """
+        key = self._key(path)
+        mainThread = threading.current_thread() is threading.main_thread()
+        if not mainThread:
+            self._slots.acquire()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._commands[key] = self._commands.get(key, 0) + 1
+            if not mainThread:
+                self._slots.release()
@@ -0,0 +1,73 @@
+from typing import Dict, Iterable, List, Optional
+
+
+class CommitGraph:
+    """
+    Assigns commits to the lanes (columns) of a history graph from their
+    parent lists, in a single pass over the commits, newest first.
+
+    Each commit is annotated with a 'commitColumn' and a 'graph' dict with
+    the edges drawn in its row, as (fromColumn, toColumn) tuples:
+    'up' edges join the top of the row with the commit row center and
+    'down' edges join the center with the bottom of the row.
+
+    The lanes that are still open are kept between calls to add(), so the
+    graph can be extended as more pages of history are read.
+    """
+
+    def __init__(self):
+        # id of the commit that each lane is waiting for, None if free
+        self.lanes: List[Optional[str]] = []
+        self.maxColumn = 0
+
+    def _freeLane(self) -> int:
+        try:
+            return self.lanes.index(None)
+        except ValueError:
+            self.lanes.append(None)
+            return len(self.lanes) - 1
+
+    def add(self, commits: Iterable[Dict]):
+        for commit in commits:
+            self.addCommit(commit)
+
+    def addCommit(self, commit: Dict, parents: Optional[List[str]] = None):
+        """
+        Assigns a lane to a commit. 'parents' replaces the parents of the
+        commit in the graph, eg. with those of a simplified history
+        """
+        if parents is None:
+            parents = commit["parents"]
+        commitid = commit["commit"]
+        lanes = self.lanes
+        incoming = [i for i, lane in enumerate(lanes) if lane == commitid]
+        column = incoming[0] if incoming else self._freeLane()
+
+        up = []
+        for i, lane in enumerate(lanes):
+            if lane is None:
+                continue
+            up.append((i, column if lane == commitid else i))
+        for i in incoming:
+            lanes[i] = None
+
+        down = [(i, i) for i, lane in enumerate(lanes) if lane is not None]
+        for n, parent in enumerate(parents):
+            if parent in lanes:
+                target = lanes.index(parent)
+            elif n == 0:
+                target = column
+                lanes[column] = parent
+            else:
+                target = self._freeLane()
+                lanes[target] = parent
+            down.append((column, target))
+
+        while lanes and lanes[-1] is None:
+            lanes.pop()
+
+        commit["commitColumn"] = column
+        commit["graph"] = {"up": up, "down": down}
+        self.maxColumn = max(
+            [self.maxColumn, column] + [max(edge) for edge in up + down]
+        )
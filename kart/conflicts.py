@@ -0,0 +1,133 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+VERSIONS = ("ancestor", "ours", "theirs")
+
+# A conflict resolution, as accepted by Repository.resolveConflicts: a
+# version name or a GeoJSON feature
+Resolution = Union[str, Dict]
+
+
+def conflictLabel(dataset: str, fid: str) -> str:
+    return f"{dataset}:feature:{fid}"
+
+
+def solveAllWithVersion(conflicts: Dict, version: str) -> Dict[str, Resolution]:
+    """
+    Resolves all conflicts in a conflicts dict (as returned by
+    Repository.conflicts) using the given version
+    """
+    return {
+        conflictLabel(dataset, fid): version
+        for dataset, features in conflicts.items()
+        for fid in features
+    }
+
+
+def mergeConflict(label: str, conflict: Dict) -> Optional[Resolution]:
+    """
+    Merges the ours and theirs versions of a conflicted feature field by
+    field, taking the value from the version that changed it.
+
+    Returns None if a field was changed differently in both versions or
+    the feature was deleted in one of them, as those need a decision
+    """
+    ancestor, ours, theirs = (conflict[v] for v in VERSIONS)
+    if ancestor is None or ours is None or theirs is None:
+        return None
+
+    def _merged(a, o, t):
+        if o == a or o == t:
+            return True, t
+        if t == a:
+            return True, o
+        return False, None
+
+    ok, geometry = _merged(ancestor["geometry"], ours["geometry"], theirs["geometry"])
+    if not ok:
+        return None
+    properties = {}
+    names = dict.fromkeys(
+        [*ancestor["properties"], *ours["properties"], *theirs["properties"]]
+    )
+    for name in names:
+        ok, value = _merged(
+            ancestor["properties"].get(name),
+            ours["properties"].get(name),
+            theirs["properties"].get(name),
+        )
+        if not ok:
+            return None
+        properties[name] = value
+
+    # use a version name where possible, so it is resolved in bulk
+    for version in ("ours", "theirs"):
+        feature = conflict[version]
+        if feature["geometry"] == geometry and feature["properties"] == properties:
+            return version
+    return {
+        "type": "Feature",
+        "id": label,
+        "geometry": geometry,
+        "properties": properties,
+    }
+
+
+def groupConflicts(
+    versions: Iterable[Tuple[str, str, str, Dict]]
+) -> Iterator[Tuple[str, str, Dict]]:
+    """
+    Groups the (dataset, fid, version, feature) tuples yielded by
+    Repository.iterConflicts into (dataset, fid, conflict) tuples, with
+    conflicts in the same form as in Repository.conflicts.
+
+    Kart writes the versions of a conflict together, so only one conflict
+    is held in memory at a time
+    """
+    key = None
+    conflict = None
+    for dataset, fid, version, feature in versions:
+        if (dataset, fid) != key:
+            if key is not None:
+                yield (*key, conflict)
+            key = (dataset, fid)
+            conflict = {v: None for v in VERSIONS}
+        conflict[version] = feature
+    if key is not None:
+        yield (*key, conflict)
+
+
+def solveMerged(
+    conflicts: Iterable[Tuple[str, str, Dict]]
+) -> Tuple[Dict[str, Resolution], List[str]]:
+    """
+    Merges the fields of the (dataset, fid, conflict) tuples yielded by
+    groupConflicts, see mergeConflict.
+
+    Returns the resolutions and the labels of the conflicts that could not
+    be merged
+    """
+    resolved = {}
+    unresolved = []
+    for dataset, fid, conflict in conflicts:
+        label = conflictLabel(dataset, fid)
+        resolution = mergeConflict(label, conflict)
+        if resolution is None:
+            unresolved.append(label)
+        else:
+            resolved[label] = resolution
+    return resolved, unresolved
+
+
+def solveAllMerged(conflicts: Dict) -> Tuple[Dict[str, Resolution], List[str]]:
+    """
+    Merges the fields of all conflicts in a conflicts dict, see
+    mergeConflict.
+
+    Returns the resolutions and the labels of the conflicts that could not
+    be merged
+    """
+    return solveMerged(
+        (dataset, fid, conflict)
+        for dataset, features in conflicts.items()
+        for fid, conflict in features.items()
+    )
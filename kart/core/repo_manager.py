@@ -1,14 +1,21 @@
+import os
 from typing import (
     Optional,
-    List
+    List,
+    Dict,
+    Tuple
 )
+from urllib.parse import urlparse
 
 from qgis.PyQt.QtCore import (
     QObject,
     pyqtSignal
 )
 
-from qgis.core import QgsMapLayer
+from qgis.core import (
+    QgsMapLayer,
+    QgsDataSourceUri
+)
 
 from kart.utils import setting, setSetting
 
@@ -42,6 +49,12 @@ class RepoManager(QObject):
         super().__init__()
 
         self._repos: List[Repository] = []
+        # repos by normalised path and by postgres (database, schema), built
+        # when first needed
+        self._path_index: Optional[Dict[str, Repository]] = None
+        self._postgres_index: Dict[Tuple[str, str], Repository] = {}
+        # repo of each layer that has been looked up, by layer id
+        self._layer_repos: Dict[str, Optional[Repository]] = {}
 
         self.read_repos_from_settings()
 
@@ -59,6 +72,7 @@ class RepoManager(QObject):
                 repo = Repository(path)
                 if repo.isInitialized():
                     self._repos.append(repo)
+                    self.invalidate_index()
                     self.repo_added.emit(repo)
 
     def save_repos_to_settings(self):
@@ -73,6 +87,7 @@ class RepoManager(QObject):
         Adds a repository to the manager
         """
         self._repos.append(repo)
+        self.invalidate_index()
         self.save_repos_to_settings()
         self.repo_added.emit(repo)
 
@@ -84,6 +99,7 @@ class RepoManager(QObject):
             if r.path == repo.path:
                 self._repos.remove(r)
                 break
+        self.invalidate_index()
         self.save_repos_to_settings()
         self.repo_removed.emit(repo)
 
@@ -93,15 +109,68 @@ class RepoManager(QObject):
         """
         return self._repos
 
-    def repo_for_layer(self, layer: QgsMapLayer) -> Optional[Repository]:
+    def invalidate_index(self):
         """
-        Returns the repo matching a layer, or None if not found
+        Drops the location index and the cached repos of layers, so they
+        are computed again when needed
         """
-        try:
-            for repo in self._repos:
-                if repo.layerBelongsToRepo(layer):
-                    return repo
-        except KartException:
-            pass
+        self._path_index = None
+        self._postgres_index = {}
+        self._layer_repos = {}
 
+    def forget_layer(self, layer_id: str):
+        """
+        Removes the cached repo of a layer, eg. when it is removed from the
+        project
+        """
+        self._layer_repos.pop(layer_id, None)
+
+    @staticmethod
+    def _normalised_path(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _build_index(self):
+        self._path_index = {}
+        self._postgres_index = {}
+        for repo in self._repos:
+            try:
+                location = repo.workingCopyLocation()
+            except (KartException, KeyError):
+                continue
+            if location.lower().startswith("postgres"):
+                parse = urlparse(location)
+                database, schema = parse.path.strip("/").split("/", 1)
+                self._postgres_index[(database, schema)] = repo
+            else:
+                self._path_index[self._normalised_path(repo.path)] = repo
+
+    def _lookup_repo(self, layer: QgsMapLayer) -> Optional[Repository]:
+        if self._path_index is None:
+            self._build_index()
+        if layer.providerType() == "postgres":
+            uri = QgsDataSourceUri(layer.source())
+            return self._postgres_index.get((uri.database(), uri.schema()))
+        source = layer.source().split("|")[0]
+        if not os.path.isabs(source):
+            return None
+        # the working copy of a repo is inside its folder, so look for a
+        # repo in each of the folders containing the layer file
+        path = self._normalised_path(source)
+        parent = os.path.dirname(path)
+        while parent != path:
+            if parent in self._path_index:
+                return self._path_index[parent]
+            path, parent = parent, os.path.dirname(parent)
         return None
+
+    def repo_for_layer(self, layer: QgsMapLayer) -> Optional[Repository]:
+        """
+        Returns the repo matching a layer, or None if not found.
+
+        Results are cached per layer id, and only cost a few dictionary
+        lookups for layers not seen before
+        """
+        layer_id = layer.id()
+        if layer_id not in self._layer_repos:
+            self._layer_repos[layer_id] = self._lookup_repo(layer)
+        return self._layer_repos[layer_id]
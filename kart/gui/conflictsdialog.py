@@ -5,20 +5,27 @@ from qgis.core import Qgis
 from qgis.gui import QgsMessageBar
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import QSize, Qt
+from qgis.PyQt.QtCore import Qt, QAbstractItemModel, QModelIndex, pyqtSignal
 from qgis.PyQt.QtGui import QFont
 from qgis.PyQt.QtWidgets import (
     QDialog,
-    QTreeWidgetItem,
     QMessageBox,
     QTableWidgetItem,
     QHeaderView,
     QSizePolicy,
-    QTreeWidgetItemIterator,
 )
 
 from kart.gui import icons
+from kart.kartapi import executeskart, runAndWait, runInBackground
+from kart.conflicts import (
+    conflictLabel,
+    groupConflicts,
+    solveAllWithVersion,
+    solveMerged,
+)
 
+# Number of conflicted features added to the tree each time more are needed
+CONFLICTS_PAGE_SIZE = 500
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "conflictsdialog.ui")
@@ -26,10 +33,16 @@ WIDGET, BASE = uic.loadUiType(
 
 
 class ConflictsDialog(BASE, WIDGET):
-    def __init__(self, conflicts):
+    def __init__(self, repo, summary):
+        """
+        'summary' is the dict of conflicted feature ids per dataset returned
+        by Repository.conflictsSummary. The conflicted versions of the
+        features of a dataset are read in the background when it is expanded
+        """
         super(QDialog, self).__init__(iface.mainWindow())
         self.okToMerge = False
-        self.conflicts = conflicts
+        self.repo = repo
+        self.summary = summary
         self.setupUi(self)
 
         self.bar = QgsMessageBar()
@@ -39,12 +52,19 @@ class ConflictsDialog(BASE, WIDGET):
         self.resize(1024, 768)
 
         self.resolvedFeatures = {}
+        self.readTasks = []
 
         self.tableAttributes.setSortingEnabled(False)
-        self.treeConflicts.itemClicked.connect(self.updateFromCurrentSelectedItem)
+        self.conflictsModel = ConflictsModel(self._readConflicts)
+        self.treeConflicts.setModel(self.conflictsModel)
+        self.treeConflicts.selectionModel().currentChanged.connect(
+            self.updateFromCurrentSelectedItem
+        )
         self.tableAttributes.cellClicked.connect(self.cellClicked)
         self.btnSolveAllOurs.clicked.connect(self.solveAllOurs)
         self.btnSolveAllTheirs.clicked.connect(self.solveAllTheirs)
+        self.btnSolveAllAncestor.clicked.connect(self.solveAllAncestor)
+        self.btnSolveAllMerged.clicked.connect(self.solveAllWithMergedFields)
         self.btnSolveOurs.clicked.connect(self.solveOurs)
         self.btnSolveTheirs.clicked.connect(self.solveTheirs)
         self.btnSolveFeature.clicked.connect(self.solveFeature)
@@ -57,33 +77,41 @@ class ConflictsDialog(BASE, WIDGET):
         self.btnSolveOurs.setEnabled(False)
         self.btnSolveTheirs.setEnabled(False)
 
-        self.fillConflictsTree()
-        self.treeConflicts.expandToDepth(3)
+        self.conflictsModel.setSummary(summary)
 
         self.autoSelectFirstConflict()
 
+    def _readConflicts(self, item):
+        def _conflictsRead(conflicts):
+            self.conflictsModel.setConflicts(item, conflicts.get(item.dataset, {}))
+            if not self.treeConflicts.currentIndex().isValid():
+                self.autoSelectFirstConflict()
+
+        def _conflictsFailed(e):
+            self.conflictsModel.setConflictsFailed(item)
+            self.bar.pushMessage(
+                "", f"Could not read conflicts of {item.dataset}: {e}", Qgis.Warning
+            )
+
+        task = runInBackground(
+            "Reading merge conflicts",
+            self.repo.conflicts,
+            item.dataset,
+            onResult=_conflictsRead,
+            onError=_conflictsFailed,
+        )
+        self.readTasks.append(task)
+
     def autoSelectFirstConflict(self):
-        iterator = QTreeWidgetItemIterator(self.treeConflicts)
-        while iterator.value():
-            item = iterator.value()
-            if isinstance(item, ConflictItem):
-                self.treeConflicts.setCurrentItem(item)
-                self.updateFromCurrentSelectedItem()
-                return
-            iterator += 1
-
-    def fillConflictsTree(self):
-        self.treeItems = {}
-        for path, conflicts in self.conflicts.items():
-            topItem = QTreeWidgetItem()
-            topItem.setText(0, path)
-            topItem.setIcon(0, icons.layerIcon)
-            self.treeConflicts.addTopLevelItem(topItem)
-            self.treeItems[path] = {}
-            for fid, conflict in conflicts.items():
-                conflictItem = ConflictItem(path, fid, conflict)
-                topItem.addChild(conflictItem)
-                self.treeItems[path][fid] = conflictItem
+        model = self.conflictsModel
+        if not model.rowCount():
+            return
+        datasetIndex = model.index(0, 0)
+        self.treeConflicts.expand(datasetIndex)
+        if model.canFetchMore(datasetIndex):
+            model.fetchMore(datasetIndex)
+        if model.rowCount(datasetIndex):
+            self.treeConflicts.setCurrentIndex(model.index(0, 0, datasetIndex))
 
     def cellClicked(self, row, col):
         if col > 2:
@@ -93,9 +121,9 @@ class ConflictsDialog(BASE, WIDGET):
         finalItem.setValue(item.value)
 
     def updateFromCurrentSelectedItem(self):
-        if not self.treeConflicts.selectedItems():
+        item = self.conflictsModel.item(self.treeConflicts.currentIndex())
+        if item is None:
             return
-        item = self.treeConflicts.selectedItems()[0]
 
         self.lastSelectedItem = item
         if isinstance(item, ConflictItem):
@@ -116,26 +144,81 @@ class ConflictsDialog(BASE, WIDGET):
             self.btnSolveFeature.setEnabled(False)
 
     def solveAllOurs(self):
+        self._solveAllWithVersion("ours")
+
+    def solveAllTheirs(self):
+        self._solveAllWithVersion("theirs")
+
+    def solveAllAncestor(self):
+        self._solveAllWithVersion("ancestor")
+
+    def _solveAllWithVersion(self, version):
         ret = QMessageBox.warning(
             self,
             "Solve conflicts",
-            "Are you sure you want to solve all conflicts using the 'ours' version?",
+            "Are you sure you want to solve all conflicts using the "
+            f"'{version}' version?",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.Yes,
         )
         if ret == QMessageBox.Yes:
-            pass
+            self._solveAll(solveAllWithVersion(self.summary, version))
 
-    def solveAllTheirs(self):
+    def _mergeAllConflicts(self):
+        # conflicts are merged as they are read, one at a time
+        return solveMerged(groupConflicts(self.repo.iterConflicts()))
+
+    def solveAllWithMergedFields(self):
         ret = QMessageBox.warning(
             self,
             "Solve conflicts",
-            "Are you sure you want to solve all conflicts using the 'theirs' version?",
+            "Are you sure you want to solve all conflicts by merging the fields "
+            "changed in each version?",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.Yes,
         )
         if ret == QMessageBox.Yes:
-            pass
+            self._solveAllMerged()
+
+    @executeskart
+    def _solveAllMerged(self):
+        resolved, unresolved = runAndWait("Merging conflicts", self._mergeAllConflicts)
+        unresolved = [
+            label for label in unresolved if label not in self.resolvedFeatures
+        ]
+        self._solveAll(resolved)
+        if unresolved:
+            self.bar.pushMessage(
+                "",
+                f"{len(unresolved)} conflicts have fields changed in both versions "
+                "and must be solved manually",
+                Qgis.Warning,
+            )
+
+    def _solveAll(self, resolved):
+        """
+        Adds resolutions for all conflicts not solved yet, and removes them
+        from the tree
+        """
+        for label, resolution in resolved.items():
+            if label not in self.resolvedFeatures:
+                self.resolvedFeatures[label] = resolution
+        self.conflictsModel.removeConflicts(self.resolvedFeatures)
+        if not self.conflictsModel.rowCount():
+            self._allConflictsSolved()
+        else:
+            self.autoSelectFirstConflict()
+
+    def _allConflictsSolved(self):
+        QMessageBox.warning(
+            self,
+            "Solve conflicts",
+            "All conflicts are solved. The merge operation will now be closed",
+            QMessageBox.Ok,
+            QMessageBox.Ok,
+        )
+        self.okToMerge = True
+        self.close()
 
     def solveFeature(self):
         conflict = self.lastSelectedItem.conflict
@@ -171,42 +254,25 @@ class ConflictsDialog(BASE, WIDGET):
         self.updateAfterSolvingCurrentItem()
 
     def updateAfterSolvingCurrentItem(self):
-        parent = self.lastSelectedItem.parent()
-        parent.removeChild(self.lastSelectedItem)
-        if not parent.childCount():
-            idx = self.treeConflicts.indexOfTopLevelItem(parent)
-            self.treeConflicts.takeTopLevelItem(idx)
-            if not self.treeConflicts.topLevelItemCount():
-                QMessageBox.warning(
-                    self,
-                    "Solve conflicts",
-                    "All conflicts are solved. The merge operation will now be closed",
-                    QMessageBox.Ok,
-                    QMessageBox.Ok,
-                )
-                self.okToMerge = True
-                self.close()
-                return
+        self.conflictsModel.removeConflict(
+            self.lastSelectedItem.path, self.lastSelectedItem.fid
+        )
+        if not self.conflictsModel.rowCount():
+            self._allConflictsSolved()
+            return
 
-        self.treeConflicts.setCurrentItem(self.treeConflicts.topLevelItem(0))
-        self.updateFromCurrentSelectedItem()
+        self.autoSelectFirstConflict()
 
     def solveOurs(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["ours"])
-        feature[
-            "id"
-        ] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("ours")
 
     def solveTheirs(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["theirs"])
-        feature[
-            "id"
-        ] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
+        self._solveWithVersion("theirs")
+
+    def _solveWithVersion(self, version):
+        # versions are resolved in bulk by Repository.resolveConflicts
+        label = conflictLabel(self.lastSelectedItem.path, self.lastSelectedItem.fid)
+        self.resolvedFeatures[label] = version
         self.updateAfterSolvingCurrentItem()
 
     def solveWithDeleted(self):
@@ -216,22 +282,10 @@ class ConflictsDialog(BASE, WIDGET):
 
     def solveWithModified(self):
         conflict = self.lastSelectedItem.conflict
-        feature = conflict["ours"] or conflict["theirs"]
-        feature = dict(feature)
-        feature[
-            "id"
-        ] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("ours" if conflict["ours"] else "theirs")
 
     def solveWithAncestor(self):
-        conflict = self.lastSelectedItem.conflict
-        feature = dict(conflict["ancestor"])
-        feature[
-            "id"
-        ] = f"{self.lastSelectedItem.path}:feature:{self.lastSelectedItem.fid}"
-        self.resolvedFeatures[feature["id"]] = feature
-        self.updateAfterSolvingCurrentItem()
+        self._solveWithVersion("ancestor")
 
     def showSolveDeleted(self):
         self.stackedWidget.setCurrentWidget(self.pageSolveWithDeleted)
@@ -297,8 +351,10 @@ class ConflictsDialog(BASE, WIDGET):
             )
             if ret == QMessageBox.No:
                 evnt.ignore()
-            else:
-                self.resolvedFeatures = None
+                return
+            self.resolvedFeatures = None
+        for task in self.readTasks:
+            task.stop()
 
 
 class ValueItem(QTableWidgetItem):
@@ -341,12 +397,227 @@ class FinalValueItem(QTableWidgetItem):
         self.setBackground(Qt.white)
 
 
-class ConflictItem(QTreeWidgetItem):
+class ConflictItem:
     def __init__(self, path, fid, conflict):
-        QTreeWidgetItem.__init__(self)
-        self.setText(0, fid)
-        self.setIcon(0, icons.featureIcon)
-        self.setSizeHint(0, QSize(self.sizeHint(0).width(), 25))
         self.conflict = conflict
         self.fid = fid
         self.path = path
+
+
+class DatasetConflicts:
+    """
+    The conflicted features of a dataset. Their versions are read the first
+    time the dataset is expanded
+    """
+
+    def __init__(self, dataset, fids):
+        self.dataset = dataset
+        self.fids = fids
+        self.conflicts = None
+        self.fetched = 0
+        self.loading = False
+        self.failed = False
+        # ConflictItems of the fetched rows, by fid
+        self.items = {}
+
+    def item(self, row):
+        fid = self.fids[row]
+        item = self.items.get(fid)
+        if item is None:
+            item = ConflictItem(self.dataset, fid, self.conflicts[fid])
+            self.items[fid] = item
+        return item
+
+    def remove(self, fid):
+        self.items.pop(fid, None)
+        if self.conflicts is not None:
+            self.conflicts.pop(fid, None)
+
+
+class ConflictsModel(QAbstractItemModel):
+    """
+    Tree model of dataset > conflicted feature.
+
+    The internal pointer of each index is the DatasetConflicts holding it
+    (the model itself for top level dataset rows). Feature rows are added
+    in pages through canFetchMore/fetchMore.
+
+    'readConflicts' is called with a DatasetConflicts the first time more of
+    its rows are needed. It must read them without blocking, and pass them
+    to setConflicts (or call setConflictsFailed) once done. conflictsRead is
+    emitted with the name of the dataset then
+    """
+
+    conflictsRead = pyqtSignal(str)
+
+    def __init__(self, readConflicts):
+        super().__init__()
+        self.readConflicts = readConflicts
+        self.datasets = []
+
+    def setSummary(self, summary):
+        self.beginResetModel()
+        self.datasets = [
+            DatasetConflicts(dataset, list(fids))
+            for dataset, fids in summary.items()
+            if fids
+        ]
+        self.endResetModel()
+
+    def item(self, index):
+        """
+        Returns the DatasetConflicts or ConflictItem at an index
+        """
+        if not index.isValid():
+            return None
+        parent = index.internalPointer()
+        row = index.row()
+        if parent is self:
+            return self.datasets[row] if 0 <= row < len(self.datasets) else None
+        elif 0 <= row < parent.fetched:
+            return parent.item(row)
+        return None
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        parentItem = self.item(parent)
+        if parentItem is None:
+            return self.createIndex(row, column, self)
+        return self.createIndex(row, column, parentItem)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parentItem = index.internalPointer()
+        if parentItem is self:
+            return QModelIndex()
+        return self.createIndex(self.datasets.index(parentItem), 0, self)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        item = self.item(parent)
+        if item is None:
+            return len(self.datasets)
+        elif isinstance(item, DatasetConflicts):
+            return item.fetched
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        item = self.item(parent)
+        if item is None:
+            return bool(self.datasets)
+        return isinstance(item, DatasetConflicts) and bool(item.fids)
+
+    def canFetchMore(self, parent):
+        item = self.item(parent)
+        return (
+            isinstance(item, DatasetConflicts)
+            and not item.loading
+            and not item.failed
+            and item.fetched < len(item.fids)
+        )
+
+    def fetchMore(self, parent):
+        item = self.item(parent)
+        if not isinstance(item, DatasetConflicts) or item.loading or item.failed:
+            return
+        if item.conflicts is None:
+            item.loading = True
+            self.readConflicts(item)
+            return
+        self._addPage(parent, item)
+
+    def _addPage(self, parent, item):
+        count = min(CONFLICTS_PAGE_SIZE, len(item.fids) - item.fetched)
+        if count > 0:
+            self.beginInsertRows(parent, item.fetched, item.fetched + count - 1)
+            item.fetched += count
+            self.endInsertRows()
+
+    def setConflicts(self, item, conflicts):
+        """
+        Adds the first page of rows of a dataset, once its conflicts are read
+        """
+        item.loading = False
+        if item in self.datasets:
+            item.conflicts = conflicts
+            self._addConflicts(item)
+        # otherwise all its conflicts were solved meanwhile
+        self.conflictsRead.emit(item.dataset)
+
+    def _addConflicts(self, item):
+        fids = [fid for fid in item.fids if fid in item.conflicts]
+        if len(fids) < len(item.fids):
+            self.beginResetModel()
+            item.fids = fids
+            self.datasets = [d for d in self.datasets if d.fids]
+            self.endResetModel()
+            if item not in self.datasets:
+                return
+        self._addPage(self.index(self.datasets.index(item), 0), item)
+
+    def setConflictsFailed(self, item):
+        item.loading = False
+        item.failed = True
+        self.conflictsRead.emit(item.dataset)
+
+    def removeConflict(self, dataset, fid):
+        for row, item in enumerate(self.datasets):
+            if item.dataset == dataset:
+                break
+        else:
+            return
+        if len(item.fids) == 1:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.datasets[row]
+            self.endRemoveRows()
+            return
+        featureRow = item.fids.index(fid)
+        if featureRow < item.fetched:
+            parent = self.index(row, 0)
+            self.beginRemoveRows(parent, featureRow, featureRow)
+            del item.fids[featureRow]
+            item.fetched -= 1
+            self.endRemoveRows()
+        else:
+            del item.fids[featureRow]
+        item.remove(fid)
+
+    def removeConflicts(self, labels):
+        """
+        Removes all conflicts with the given labels (dataset:feature:fid)
+        """
+        self.beginResetModel()
+        for item in self.datasets:
+            fids = []
+            fetched = 0
+            for row, fid in enumerate(item.fids):
+                if conflictLabel(item.dataset, fid) in labels:
+                    item.remove(fid)
+                else:
+                    fids.append(fid)
+                    if row < item.fetched:
+                        fetched += 1
+            item.fids = fids
+            item.fetched = fetched
+        self.datasets = [item for item in self.datasets if item.fids]
+        self.endResetModel()
+
+    def data(self, index, role=Qt.DisplayRole):
+        item = self.item(index)
+        if item is None:
+            return None
+        if role == Qt.DisplayRole:
+            if isinstance(item, DatasetConflicts):
+                return item.dataset
+            return item.fid
+        elif role == Qt.DecorationRole:
+            if isinstance(item, DatasetConflicts):
+                return icons.layerIcon
+            return icons.featureIcon
+        return None
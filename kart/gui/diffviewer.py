@@ -5,15 +5,13 @@ import json
 import difflib
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import Qt, pyqtSignal
+from qgis.PyQt.QtCore import Qt, pyqtSignal, QAbstractItemModel, QModelIndex
 from qgis.PyQt.QtGui import QColor, QBrush
 from qgis.PyQt.QtWidgets import (
     QVBoxLayout,
     QTableWidgetItem,
     QHeaderView,
-    QTreeWidgetItem,
     QDialog,
-    QTreeWidgetItemIterator,
     QSizePolicy,
 )
 
@@ -29,6 +27,7 @@ from qgis.core import (
     QgsGeometry,
     QgsPointXY,
     QgsWkbTypes,
+    QgsReferencedRectangle,
 )
 
 from qgis.utils import iface
@@ -37,10 +36,22 @@ from qgis.gui import QgsMapCanvas, QgsMessageBar, QgsMapToolPan
 from .mapswipetool import MapSwipeTool
 
 from kart.gui import icons
+from kart.kartapi import (
+    KartCanceledException,
+    executeskart,
+    iterInBackground,
+    runAndWait,
+)
+from kart.streaming import diffRecordsFromDict, DiffRecord
 from kart.utils import setting, DIFFSTYLES
 
 ADDED, MODIFIED, REMOVED, UNCHANGED = 0, 1, 2, 3
 
+# Number of changed features added to the tree each time more are needed
+FEATURES_PAGE_SIZE = 500
+# Number of geometries converted and added to the diff layers at once
+GEOMETRY_BATCH_SIZE = 10000
+
 PROJECT_LAYERS = 0
 OSM_BASEMAP = 1
 NO_LAYERS = 2
@@ -65,7 +76,9 @@ WIDGET, BASE = uic.loadUiType(
 
 
 class DiffViewerDialog(QDialog):
-    def __init__(self, parent, diff, repo, showRecoverNewButton=True):
+    def __init__(
+        self, parent, diff, repo, showRecoverNewButton=True, changeCounts=None
+    ):
         super(QDialog, self).__init__(parent)
         self.setWindowFlags(Qt.Window)
         layout = QVBoxLayout()
@@ -73,7 +86,7 @@ class DiffViewerDialog(QDialog):
         self.bar = QgsMessageBar()
         self.bar.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
         layout.addWidget(self.bar)
-        self.history = DiffViewerWidget(diff, repo, showRecoverNewButton)
+        self.history = DiffViewerWidget(diff, repo, showRecoverNewButton, changeCounts)
         self.history.workingLayerChanged.connect(self.workingLayerChanged)
         layout.addWidget(self.history)
         self.setLayout(layout)
@@ -84,17 +97,35 @@ class DiffViewerDialog(QDialog):
         self.bar.pushMessage("Diff", "Working copy has been updated", Qgis.Success, 5)
 
     def closeEvent(self, evt):
+        self.history.stopReading()
         self.history.removeMapLayers()
         evt.accept()
 
+    def done(self, result):
+        # closing with Esc doesn't go through closeEvent
+        self.history.stopReading()
+        super().done(result)
+
 
 class DiffViewerWidget(WIDGET, BASE):
 
     workingLayerChanged = pyqtSignal()
 
-    def __init__(self, diff, repo, showRecoverNewButton):
+    def __init__(self, diff, repo, showRecoverNewButton, changeCounts=None):
+        """
+        diff can be a dict as returned by Repository.diff(), or an iterable
+        of DiffRecords, such as the stream returned by Repository.diffStream().
+        The latter is read in the background, adding the changed features to
+        the tree as they arrive
+
+        If changeCounts is given (as returned by
+        StatusSnapshot.featureChangeCounts()), only those counts are shown at
+        first, and diff is a function returning the diff of a single dataset,
+        called when the user expands or selects it
+        """
         super(DiffViewerWidget, self).__init__()
         self.diff = diff
+        self.changeCounts = changeCounts
         self.repo = repo
         self.oldLayer = None
         self.newLayer = None
@@ -107,6 +138,8 @@ class DiffViewerWidget(WIDGET, BASE):
         self.workingCopyLayers = {}
         self.workingCopyLayersIdFields = {}
         self.workingCopyLayerCrs = {}
+        self.datasetNodes = {}
+        self.readTask = None
 
         self.mostRecentTabIndex = None
 
@@ -131,7 +164,10 @@ class DiffViewerWidget(WIDGET, BASE):
         self.comboAdditionalLayers.currentIndexChanged.connect(self.fillCanvas)
         self.btnRecoverOldVersion.clicked.connect(self.recoverOldVersion)
         self.btnRecoverNewVersion.clicked.connect(self.recoverNewVersion)
-        self.featuresTree.currentItemChanged.connect(self.treeItemChanged)
+        self.featuresModel = DiffTreeModel()
+        self.featuresTree.setModel(self.featuresModel)
+        self.featuresTree.selectionModel().currentChanged.connect(self.treeIndexChanged)
+        self.featuresTree.expanded.connect(self.treeIndexExpanded)
         self.featuresTree.header().hide()
 
         self.featuresTree.header().setStretchLastSection(True)
@@ -141,32 +177,59 @@ class DiffViewerWidget(WIDGET, BASE):
         self.selectFirstChangedFeature()
 
     def selectFirstChangedFeature(self):
-        iterator = QTreeWidgetItemIterator(self.featuresTree)
-        while iterator.value():
-            item = iterator.value()
-            if isinstance(item, FeatureItem):
-                self.featuresTree.setCurrentItem(item)
-                return
-            iterator += 1
+        model = self.featuresModel
+        if model.rowCount() and not self.featuresTree.currentIndex().isValid():
+            datasetIndex = model.index(0, 0)
+            groupIndex = model.index(0, 0, datasetIndex)
+            self.featuresTree.setCurrentIndex(model.index(0, 0, groupIndex))
 
     def _hasGeometry(self, item):
-        if isinstance(item, FeatureItem):
+        if isinstance(item, DiffRecord):
             old = self.currentFeatureItem.old
             new = self.currentFeatureItem.new
             ref = old or new
             return ref["geometry"] is not None
+        elif item.dataset not in self.layerDiffLayers:
+            # a dataset without changed features
+            return False
         else:
             oldLayer, newLayer = self.layerDiffLayers[item.dataset]
             return oldLayer.wkbType() != QgsWkbTypes.NoGeometry
 
-    def treeItemChanged(self, current, previous):
+    def treeIndexChanged(self, current, previous):
+        self._loadDataset(current)
+        self.treeItemChanged(self.featuresModel.node(current))
+
+    def treeIndexExpanded(self, index):
+        self._loadDataset(index)
+
+    @executeskart
+    def _loadDataset(self, index):
+        """
+        Reads the changed features of a dataset shown only by its change
+        counts so far
+        """
+        node = self.featuresModel.node(index)
+        if not isinstance(node, DatasetNode) or node.loaded:
+            return
+        diff = runAndWait(
+            f"Computing changes in dataset '{node.dataset}'", self.diff, node.dataset
+        )
+        if isinstance(diff, dict):
+            diff = diffRecordsFromDict(diff)
+        self._readRecords(diff, self.datasetNodes)
+        self._createSpatialIndexes([node.dataset])
+        self.featuresModel.datasetLoaded(index)
+        self._expandGroups(index)
+
+    def treeItemChanged(self, current):
         self.grpTransparency.setVisible(True)
         self.canvasWidget.setVisible(True)
         self.widgetDiffConfig.setVisible(True)
         self.tabWidget.setTabEnabled(TAB_GEOMETRY, True)
         self.tabWidget.setTabEnabled(TAB_ATTRIBUTES, True)
         self.tabWidget.setCurrentIndex(self.mostRecentTabIndex or TAB_ATTRIBUTES)
-        if isinstance(current, FeatureItem):
+        if isinstance(current, DiffRecord):
             self.currentFeatureItem = current
             self.currentDatasetItem = None
             self.fillAttributesDiff()
@@ -180,7 +243,7 @@ class DiffViewerWidget(WIDGET, BASE):
                 self.fillCanvas()
             else:
                 self.tabWidget.setTabEnabled(TAB_GEOMETRY, False)
-        elif isinstance(current, DatasetItem):
+        elif isinstance(current, DatasetNode):
             self.currentFeatureItem = None
             self.currentDatasetItem = current
             self.removeMapLayers()
@@ -292,97 +355,127 @@ class DiffViewerWidget(WIDGET, BASE):
             header.setSectionResizeMode(column, QHeaderView.Interactive)
 
     def fillTree(self):
-        self.featuresTree.clear()
-        for dataset, changes in self.diff.items():
-            if dataset not in self.workingCopyLayerCrs:
-                self.workingCopyLayerCrs[dataset] = self.repo.workingCopyLayerCrs(
-                    dataset
+        self.stopReading()
+        self.datasetNodes = {}
+        if self.changeCounts is not None:
+            _, tables = self.repo.datasets()
+            for dataset, counts in self.changeCounts.items():
+                self.datasetNodes[dataset] = DatasetNode(
+                    dataset, dataset in tables, counts
                 )
-            crs = self.workingCopyLayerCrs[dataset]
-            datasetItem = DatasetItem(dataset, crs is None)
-            addedItem = QTreeWidgetItem()
-            addedItem.setText(0, "Added")
-            addedItem.setIcon(0, icons.addedIcon)
-            removedItem = QTreeWidgetItem()
-            removedItem.setText(0, "Removed")
-            removedItem.setIcon(0, icons.removeIcon)
-            modifiedItem = QTreeWidgetItem()
-            modifiedItem.setText(0, "Modified")
-            modifiedItem.setIcon(0, icons.modifiedIcon)
-
-            subItems = {"I": addedItem, "U": modifiedItem, "D": removedItem}
-            changes = {feat["id"]: feat for feat in changes}
-            usedids = []
-            for feat in changes.values():
-                # Try to parse the feature id string in the old format first
-                # and if that fails try the new format. The old format is
-                # the change type and numeric id, eg.
-                # 'U-::49'
-                # whereas the new format additionally includes the dataset name
-                # and element type eg.
-                # 'nz_pipelines:feature:49:U-'
-                # TODO - remove support for 'old' format, requires users to have upgraded
-                #  this plugin first
-                is_new_id_format = False
-                elementtype = None
-                try:
-                    changetype, featid = feat["id"].split("::")
-                except ValueError:
-                    _, elementtype, featid, changetype = feat["id"].split(":")
-                    is_new_id_format = True
-                changetype = changetype[0]
-                if featid not in usedids:
-                    if changetype == "I":
-                        old = {}
-                        new = feat
-                    elif changetype == "D":
-                        old = feat
-                        new = {}
-                    else:
-                        if is_new_id_format:
-                            old = changes[f"{dataset}:{elementtype}:{featid}:U-"]
-                            new = changes[f"{dataset}:{elementtype}:{featid}:U+"]
-                        else:
-                            old = changes[f"U-::{featid}"]
-                            new = changes[f"U+::{featid}"]
-                    usedids.append(featid)
-                    item = FeatureItem(featid, old, new, dataset)
-                    subItems[changetype].addChild(item)
-                if dataset not in self.layerDiffLayers:
-                    ref = new or old
-                    geom = ref["geometry"]
-                    if geom is not None:
-                        geomtype = geom["type"]
-                        oldLayer = QgsVectorLayer(
-                            f"{geomtype}?crs={crs}", "old", "memory"
-                        )
-                        newLayer = QgsVectorLayer(
-                            f"{geomtype}?crs={crs}", "new", "memory"
-                        )
-                    else:
-                        oldLayer = QgsVectorLayer("None", "old", "memory")
-                        newLayer = QgsVectorLayer("None", "new", "memory")
-                    self.layerDiffLayers[dataset] = (oldLayer, newLayer)
-
-                if old and old["geometry"] is not None:
-                    oldFeature = QgsFeature()
-                    oldFeature.setGeometry(self._geomFromGeojson(old))
-                    oldLayer.dataProvider().addFeatures([oldFeature])
-                if new and new["geometry"] is not None:
-                    newFeature = QgsFeature()
-                    newFeature.setGeometry(self._geomFromGeojson(new))
-                    newLayer.dataProvider().addFeatures([newFeature])
-            for subItem in subItems.values():
-                if subItem.childCount():
-                    datasetItem.addChild(subItem)
-            if datasetItem.childCount():
-                self.featuresTree.addTopLevelItem(datasetItem)
+        elif isinstance(self.diff, dict):
+            self._readRecords(diffRecordsFromDict(self.diff), self.datasetNodes)
+            self._createSpatialIndexes(self.datasetNodes)
+        else:
+            self.readTask = iterInBackground(
+                "Reading changes",
+                iter,
+                self.diff,
+                onBatch=self._recordsRead,
+                onResult=self._readingFinished,
+                onError=self._readingFailed,
+            )
+        self.featuresModel.setDatasets(list(self.datasetNodes.values()))
 
         self.attributesTable.clear()
         self.attributesTable.verticalHeader().hide()
         self.attributesTable.horizontalHeader().hide()
 
-        self.featuresTree.expandAll()
+        self._expandDatasets()
+
+    def _expandDatasets(self):
+        model = self.featuresModel
+        for row in range(model.rowCount()):
+            datasetIndex = model.index(row, 0)
+            if model.node(datasetIndex).loaded:
+                self.featuresTree.setExpanded(datasetIndex, True)
+                self._expandGroups(datasetIndex)
+
+    def _expandGroups(self, datasetIndex):
+        # expanding change type groups only shows their first page of features
+        model = self.featuresModel
+        for groupRow in range(model.rowCount(datasetIndex)):
+            groupIndex = model.index(groupRow, 0, datasetIndex)
+            if (
+                model.canFetchMore(groupIndex)
+                and model.node(groupIndex).fetched < FEATURES_PAGE_SIZE
+            ):
+                model.fetchMore(groupIndex)
+            self.featuresTree.setExpanded(groupIndex, True)
+
+    def _recordsRead(self, records):
+        self._readRecords(records, self.datasetNodes)
+        self.featuresModel.recordsAdded(list(self.datasetNodes.values()))
+        self._expandDatasets()
+        self.selectFirstChangedFeature()
+
+    def _readingFinished(self, count):
+        self.readTask = None
+        self._createSpatialIndexes(self.datasetNodes)
+
+    def _readingFailed(self, ex):
+        self.readTask = None
+        if not isinstance(ex, KartCanceledException):
+            iface.messageBar().pushMessage(
+                "Diff", f"Changes could not be read: {ex}", level=Qgis.Warning
+            )
+
+    def stopReading(self):
+        """
+        Cancels reading the changes in the background, if still running
+        """
+        if self.readTask is not None:
+            self.readTask.stop()
+            self.readTask = None
+
+    def _createSpatialIndexes(self, datasets):
+        for dataset in datasets:
+            if dataset in self.layerDiffLayers:
+                oldLayer, newLayer = self.layerDiffLayers[dataset]
+                if oldLayer.wkbType() != QgsWkbTypes.NoGeometry:
+                    oldLayer.dataProvider().createSpatialIndex()
+                    newLayer.dataProvider().createSpatialIndex()
+
+    def _readRecords(self, records, datasets):
+        """
+        Adds diff records to the nodes of their datasets in 'datasets',
+        creating the missing ones, and their geometries to the diff layers
+        """
+        # GeoJSON geometries of each dataset, not yet added to its diff layers
+        geometries = {}
+        for record in records:
+            dataset = record.dataset
+            if dataset not in self.workingCopyLayerCrs:
+                self.workingCopyLayerCrs[dataset] = self.repo.workingCopyLayerCrs(
+                    dataset
+                )
+            crs = self.workingCopyLayerCrs[dataset]
+            if dataset not in datasets:
+                datasets[dataset] = DatasetNode(dataset, crs is None)
+            datasets[dataset].addRecord(record)
+            old, new = record.old, record.new
+            if dataset not in self.layerDiffLayers:
+                ref = new or old
+                geom = ref["geometry"]
+                if geom is not None:
+                    geomtype = geom["type"]
+                    oldLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "old", "memory")
+                    newLayer = QgsVectorLayer(f"{geomtype}?crs={crs}", "new", "memory")
+                else:
+                    oldLayer = QgsVectorLayer("None", "old", "memory")
+                    newLayer = QgsVectorLayer("None", "new", "memory")
+                self.layerDiffLayers[dataset] = (oldLayer, newLayer)
+            oldGeoms, newGeoms = geometries.setdefault(dataset, ([], []))
+            if old and old["geometry"] is not None:
+                oldGeoms.append(old["geometry"])
+            if new and new["geometry"] is not None:
+                newGeoms.append(new["geometry"])
+            if len(oldGeoms) + len(newGeoms) >= GEOMETRY_BATCH_SIZE:
+                self._addDiffGeometries(dataset, oldGeoms, newGeoms)
+                geometries[dataset] = ([], [])
+
+        for dataset, (oldGeoms, newGeoms) in geometries.items():
+            self._addDiffGeometries(dataset, oldGeoms, newGeoms)
 
     def fillCanvas(self):
         layers = []
@@ -462,6 +555,13 @@ class DiffViewerWidget(WIDGET, BASE):
         self.oldLayer.setOpacity((100 - self.sliderTransparency.value()) / 100)
         self.canvas.refresh()
 
+    def _addDiffGeometries(self, dataset, oldGeoms, newGeoms):
+        oldLayer, newLayer = self.layerDiffLayers[dataset]
+        if oldGeoms:
+            oldLayer.dataProvider().addFeatures(_featuresFromGeometries(oldGeoms))
+        if newGeoms:
+            newLayer.dataProvider().addFeatures(_featuresFromGeometries(newGeoms))
+
     def _geomFromGeojson(self, geojson):
         feats = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))
         geom = feats[0].geometry()
@@ -611,27 +711,251 @@ class DiffViewerWidget(WIDGET, BASE):
             if old:
                 layer.deleteFeature(old[0].id())
             layer.addFeature(new)
-        self.repo.updateCanvas()
+        extent = new.geometry().boundingBox()
+        if old:
+            extent.combineExtentWith(old[0].geometry().boundingBox())
+        self.repo.updateCanvas(
+            [self.currentFeatureItem.dataset],
+            QgsReferencedRectangle(extent, layer.crs()),
+        )
         self.workingLayerChanged.emit()
 
 
-class FeatureItem(QTreeWidgetItem):
-    def __init__(self, fid, old, new, dataset):
-        QTreeWidgetItem.__init__(self)
-        self.setIcon(0, icons.featureIcon)
-        self.setText(0, fid)
-        self.old = old
-        self.new = new
+def _featuresFromGeometries(geometries):
+    """
+    Converts a list of GeoJSON geometries into QgsFeatures, parsing them all
+    at once as a single feature collection
+    """
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {}, "geometry": geom}
+            for geom in geometries
+        ],
+    }
+    return QgsJsonUtils.stringToFeatureList(json.dumps(collection))
+
+
+class DatasetNode:
+    """
+    A dataset in the diff tree, with one group of changes per change type.
+    A node created with the counts of its changes has no groups until its
+    changed features are read
+    """
+
+    def __init__(self, dataset, isTable, counts=None):
         self.dataset = dataset
-        self.fid = fid
-
-
-class DatasetItem(QTreeWidgetItem):
-    def __init__(self, dataset, isTable):
-        QTreeWidgetItem.__init__(self)
-        self.dataset = dataset
-        self.setIcon(0, icons.tableIcon if isTable else icons.vectorDatasetIcon)
-        self.setText(0, dataset)
+        self.isTable = isTable
+        self.counts = counts
+        self.loaded = counts is None
+        self.groups = {}
+        self.children = []
+
+    def addRecord(self, record):
+        if record.changeType not in self.groups:
+            self.groups[record.changeType] = ChangeGroupNode(self, record.changeType)
+        self.groups[record.changeType].records.append(record)
+
+    def finish(self):
+        # keep the order used in the tree: added, modified, removed
+        self.children = [
+            self.groups[changeType] for changeType in "IUD" if changeType in self.groups
+        ]
+        self.loaded = True
+
+    def title(self):
+        if not self.counts:
+            return self.dataset
+        counts = [
+            f"{self.counts[key]} {name.lower()}"
+            for key, name in zip(
+                ("inserts", "updates", "deletes"), ChangeGroupNode.NAMES.values()
+            )
+            if self.counts[key]
+        ]
+        return f"{self.dataset} ({', '.join(counts)})"
+
+
+class ChangeGroupNode:
+    """
+    The features of a dataset with a given change type. Features are only
+    shown in the tree as the user scrolls to them
+    """
+
+    NAMES = {"I": "Added", "U": "Modified", "D": "Removed"}
+
+    def __init__(self, datasetNode, changeType):
+        self.datasetNode = datasetNode
+        self.changeType = changeType
+        self.records = []
+        self.fetched = 0
+
+
+class DiffTreeModel(QAbstractItemModel):
+    """
+    Tree model of dataset > change type > changed feature.
+
+    The internal pointer of each index is the node holding it (the model
+    itself for top level dataset rows), so features don't need a node of
+    their own: they are the DiffRecords stored in their group.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.datasets = []
+        self._fetching = False
+
+    def setDatasets(self, datasets):
+        self.beginResetModel()
+        for datasetNode in datasets:
+            if datasetNode.loaded:
+                datasetNode.finish()
+        self.datasets = datasets
+        self.endResetModel()
+
+    def recordsAdded(self, datasets):
+        """
+        Shows the new datasets and change groups that records have been
+        added to. 'datasets' has all the dataset nodes, the ones already in
+        the model first
+        """
+        for row, datasetNode in enumerate(self.datasets):
+            if datasetNode.loaded:
+                self._addGroups(self.index(row, 0), datasetNode)
+        new = datasets[len(self.datasets) :]
+        if new:
+            first = len(self.datasets)
+            self.beginInsertRows(QModelIndex(), first, first + len(new) - 1)
+            for datasetNode in new:
+                datasetNode.finish()
+            self.datasets.extend(new)
+            self.endInsertRows()
+
+    def _addGroups(self, index, datasetNode):
+        children = datasetNode.children
+        for row, changeType in enumerate(c for c in "IUD" if c in datasetNode.groups):
+            group = datasetNode.groups[changeType]
+            if row >= len(children) or children[row] is not group:
+                self.beginInsertRows(index, row, row)
+                children.insert(row, group)
+                self.endInsertRows()
+
+    def datasetLoaded(self, index):
+        """
+        Adds the change groups of a dataset node whose records have just been
+        added to it
+        """
+        datasetNode = self.node(index)
+        if datasetNode.groups:
+            self.beginInsertRows(index, 0, len(datasetNode.groups) - 1)
+            datasetNode.finish()
+            self.endInsertRows()
+        else:
+            datasetNode.finish()
+
+    def node(self, index):
+        """
+        Returns the DatasetNode, ChangeGroupNode or DiffRecord at an index
+        """
+        if not index.isValid():
+            return None
+        parent = index.internalPointer()
+        if parent is self:
+            nodes = self.datasets
+        elif isinstance(parent, DatasetNode):
+            nodes = parent.children
+        else:
+            nodes = parent.records
+        if 0 <= index.row() < len(nodes):
+            return nodes[index.row()]
+        return None
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        parentNode = self.node(parent)
+        if parentNode is None:
+            return self.createIndex(row, column, self)
+        return self.createIndex(row, column, parentNode)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parentNode = index.internalPointer()
+        if parentNode is self:
+            return QModelIndex()
+        elif isinstance(parentNode, DatasetNode):
+            return self.createIndex(self.datasets.index(parentNode), 0, self)
+        else:
+            datasetNode = parentNode.datasetNode
+            row = datasetNode.children.index(parentNode)
+            return self.createIndex(row, 0, datasetNode)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        if node is None:
+            return len(self.datasets)
+        elif isinstance(node, DatasetNode):
+            return len(node.children)
+        elif isinstance(node, ChangeGroupNode):
+            return node.fetched
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if isinstance(node, ChangeGroupNode):
+            return bool(node.records)
+        return not isinstance(node, DiffRecord)
+
+    def canFetchMore(self, parent):
+        if self._fetching:
+            return False
+        node = self.node(parent)
+        return isinstance(node, ChangeGroupNode) and node.fetched < len(node.records)
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if not isinstance(node, ChangeGroupNode):
+            return
+        count = min(FEATURES_PAGE_SIZE, len(node.records) - node.fetched)
+        if count <= 0 or self._fetching:
+            return
+        self._fetching = True
+        try:
+            self.beginInsertRows(parent, node.fetched, node.fetched + count - 1)
+            node.fetched += count
+            self.endInsertRows()
+        finally:
+            self._fetching = False
+
+    def data(self, index, role=Qt.DisplayRole):
+        node = self.node(index)
+        if node is None:
+            return None
+        if role == Qt.DisplayRole:
+            if isinstance(node, DatasetNode):
+                return node.title()
+            elif isinstance(node, ChangeGroupNode):
+                return ChangeGroupNode.NAMES[node.changeType]
+            else:
+                return node.fid
+        elif role == Qt.DecorationRole:
+            if isinstance(node, DatasetNode):
+                return icons.tableIcon if node.isTable else icons.vectorDatasetIcon
+            elif isinstance(node, ChangeGroupNode):
+                return {
+                    "I": icons.addedIcon,
+                    "U": icons.modifiedIcon,
+                    "D": icons.removeIcon,
+                }[node.changeType]
+            else:
+                return icons.featureIcon
+        return None
 
 
 class DiffItem(QTableWidgetItem):
@@ -2,9 +2,10 @@ import os
 import re
 import math
 import tempfile
+from collections import deque
 from functools import partial
 
-from qgis.PyQt import uic
+from qgis.PyQt import sip, uic
 from qgis.PyQt.QtCore import Qt, QMimeData, QByteArray, QDataStream, QIODevice
 
 from qgis.PyQt.QtWidgets import (
@@ -31,21 +32,11 @@ from kart.core import RepoManager
 from kart.kartapi import (
     Repository,
     executeskart,
-    KartException,
     checkKartInstalled,
+    runAndWait,
+    runInBackground,
 )
 from kart.gui import icons
-from kart.gui.diffviewer import DiffViewerDialog
-from kart.gui.historyviewer import HistoryDialog
-from kart.gui.conflictsdialog import ConflictsDialog
-from kart.gui.clonedialog import CloneDialog
-from kart.gui.pushdialog import PushDialog
-from kart.gui.pulldialog import PullDialog
-from kart.gui.initdialog import InitDialog
-from kart.gui.mergedialog import MergeDialog
-from kart.gui.switchdialog import SwitchDialog
-from kart.gui.repopropertiesdialog import RepoPropertiesDialog
-from kart.gui.dbconnectiondialog import DbConnectionDialog
 from kart.utils import (
     layerFromSource,
     confirm,
@@ -60,6 +51,68 @@ pluginPath = os.path.split(os.path.dirname(__file__))[0]
 
 WIDGET, BASE = uic.loadUiType(os.path.join(os.path.dirname(__file__), "dockwidget.ui"))
 
+# Maximum number of repos whose contents are read at the same time
+MAX_CONCURRENT_LOADS = 4
+
+
+class LoadingQueue:
+    """
+    Runs the functions that read the contents of the tree in the background,
+    a limited number of them at a time
+    """
+
+    def __init__(self, maxConcurrent=MAX_CONCURRENT_LOADS):
+        self.maxConcurrent = maxConcurrent
+        self.pending = deque()
+        self.running = 0
+
+    def add(self, description, func, onResult, onError):
+        self.pending.append((description, func, onResult, onError))
+        self._next()
+
+    def _next(self):
+        while self.pending and self.running < self.maxConcurrent:
+            description, func, onResult, onError = self.pending.popleft()
+            self.running += 1
+            runInBackground(
+                description,
+                func,
+                onResult=partial(self._finished, onResult),
+                onError=partial(self._finished, onError),
+            )
+
+    def _finished(self, callback, value):
+        self.running -= 1
+        try:
+            callback(value)
+        finally:
+            self._next()
+
+
+loadingQueue = LoadingQueue()
+
+
+def _isInTree(item):
+    """
+    Returns False if an item was deleted or removed from the tree, as it can
+    be while its contents are read in the background
+    """
+    return not sip.isdeleted(item) and item.treeWidget() is not None
+
+
+class LoadingItem(QTreeWidgetItem):
+    """
+    Placeholder shown while the children of an item are being read
+    """
+
+    def __init__(self):
+        QTreeWidgetItem.__init__(self)
+        self.setText(0, "Loading…")
+        self.setDisabled(True)
+
+    def actions(self):
+        return []
+
 
 class KartDockWidget(BASE, WIDGET):
     def __init__(self):
@@ -201,6 +254,8 @@ class ReposItem(RefreshableItem):
 
     @executeskart
     def createRepo(self):
+        from kart.gui.initdialog import InitDialog
+
         dialog = InitDialog()
         ret = dialog.exec()
         if ret == dialog.Accepted:
@@ -251,6 +306,8 @@ class ReposItem(RefreshableItem):
                         value = math.floor(float(matches[0][0]))
                         bar.setValue(value)
 
+        from kart.gui.clonedialog import CloneDialog
+
         dialog = CloneDialog()
         dialog.show()
         ret = dialog.exec_()
@@ -280,6 +337,9 @@ class RepoItem(RefreshableItem):
         self.repo = repo
 
         self.populated = False
+        self.branch = None
+        self.readingStatus = False
+        self.statusOutdated = False
 
         self.setTitle()
         self.setIcon(0, icons.repoIcon)
@@ -288,19 +348,46 @@ class RepoItem(RefreshableItem):
     def refreshContent(self):
         self.takeChildren()
         self.populate()
-        self.setTitle()
 
     def setTitle(self):
-        if self.populated:
-            try:
-                title = (
-                    f"{self.repo.title() or os.path.normpath(self.repo.path)} "
-                    f"[{self.repo.currentBranch()}]"
-                )
-            except KartException:
-                title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
+        """
+        Sets the title, with the current branch once populated. The branch
+        is read in the background with the rest of the repo status, which is
+        then at hand for the repo actions, showing the last one known
+        meanwhile. Only one read runs at a time, with another one after it
+        if the title is set again meanwhile
+        """
+        self._showTitle()
+        if not self.populated:
+            return
+        if self.readingStatus:
+            self.statusOutdated = True
         else:
-            title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
+            self._readStatus()
+
+    def _readStatus(self):
+        self.readingStatus = True
+        self.statusOutdated = False
+        loadingQueue.add(
+            "Reading repository status",
+            self.repo.statusSnapshot,
+            onResult=lambda status: self._branchRead(status.branch),
+            onError=lambda ex: self._branchRead(None),
+        )
+
+    def _branchRead(self, branch):
+        if not _isInTree(self):
+            return
+        self.readingStatus = False
+        self.branch = branch
+        self._showTitle()
+        if self.statusOutdated:
+            self._readStatus()
+
+    def _showTitle(self):
+        title = f"{self.repo.title() or os.path.normpath(self.repo.path)}"
+        if self.populated and self.branch:
+            title = f"{title} [{self.branch}]"
         self.setText(0, title)
 
     def onExpanded(self):
@@ -373,6 +460,8 @@ class RepoItem(RefreshableItem):
         return actions
 
     def showProperties(self):
+        from kart.gui.repopropertiesdialog import RepoPropertiesDialog
+
         dialog = RepoPropertiesDialog(self.repo)
         dialog.show()
         dialog.exec()
@@ -385,11 +474,15 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def showLog(self):
+        from kart.gui.historyviewer import HistoryDialog
+
         dialog = HistoryDialog(self.repo)
         dialog.exec()
         self.refreshContent()
 
     def importLayerFromDatabase(self):
+        from kart.gui.dbconnectiondialog import DbConnectionDialog
+
         dlg = DbConnectionDialog()
         ret = dlg.exec()
         if ret == dlg.Accepted:
@@ -461,21 +554,34 @@ class RepoItem(RefreshableItem):
                         "Commit", "Changes could not be commited", level=Qgis.Warning
                     )
 
+    def _changeCounts(self):
+        """
+        Returns the number of changed features of each dataset in the working
+        copy, or None if there are schema changes
+        """
+        if self.repo.diffHasSchemaChanges():
+            return None
+        return self.repo.statusSnapshot().featureChangeCounts()
+
     @executeskart
     def showChanges(self):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges()
-        if hasSchemaChanges:
+        changeCounts = runAndWait("Checking working copy changes", self._changeCounts)
+        if changeCounts is None:
             iface.messageBar().pushMessage(
                 "Changes",
                 "There are schema changes in the working copy and changes cannot be shown",
                 level=Qgis.Warning,
             )
-            return
-        diff = self.repo.diff()
-        hasChanges = any([bool(c) for c in diff.values()])
-        if hasChanges:
+        elif changeCounts:
+            from kart.gui.diffviewer import DiffViewerDialog
+
+            # the changed features of each dataset are read when it's opened
             dialog = DiffViewerDialog(
-                iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
+                iface.mainWindow(),
+                lambda dataset: self.repo.diff(dataset=dataset),
+                self.repo,
+                showRecoverNewButton=False,
+                changeCounts=changeCounts,
             )
             dialog.exec()
         else:
@@ -487,6 +593,8 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def switchBranch(self):
+        from kart.gui.switchdialog import SwitchDialog
+
         dialog = SwitchDialog(self.repo)
         if dialog.exec() == dialog.Accepted:
             self.repo.checkoutBranch(dialog.branch, dialog.force)
@@ -494,6 +602,8 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def mergeBranch(self):
+        from kart.gui.mergedialog import MergeDialog
+
         dialog = MergeDialog(self.repo)
         if dialog.exec() == dialog.Accepted:
             conflicts = self.repo.mergeBranch(
@@ -524,7 +634,7 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def continueMerge(self):
-        if self.repo.conflicts():
+        if self.repo.conflictsSummary():
             iface.messageBar().pushMessage(
                 "Merge",
                 "Cannot continue. There are merge conflicts.",
@@ -555,13 +665,20 @@ class RepoItem(RefreshableItem):
                 level=Qgis.Warning,
             )
             return
-        conflicts = self.repo.conflicts()
-        if conflicts:
-            dialog = ConflictsDialog(conflicts)
+        summary = runAndWait("Reading merge conflicts", self.repo.conflictsSummary)
+        if summary:
+            from kart.gui.conflictsdialog import ConflictsDialog
+
+            dialog = ConflictsDialog(self.repo, summary)
             dialog.exec()
             if dialog.okToMerge:
-                self.repo.resolveConflicts(dialog.resolvedFeatures)
+                runAndWait(
+                    "Resolving conflicts",
+                    self.repo.resolveConflicts,
+                    dialog.resolvedFeatures,
+                )
                 self.repo.continueMerge()
+                self.repo.updateCanvas()
                 iface.messageBar().pushMessage(
                     "Merge",
                     "Merge operation was correctly continued and closed",
@@ -574,6 +691,8 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def push(self):
+        from kart.gui.pushdialog import PushDialog
+
         dialog = PushDialog(self.repo)
         if dialog.exec() == dialog.Accepted:
             self.repo.push(dialog.remote, dialog.branch, dialog.pushAll)
@@ -590,6 +709,8 @@ class RepoItem(RefreshableItem):
 
     @executeskart
     def pull(self):
+        from kart.gui.pulldialog import PullDialog
+
         dialog = PullDialog(self.repo)
         if dialog.exec() == dialog.Accepted:
             ret = self.repo.pull(dialog.remote, dialog.branch)
@@ -628,15 +749,38 @@ class DatasetsItem(RefreshableItem):
         QTreeWidgetItem.__init__(self)
 
         self.repo = repo
+        self.loadingItem = None
 
         self.setText(0, "Datasets")
         self.setIcon(0, icons.datasetIcon)
 
         self.populate()
 
-    @executeskart
     def populate(self):
-        vectorDatasets, tables = self.repo.datasets()
+        """
+        Adds a placeholder child, replaced by the datasets once they have
+        been read in the background
+        """
+        self.loadingItem = loadingItem = LoadingItem()
+        self.addChild(loadingItem)
+        loadingQueue.add(
+            "Reading datasets",
+            self.repo.datasets,
+            onResult=partial(self._datasetsRead, loadingItem),
+            onError=partial(self._datasetsFailed, loadingItem),
+        )
+
+    def _isLoading(self, loadingItem):
+        # the item might have been refreshed or removed from the tree
+        # while reading
+        return loadingItem is self.loadingItem and _isInTree(self)
+
+    def _datasetsRead(self, loadingItem, datasets):
+        if not self._isLoading(loadingItem):
+            return
+        self.removeChild(loadingItem)
+        self.loadingItem = None
+        vectorDatasets, tables = datasets
         for dataset in vectorDatasets:
             item = DatasetItem(dataset, self.repo, False)
             self.addChild(item)
@@ -644,6 +788,12 @@ class DatasetsItem(RefreshableItem):
             item = DatasetItem(table, self.repo, True)
             self.addChild(item)
 
+    def _datasetsFailed(self, loadingItem, ex):
+        if self._isLoading(loadingItem):
+            loadingItem.setText(0, "Datasets could not be read")
+            loadingItem.setToolTip(0, str(ex))
+            self.loadingItem = None
+
     def _actions(self):
         return []
 
@@ -699,7 +849,7 @@ class DatasetItem(QTreeWidgetItem):
                 iface.mainWindow(), "Commit", "Enter commit message:"
             )
             if ok and msg:
-                if self.repo.commit(msg, dataset=self.name):
+                if self.repo.commit(msg, datasets=[self.name]):
                     iface.messageBar().pushMessage(
                         "Commit", "Changes correctly committed", level=Qgis.Info
                     )
@@ -708,18 +858,27 @@ class DatasetItem(QTreeWidgetItem):
                         "Commit", "Changes could not be commited", level=Qgis.Warning
                     )
 
+    def _diff(self):
+        """
+        Returns the working copy changes of the dataset, or None if there are
+        schema changes. Kart is only asked for them if the status shows any
+        """
+        if self.name not in self.repo.statusSnapshot().changes:
+            return {}
+        return self.repo.diffUnlessSchemaChanged(dataset=self.name)
+
     @executeskart
     def showChanges(self):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(dataset=self.name)
-        if hasSchemaChanges:
+        diff = runAndWait("Computing working copy changes", self._diff)
+        if diff is None:
             iface.messageBar().pushMessage(
                 "Changes",
                 "There are schema changes in the working copy and changes cannot be shown",
                 level=Qgis.Warning,
             )
-            return
-        diff = self.repo.diff(dataset=self.name)
-        if diff.get(self.name):
+        elif diff.get(self.name):
+            from kart.gui.diffviewer import DiffViewerDialog
+
             dialog = DiffViewerDialog(
                 iface.mainWindow(), diff, self.repo, showRecoverNewButton=False
             )
@@ -745,6 +904,8 @@ class DatasetItem(QTreeWidgetItem):
 
     @executeskart
     def showLog(self):
+        from kart.gui.historyviewer import HistoryDialog
+
         dialog = HistoryDialog(self.repo, self.name)
         dialog.exec()
 
@@ -20,10 +20,12 @@ from qgis.core import (
     QgsProject,
     QgsJsonUtils,
     QgsVectorLayer,
+    QgsReferencedRectangle,
 )
 from qgis.gui import QgsMapCanvas, QgsMapToolPan, QgsMessageBar
 from qgis.utils import iface
 
+from kart.kartapi import runInBackground
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "featurehistorydialog.ui")
@@ -61,13 +63,51 @@ class FeatureHistoryDialog(BASE, WIDGET):
         self.panTool = QgsMapToolPan(self.canvas)
         self.canvas.setMapTool(self.panTool)
 
+        self.items = {}
         for commit in history:
             item = CommitListItem(commit, workingCopyLayer, dataset, fid, repo)
             self.listCommits.addItem(item)
+            self.items[commit["commit"]] = item
+
+        # read all versions of the feature up front, so stepping through
+        # commits doesn't need to call Kart each time. The first commit is
+        # read on its own, to show it as soon as possible
+        self.prefetchTasks = [
+            runInBackground(
+                "Reading feature history",
+                repo.featureHistory,
+                dataset,
+                fid,
+                commits,
+                onResult=self._versionsRead,
+                onError=self._versionsFailed,
+            )
+            for commits in (history[:1], history[1:])
+            if commits
+        ]
 
         self.listCommits.setCurrentRow(0)
 
+    def _versionsRead(self, versions):
+        self.prefetchTasks = [t for t in self.prefetchTasks if t.result is not versions]
+        for commitid, features in versions.items():
+            self.items[commitid].setVersions(features)
+        # the current commit may have been waiting for its version
+        current = self.listCommits.currentItem()
+        if current is not None and current.commit["commit"] in versions:
+            self.currentCommitChanged()
+
+    def _versionsFailed(self, ex):
+        self.prefetchTasks = [t for t in self.prefetchTasks if t.exception is not ex]
+        self.bar.pushMessage(
+            "Feature history", f"Could not read the feature history: {ex}", Qgis.Warning
+        )
+
     def _currentCommitFeature(self):
+        """
+        Returns the feature at the current commit, or None if it has no
+        version or it hasn't been read yet
+        """
         row = self.listCommits.currentRow()
         if row == self.listCommits.count() - 1:
             if self.listCommits.count() == 1:
@@ -150,7 +190,13 @@ class FeatureHistoryDialog(BASE, WIDGET):
         if old:
             provider.deleteFeatures([old[0].id()])
         provider.addFeatures([new])
-        self.repo.updateCanvas()
+        extent = new.geometry().boundingBox()
+        if old:
+            extent.combineExtentWith(old[0].geometry().boundingBox())
+        self.repo.updateCanvas(
+            [self.dataset],
+            QgsReferencedRectangle(extent, self.workingCopyLayer.crs()),
+        )
         self.bar.pushMessage(
             "Feature history",
             "Working copy has been correctly modified",
@@ -162,10 +208,25 @@ class FeatureHistoryDialog(BASE, WIDGET):
         if self.layer is not None:
             QgsProject.instance().removeMapLayers([self.layer.id()])
 
+    def stopReading(self):
+        """
+        Cancels reading the feature versions, so they are not delivered to
+        the closed dialog
+        """
+        for task in self.prefetchTasks:
+            task.stop()
+        self.prefetchTasks = []
+
     def closeEvent(self, evt):
+        self.stopReading()
         self.removeLayer()
         evt.accept()
 
+    def done(self, result):
+        # closing with Esc doesn't go through closeEvent
+        self.stopReading()
+        super().done(result)
+
 
 class CommitListItem(QListWidgetItem):
     def __init__(self, commit, layer, dataset, fid, repo):
@@ -177,6 +238,9 @@ class CommitListItem(QListWidgetItem):
         self.fid = fid
         self._feature = None
         self._oldFeature = None
+        # None until read, and empty if the commit has no versions of the
+        # feature (e.g. it's a root commit)
+        self._versions = None
         self.setText(f'{commit["message"].splitlines()[0]}')
 
     def feature(self):
@@ -187,21 +251,22 @@ class CommitListItem(QListWidgetItem):
         self._createFeatures()
         return self._oldFeature
 
+    def setVersions(self, features):
+        """
+        Sets the versions of the feature changed by this commit, as returned
+        by Repository.featureHistory
+        """
+        self._versions = features
+
     def _createFeatures(self):
-        if self._feature is None:
-            diff = self.repo.diff(
-                self.commit["parents"][0],
-                self.commit["commit"],
-                self.dataset,
-                self.fid,
-            )
-            geojson = diff[self.dataset][0]
+        if self._feature is None and self._versions:
+            geojson = self._versions[0]
             self._feature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
             props = geojson["properties"]
             self._feature.setFields(self.layer.fields())
             for prop in props:
                 self._feature[prop] = props[prop]
-            geojson = diff[self.dataset][-1]
+            geojson = self._versions[-1]
             self._oldFeature = QgsJsonUtils.stringToFeatureList(json.dumps(geojson))[0]
             props = geojson["properties"]
             self._oldFeature.setFields(self.layer.fields())
@@ -1,30 +1,39 @@
 import json
 import os
+import tempfile
 
-from kart.kartapi import executeskart
+from kart.kartapi import executeskart, runAndWait
+from kart.commitgraph import CommitGraph
 from kart.gui import icons
 from kart.gui.diffviewer import DiffViewerDialog
 from kart.utils import setting, DIFFSTYLES
 
-from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsWkbTypes
+from qgis.core import (
+    Qgis,
+    QgsFeatureRequest,
+    QgsProject,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
 from qgis.utils import iface
 from qgis.gui import QgsMessageBar
 
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import (
     Qt,
-    QPoint,
+    QPointF,
     QRectF,
+    QSize,
     QDateTime,
 )
 from qgis.PyQt.QtGui import (
-    QPixmap,
     QPainter,
     QColor,
     QPainterPath,
     QPen,
     QPalette,
     QBrush,
+    QFontMetrics,
 )
 
 from qgis.PyQt.QtWidgets import (
@@ -33,20 +42,28 @@ from qgis.PyQt.QtWidgets import (
     QAction,
     QMenu,
     QTreeWidgetItem,
-    QWidget,
     QVBoxLayout,
     QSizePolicy,
-    QLabel,
+    QStyledItemDelegate,
     QInputDialog,
     QHeaderView,
     QFileDialog,
 )
 
+COMMIT_ROLE = Qt.UserRole + 1
+
 COMMIT_GRAPH_HEIGHT = 20
 RADIUS = 4
 COL_SPACING = 20
 PEN_WIDTH = 2
 MARGIN = 50
+BADGE_PADDING = 6
+BADGE_MARGIN = 4
+
+# Number of commits read from the repository history at once
+LOG_PAGE_SIZE = 200
+# Rows from the bottom of the tree at which the next page is read
+FETCH_THRESHOLD = 20
 
 COLORS = [
     QColor(Qt.red),
@@ -70,6 +87,7 @@ class HistoryTree(QTreeWidget):
         self.filterText = ""
         self.startDate = QDateTime.fromSecsSinceEpoch(0).date()
         self.endDate = QDateTime.currentDateTime().date()
+        self.fetching = False
         self.initGui()
 
     def initGui(self):
@@ -80,6 +98,10 @@ class HistoryTree(QTreeWidget):
         )
         self.customContextMenuRequested.connect(self._showPopupMenu)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setUniformRowHeights(True)
+        self.setItemDelegateForColumn(0, CommitGraphDelegate(self))
+        self.setItemDelegateForColumn(1, RefsDelegate(self))
+        self.verticalScrollBar().valueChanged.connect(self._scrolled)
         self.populate()
 
     def _showPopupMenu(self, point):
@@ -233,29 +255,30 @@ class HistoryTree(QTreeWidget):
     @executeskart
     def showDiff(self, item, parent):
         refa = item.commit["commit"]
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, parent)
-        if hasSchemaChanges:
+        if runAndWait(
+            "Checking schema changes", self.repo.diffHasSchemaChanges, refa, parent
+        ):
             self.message(
                 "There are schema changes in the selected commit and changes cannot be shown",
                 Qgis.Warning,
             )
             return
-        diff = self.repo.diff(refa, parent)
-        dialog = DiffViewerDialog(self, diff, self.repo)
+        # the viewer shows the changes as they are read
+        dialog = DiffViewerDialog(self, self.repo.diffStream(refa, parent), self.repo)
         dialog.exec()
 
     @executeskart
     def showChangesBetweenCommits(self, refa, refb):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refa, refb)
-        if hasSchemaChanges:
+        if runAndWait(
+            "Checking schema changes", self.repo.diffHasSchemaChanges, refa, refb
+        ):
             self.message(
                 "There are schema changes between the selected commits "
                 "and changes cannot be shown",
                 Qgis.Warning,
             )
             return
-        diff = self.repo.diff(refa, refb)
-        dialog = DiffViewerDialog(self, diff, self.repo)
+        dialog = DiffViewerDialog(self, self.repo.diffStream(refa, refb), self.repo)
         dialog.exec()
 
     @executeskart
@@ -270,20 +293,26 @@ class HistoryTree(QTreeWidget):
 
     @executeskart
     def saveAsLayer(self, refa, refb):
-        hasSchemaChanges = self.repo.diffHasSchemaChanges(refb, refa)
-        if hasSchemaChanges:
-            self.message(
-                "There are schema changes between the selected commits "
-                "and changes cannot be saved as a layer",
-                Qgis.Warning,
-            )
-            return
-        diff = self.repo.diff(refb, refa)
-        for dataset in diff:
-            geojson = {"type": "FeatureCollection", "features": diff[dataset]}
-            layer = QgsVectorLayer(
-                json.dumps(geojson), f"{dataset}_diff_{refa[:7]}", "ogr"
+        with tempfile.TemporaryDirectory() as folder:
+            files = runAndWait(
+                "Computing changes", self._writeDiffFiles, refb, refa, folder
             )
+            if files is None:
+                self.message(
+                    "There are schema changes between the selected commits "
+                    "and changes cannot be saved as a layer",
+                    Qgis.Warning,
+                )
+                return
+            # copied to memory layers, so the files can be removed
+            layers = {
+                dataset: QgsVectorLayer(filename, "", "ogr").materialize(
+                    QgsFeatureRequest()
+                )
+                for dataset, filename in files.items()
+            }
+        for dataset, layer in layers.items():
+            layer.setName(f"{dataset}_diff_{refa[:7]}")
             styleName = setting(DIFFSTYLES) or "standard"
             typeString = QgsWkbTypes.geometryDisplayString(layer.geometryType()).lower()
             styleFolder = os.path.join(
@@ -296,6 +325,32 @@ class HistoryTree(QTreeWidget):
             layer.loadNamedStyle(stylePath)
             QgsProject.instance().addMapLayer(layer)
 
+    def _writeDiffFiles(self, refa, refb, folder):
+        """
+        Writes the changed features of each dataset to a GeoJSON file as they
+        are read from Kart, so the diff is never held in memory. Returns None
+        if there are schema changes
+        """
+        if self.repo.diffHasSchemaChanges(refa, refb):
+            return None
+        files = {}
+        streams = {}
+        try:
+            for dataset, feature in self.repo.iterDiff(refa, refb):
+                if dataset not in streams:
+                    filename = f"{dataset.replace('/', '_')}.geojson"
+                    files[dataset] = os.path.join(folder, filename)
+                    streams[dataset] = open(files[dataset], "w")
+                    streams[dataset].write('{"type":"FeatureCollection","features":[')
+                else:
+                    streams[dataset].write(",")
+                json.dump(feature, streams[dataset])
+        finally:
+            for stream in streams.values():
+                stream.write("]}")
+                stream.close()
+        return files
+
     @executeskart
     def resetBranch(self, item):
         self.repo.reset(item.commit["commit"])
@@ -327,97 +382,66 @@ class HistoryTree(QTreeWidget):
     def message(self, text, level):
         self.parent.bar.pushMessage(text, level, duration=5)
 
-    @executeskart
     def populate(self):
-        commits = self.repo.log(dataset=self.dataset)
-
-        self.log = {c["commit"]: c for c in commits}
+        self.commits = []
+        self.log = {}
+        self.graph = CommitGraph()
+        self.hasMoreCommits = True
+        self.graphWidth = 2 * RADIUS
         self.clear()
+        self.fetchMoreCommits()
+
+    def _scrolled(self, value):
+        if value >= self.verticalScrollBar().maximum() - FETCH_THRESHOLD:
+            self.fetchMoreCommits()
 
-        maxcol = 0
-        for c in commits:
-            graph = c["graph"]
-            for i in range(3):
-                for positions in graph[i].values():
-                    if positions:
-                        maxcol = max(maxcol, max(positions))
+    @executeskart
+    def fetchMoreCommits(self):
+        """
+        Adds the next page of commits to the tree, if there are any left
+        """
+        if not self.hasMoreCommits or self.fetching:
+            return
+        self.fetching = True
+        try:
+            commits = runAndWait(
+                "Reading repository history",
+                self.repo.log,
+                dataset=self.dataset,
+                limit=LOG_PAGE_SIZE,
+                skip=len(self.commits),
+                graph=self.graph,
+            )
+        finally:
+            self.fetching = False
+        self.hasMoreCommits = len(commits) == LOG_PAGE_SIZE
+        self.commits.extend(commits)
+        self.log.update({c["commit"]: c for c in commits})
 
-        # maxcol = max([c["commitColumn"] for c in commits])
-        width = COL_SPACING * maxcol + 2 * RADIUS
+        width = COL_SPACING * self.graph.maxColumn + 2 * RADIUS
 
         grafted = False
-        for i, commit in enumerate(commits):
+        for commit in commits:
             item = CommitTreeItem(commit, self)
             self.addTopLevelItem(item)
-            img = self.graphImage(commit, width)
-            w = GraphWidget(img)
-            w.setFixedHeight(COMMIT_GRAPH_HEIGHT)
-            self.setItemWidget(item, 0, w)
             if "grafted" in commit["refs"]:
                 grafted = True
         if grafted:
             item = ShallowCloneWarningItem(self)
             self.addTopLevelItem(item)
-        for i in range(1, 6):
-            self.resizeColumnToContents(i)
-        self.setColumnWidth(0, width + MARGIN)
-        self.header().setSectionResizeMode(0, QHeaderView.Fixed)
-        self.header().setSectionResizeMode(1, QHeaderView.Fixed)
+        if width != self.graphWidth or len(self.commits) == len(commits):
+            self.graphWidth = width
+            for i in range(1, 6):
+                self.resizeColumnToContents(i)
+            self.setColumnWidth(0, width + MARGIN)
+            self.header().setSectionResizeMode(0, QHeaderView.Fixed)
+            self.header().setSectionResizeMode(1, QHeaderView.Fixed)
         self.filterCommits()
-
-    def graphImage(self, commit, width):
-        image = QPixmap(width, COMMIT_GRAPH_HEIGHT).toImage()
-        qp = QPainter(image)
-        palette = QWidget().palette()
-        qp.fillRect(
-            QRectF(0, 0, width, COMMIT_GRAPH_HEIGHT), palette.color(QPalette.Base)
-        )
-
-        path = QPainterPath()
-        for col in commit["graph"][0][r"\|"]:
-            x = RADIUS + COL_SPACING * col
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x, 0)
-        for col in commit["graph"][2][r"\|"]:
-            x = RADIUS + COL_SPACING * col
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x, COMMIT_GRAPH_HEIGHT)
-        for col in commit["graph"][0][r"/"]:
-            x = RADIUS + COL_SPACING * col
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, 0)
-        for col in commit["graph"][2][r"/"]:
-            x = RADIUS + COL_SPACING * (col + 1)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, COMMIT_GRAPH_HEIGHT)
-        for col in commit["graph"][0][r"\\"]:
-            x = RADIUS + COL_SPACING * (col + 1)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, 0)
-        for col in commit["graph"][2][r"\\"]:
-            x = RADIUS + COL_SPACING * (col)
-            x2 = RADIUS + COL_SPACING * (col + 0.5)
-            path.moveTo(x, COMMIT_GRAPH_HEIGHT / 2)
-            path.lineTo(x2, COMMIT_GRAPH_HEIGHT)
-        pen = QPen()
-        pen.setWidth(PEN_WIDTH)
-        pen.setBrush(palette.color(QPalette.WindowText))
-        qp.setPen(pen)
-        qp.drawPath(path)
-
-        col = commit["commitColumn"]
-        y = int(COMMIT_GRAPH_HEIGHT / 2)
-        x = int(RADIUS + COL_SPACING * col)
-        color = COLORS[col]
-        qp.setPen(color)
-        qp.setBrush(color)
-        qp.drawEllipse(QPoint(x, y), RADIUS, RADIUS)
-        qp.end()
-
-        return image
+        # keep loading while the loaded commits don't fill the view, as no
+        # scrolling would trigger it
+        rowsHeight = self.topLevelItemCount() * COMMIT_GRAPH_HEIGHT
+        if self.hasMoreCommits and rowsHeight < self.viewport().height():
+            self.fetchMoreCommits()
 
     def filterCommits(self, text=None, startDate=None, endDate=None):
         self.filterText = text or self.filterText
@@ -444,58 +468,129 @@ class HistoryTree(QTreeWidget):
                 item.setHidden(hide)
 
 
-class GraphWidget(QWidget):
-    def __init__(self, img):
-        QWidget.__init__(self)
-        self.setFixedWidth(img.width())
-        self.img = img
-
-    def paintEvent(self, e):
-        painter = QPainter(self)
-        # painter.begin(self);
-        painter.drawImage(0, 0, self.img)
-        painter.end()
-
-
 class CommitTreeItem(QTreeWidgetItem):
     def __init__(self, commit, parent):
         QTreeWidgetItem.__init__(self, parent)
         self.commit = commit
-        if commit["refs"]:
-            labelslist = []
-            for label in commit["refs"]:
-                if label == "grafted":
-                    continue
-                if "HEAD ->" in label:
-                    labelslist.append(
-                        '<span style="background-color:crimson; color:white"> '
-                        f'&nbsp;&nbsp;{label.split("->")[-1].strip()}&nbsp;&nbsp;</span>'
-                    )
-                elif "tag:" in label:
-                    labelslist.append(
-                        '<span style="background-color:yellow; color:black"> '
-                        f"&nbsp;&nbsp;{label[4:].strip()}&nbsp;&nbsp;</span>"
-                    )
-                else:
-                    labelslist.append(
-                        '<span style="background-color:salmon; color:white"> '
-                        f"&nbsp;&nbsp;{label}&nbsp;&nbsp;</span>"
-                    )
-            if labelslist:
-                labels = " ".join(labelslist) + "&nbsp;&nbsp;"
-            else:
-                labels = ""
-        else:
-            labels = ""
-        qlabel = QLabel(labels)
-        qlabel.setStyleSheet("QLabel {padding-left: 15px;}")
-        parent.setItemWidget(self, 1, qlabel)
+        self.setData(0, COMMIT_ROLE, commit)
+        self.setData(1, COMMIT_ROLE, commit)
         self.setText(2, commit["message"].splitlines()[0])
         self.setText(3, commit["authorName"])
         self.setText(4, commit["authorTime"])
         self.setText(5, commit["abbrevCommit"])
 
 
+def refBadges(commit):
+    """
+    Returns the text, background and text colors of the badges shown for
+    the refs pointing to a commit
+    """
+    badges = []
+    for label in commit["refs"]:
+        if label == "grafted":
+            continue
+        if "HEAD ->" in label:
+            badges.append(
+                (label.split("->")[-1].strip(), QColor("crimson"), QColor(Qt.white))
+            )
+        elif "tag:" in label:
+            badges.append((label[4:].strip(), QColor(Qt.yellow), QColor(Qt.black)))
+        else:
+            badges.append((label, QColor("salmon"), QColor(Qt.white)))
+    return badges
+
+
+class CommitGraphDelegate(QStyledItemDelegate):
+    """
+    Paints the lanes of the history graph in the row of a commit
+    """
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        commit = index.data(COMMIT_ROLE)
+        if commit is not None:
+            width = COL_SPACING * commit["commitColumn"] + 2 * RADIUS
+            size = QSize(max(size.width(), width), COMMIT_GRAPH_HEIGHT)
+        return size
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        commit = index.data(COMMIT_ROLE)
+        if commit is None:
+            return
+        rect = option.rect
+        top = rect.top()
+        middle = rect.top() + rect.height() / 2
+        bottom = rect.bottom() + 1
+
+        def x(col):
+            return rect.left() + RADIUS + COL_SPACING * col
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setClipRect(rect)
+        path = QPainterPath()
+        for col, col2 in commit["graph"]["up"]:
+            path.moveTo(x(col), top)
+            path.lineTo(x(col2), middle)
+        for col, col2 in commit["graph"]["down"]:
+            path.moveTo(x(col), middle)
+            path.lineTo(x(col2), bottom)
+        pen = QPen()
+        pen.setWidth(PEN_WIDTH)
+        pen.setBrush(option.palette.color(QPalette.WindowText))
+        painter.setPen(pen)
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPath(path)
+
+        col = commit["commitColumn"]
+        color = COLORS[col % len(COLORS)]
+        painter.setPen(color)
+        painter.setBrush(color)
+        painter.drawEllipse(QPointF(x(col), middle), RADIUS, RADIUS)
+        painter.restore()
+
+
+class RefsDelegate(QStyledItemDelegate):
+    """
+    Paints the branches and tags pointing to a commit as colored badges
+    """
+
+    def _badgeWidth(self, metrics, text):
+        return metrics.horizontalAdvance(text) + 2 * BADGE_PADDING
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        commit = index.data(COMMIT_ROLE)
+        if commit is not None:
+            metrics = QFontMetrics(option.font)
+            width = BADGE_MARGIN
+            for text, _, _ in refBadges(commit):
+                width += self._badgeWidth(metrics, text) + BADGE_MARGIN
+            size = QSize(max(size.width(), width), size.height())
+        return size
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        commit = index.data(COMMIT_ROLE)
+        if commit is None:
+            return
+        metrics = QFontMetrics(option.font)
+        rect = option.rect
+        left = rect.left() + BADGE_MARGIN
+        painter.save()
+        painter.setClipRect(rect)
+        painter.setFont(option.font)
+        for text, background, foreground in refBadges(commit):
+            width = self._badgeWidth(metrics, text)
+            badgeRect = QRectF(left, rect.top() + 1, width, rect.height() - 2)
+            painter.fillRect(badgeRect, background)
+            painter.setPen(foreground)
+            painter.drawText(badgeRect, Qt.AlignCenter, text)
+            left += width + BADGE_MARGIN
+        painter.restore()
+
+
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "historyviewer.ui")
 )
@@ -6,9 +6,9 @@ import sys
 import tempfile
 import webbrowser
 
+from qgis.PyQt import uic
 from qgis.PyQt.QtWidgets import QDialog
 from qgis.PyQt.QtCore import QThread, Qt, pyqtSignal, QEventLoop
-from qgis.PyQt import uic
 
 from qgis.utils import iface
 
@@ -6,7 +6,19 @@ from qgis.gui import QgsMessageBar
 from qgis.PyQt import uic
 from qgis.PyQt.QtWidgets import QDialog, QSizePolicy, QFileDialog
 
-from kart.utils import setting, setSetting, KARTPATH, HELPERMODE, AUTOCOMMIT, DIFFSTYLES
+from kart.utils import (
+    setting,
+    setSetting,
+    KARTPATH,
+    HELPERMODE,
+    AUTOCOMMIT,
+    AUTOCOMMITDELAY,
+    DIFFSTYLES,
+    DEBUGLOGGING,
+    LOGFILE,
+)
+from kart import logging
+from kart.autocommit import autoCommitDelay
 
 WIDGET, BASE = uic.loadUiType(
     os.path.join(os.path.dirname(__file__), "settingsdialog.ui")
@@ -25,6 +37,7 @@ class SettingsDialog(BASE, WIDGET):
         self.layout().addWidget(self.bar)
 
         self.btnBrowsePath.clicked.connect(lambda: self.browse(self.txtKartPath))
+        self.btnBrowseLogFile.clicked.connect(self.browseLogFile)
 
         self.buttonBox.accepted.connect(self.okClicked)
         self.buttonBox.rejected.connect(self.reject)
@@ -37,7 +50,10 @@ class SettingsDialog(BASE, WIDGET):
         self.comboDiffStyles.setCurrentText(setting(DIFFSTYLES))
         self.chkHelperMode.setChecked(setting(HELPERMODE))
         self.chkAutoCommit.setChecked(setting(AUTOCOMMIT))
+        self.spinAutoCommitDelay.setValue(autoCommitDelay())
         self.txtKartPath.setText(setting(KARTPATH))
+        self.chkDebugLogging.setChecked(setting(DEBUGLOGGING))
+        self.txtLogFile.setText(setting(LOGFILE))
 
     def browse(self, textbox):
         folder = QFileDialog.getExistingDirectory(
@@ -46,9 +62,20 @@ class SettingsDialog(BASE, WIDGET):
         if folder:
             textbox.setText(folder)
 
+    def browseLogFile(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            iface.mainWindow(), "Log File", "", "Log files (*.log)"
+        )
+        if filename:
+            self.txtLogFile.setText(filename)
+
     def okClicked(self):
         setSetting(KARTPATH, self.txtKartPath.text())
         setSetting(HELPERMODE, self.chkHelperMode.isChecked())
         setSetting(AUTOCOMMIT, self.chkAutoCommit.isChecked())
+        setSetting(AUTOCOMMITDELAY, self.spinAutoCommitDelay.value())
         setSetting(DIFFSTYLES, self.comboDiffStyles.currentText())
+        setSetting(DEBUGLOGGING, self.chkDebugLogging.isChecked())
+        setSetting(LOGFILE, self.txtLogFile.text())
+        logging.configure()
         self.accept()
@@ -1,44 +1,73 @@
 import json
 import locale
 import os
-import re
+import pathlib
+import sqlite3
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, Iterator, NamedTuple, Tuple, Dict
 from functools import wraps
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from urllib.parse import urlparse
 
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import Qt, QThread, QCoreApplication, QEventLoop, pyqtSignal
 from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import (
     QApplication,
 )
 
 from qgis.core import (
+    QgsApplication,
+    QgsCoordinateTransform,
+    QgsCsException,
     QgsDataSourceUri,
+    QgsGeometry,
     QgsMessageOutput,
     QgsProject,
     QgsCoordinateReferenceSystem,
     QgsRectangle,
     QgsReferencedRectangle,
+    QgsTask,
     QgsVectorLayer,
     Qgis,
 )
 from qgis.utils import iface
 
-from kart.gui.userconfigdialog import UserConfigDialog
-from kart.gui.installationwarningdialog import InstallationWarningDialog
 
 from kart.utils import setting, setSetting, KARTPATH, HELPERMODE
+from kart.commandlimiter import KartCommandLimiter, MAX_CONCURRENT_COMMANDS
+from kart.repostate import (
+    RepoStateCache,
+    cachedbystate,
+    isReadOnlyCommand,
+    workingCopyKey,
+)
+from kart.streaming import (
+    iterJsonArray,
+    iterJsonLines,
+    isSchemaChange,
+    diffLinesFeatures,
+    diffRecords,
+    DiffRecord,
+)
+from kart.commitgraph import CommitGraph
+from kart.profiling import KartCallLog
 from kart import logging
 
 
 MINIMUM_SUPPORTED_VERSION = "0.14.0"
 CURRENT_VERSION = "0.15.0"
 
+# Maximum number of conflicts passed to a single 'kart resolve' call, which
+# keeps command lines well below the length limit on Windows
+RESOLVE_CHUNK_SIZE = 200
+
 
 class KartException(Exception):
     pass
@@ -48,12 +77,20 @@ class KartNotSupportedOperationException(Exception):
     pass
 
 
+class KartCanceledException(KartException):
+    pass
+
+
 def executeskart(f):
     @wraps(f)
     def inner(*args):
         try:
             if checkKartInstalled():
                 return f(*args)
+        except KartCanceledException:
+            iface.messageBar().pushMessage(
+                "Kart", "Operation was canceled", level=Qgis.Info
+            )
         except KartException as ex:
             dlg = QgsMessageOutput.createMessageOutput()
             dlg.setTitle("Kart")
@@ -129,6 +166,8 @@ def checkKartInstalled(showMessage=True, useCache=True):
             )
     if msg:
         if showMessage:
+            from kart.gui.installationwarningdialog import InstallationWarningDialog
+
             dlg = InstallationWarningDialog(msg, CURRENT_VERSION)
             dlg.exec()
             installed = checkKartInstalled(showMessage=False, useCache=False)
@@ -196,11 +235,12 @@ def kartVersionDetails():
         return errtxt
 
 
-def executeKart(commands, path=None, jsonoutput=False, feedback=None):
-    commands.insert(0, kartExecutable())
-    if jsonoutput:
-        commands.append("-ojson")
+def _isMainThread():
+    app = QCoreApplication.instance()
+    return app is None or QThread.currentThread() == app.thread()
 
+
+def _kartEnvironment():
     # The env PYTHONHOME/GDAL_DRIVER_PATH from QGIS can interfere with Kart.
     if not hasattr(executeKart, "env"):
         executeKart.env = os.environ.copy()
@@ -211,15 +251,28 @@ def executeKart(commands, path=None, jsonoutput=False, feedback=None):
 
     # always set the use helper env var as it is long lived and the setting may have changed
     executeKart.env["KART_USE_HELPER"] = "1" if setting(HELPERMODE) else ""
+    return executeKart.env
+
 
+def executeKart(commands, path=None, jsonoutput=False, feedback=None):
+    commands.insert(0, kartExecutable())
+    if jsonoutput:
+        commands.append("-ojson")
+
+    _kartEnvironment()
+
+    # the override cursor can only be touched from the main thread. Commands
+    # running within a KartTask report progress through the task instead
+    mainThread = _isMainThread()
+    task = currentTask()
+    started = time.perf_counter()
+    stdout = stderr = returncode = None
     try:
         encoding = locale.getdefaultlocale()[1] or "utf-8"
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        logging.debug(f"Command: {' '.join(commands)}")
-        # TODO - all of this should be replaced by useage of QgsTask which
-        #  will execute on a background thread. There are a number of
-        #  ways in which this can deadlock
-        with subprocess.Popen(
+        if mainThread:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+        logging.debug("Command: %s", " ".join(commands))
+        with KartCommandLimiter.instance().slot(path), subprocess.Popen(
             commands,
             shell=os.name == "nt",
             env=executeKart.env,
@@ -234,6 +287,9 @@ def executeKart(commands, path=None, jsonoutput=False, feedback=None):
                 output = []
                 err = []
                 for line in proc.stderr:
+                    if task is not None and task.isCanceled():
+                        proc.kill()
+                        raise KartCanceledException()
                     feedback(line)
                     err.append(line)
                 for line in proc.stdout:
@@ -241,20 +297,376 @@ def executeKart(commands, path=None, jsonoutput=False, feedback=None):
                 stdout = "".join(output)
                 stderr = "".join(err)
                 proc.communicate()  # need to get the returncode
+            elif task is not None:
+                stdout, stderr = _communicateCancelable(proc, task)
             else:
                 stdout, stderr = proc.communicate()
-            logging.debug(f"Command output: {stdout}")
+            returncode = proc.returncode
+            logging.debug("Command output: %s", stdout)
             if proc.returncode:
                 raise KartException(stderr)
             if jsonoutput:
                 return json.loads(stdout)
             else:
                 return stdout
+    except KartCanceledException:
+        logging.debug("Command canceled: %s", " ".join(commands))
+        raise
     except Exception as e:
         logging.error(str(e))
         raise KartException(str(e))
+    finally:
+        KartCallLog.instance().record(
+            commands[1:], path, started, stdout, stderr, returncode
+        )
+        if mainThread:
+            QApplication.restoreOverrideCursor()
+
+
+@contextmanager
+def kartOutputStream(commands, path=None):
+    """
+    Runs a Kart command and yields its standard output as a text stream,
+    which can be consumed while Kart is still writing it.
+
+    Raises KartException once the stream has been consumed if Kart failed
+    """
+    commands.insert(0, kartExecutable())
+    env = _kartEnvironment()
+    encoding = locale.getdefaultlocale()[1] or "utf-8"
+    logging.debug("Command: %s", " ".join(commands))
+    started = time.perf_counter()
+    # stderr goes to a file, so a chatty process never blocks on a full pipe
+    # while we are reading its output
+    with KartCommandLimiter.instance().slot(path), tempfile.TemporaryFile(
+        "w+t", encoding=encoding
+    ) as errfile:
+        try:
+            proc = subprocess.Popen(
+                commands,
+                shell=os.name == "nt",
+                env=env,
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                stderr=errfile,
+                universal_newlines=True,
+                encoding=encoding,
+                cwd=path,
+            )
+        except Exception as e:
+            logging.error(str(e))
+            raise KartException(str(e))
+        stream = _CountingStream(proc.stdout)
+        try:
+            with proc:
+                try:
+                    yield stream
+                except BaseException:
+                    # the consumer stopped reading, so there is no use in
+                    # letting Kart finish
+                    proc.kill()
+                    raise
+                stream.read()
+                proc.wait()
+                if proc.returncode:
+                    errfile.seek(0)
+                    stderr = errfile.read()
+                    logging.error(stderr)
+                    raise KartException(stderr)
+        finally:
+            KartCallLog.instance().record(
+                commands[1:],
+                path,
+                started,
+                exitCode=proc.returncode,
+                stdoutSize=stream.size,
+            )
+
+
+class _CountingStream:
+    """
+    Wraps a text stream, counting the characters read from it
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self.stream:
+            self.size += len(line)
+            yield line
+
+
+CANCEL_POLL_INTERVAL = 0.1
+# Number of items passed at once to the main thread by iterInBackground
+ITER_BATCH_SIZE = 1000
+
+
+def _communicateCancelable(proc, task):
+    """
+    Waits for a Kart process to finish, killing it if the given task is canceled
+    """
+    while True:
+        try:
+            return proc.communicate(timeout=CANCEL_POLL_INTERVAL)
+        except subprocess.TimeoutExpired:
+            if task.isCanceled():
+                proc.kill()
+                proc.communicate()
+                raise KartCanceledException()
+
+
+# Background execution
+
+_taskLocal = threading.local()
+_runningTasks = set()
+
+
+def currentTask() -> Optional["KartTask"]:
+    """
+    Returns the KartTask being run by the current thread, or None
+    """
+    return getattr(_taskLocal, "task", None)
+
+
+def _inTask(task: Optional["KartTask"], func: Callable) -> Callable:
+    """
+    Wraps a callable so it runs as part of the given task when called from
+    another thread, such as a thread pool worker, so it can see if the task
+    is canceled
+    """
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        previous = currentTask()
+        _taskLocal.task = task
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _taskLocal.task = previous
+
+    return inner
+
+
+def setTaskProgress(value: float):
+    """
+    Reports progress (0-100) of the current background task, if any
+    """
+    task = currentTask()
+    if task is not None:
+        task.setProgress(value)
+
+
+def isTaskCanceled() -> bool:
+    """
+    Returns True if the current background task has been canceled
+    """
+    task = currentTask()
+    return task is not None and task.isCanceled()
+
+
+class KartTask(QgsTask):
+    """
+    Runs a callable (usually a read-only Repository method) on a background
+    thread using the QGIS task manager.
+
+    The callable must not touch the project, layers or widgets, as it does
+    not run in the main thread. Results and errors are delivered back in
+    the main thread through the resultReady and errorOccurred signals.
+    """
+
+    resultReady = pyqtSignal(object)
+    errorOccurred = pyqtSignal(object)
+    batchReady = pyqtSignal(object)
+
+    def __init__(self, description, func, *args, **kwargs):
+        super().__init__(description, QgsTask.CanCancel)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.exception = None
+
+    def run(self):
+        _taskLocal.task = self
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+            return not self.isCanceled()
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            _taskLocal.task = None
+
+    def stop(self):
+        """
+        Cancels the task and disconnects its signals, so batches or results
+        already on their way are not delivered, e.g. to a closed dialog
+        """
+        self.cancel()
+        for signal in (self.batchReady, self.resultReady, self.errorOccurred):
+            try:
+                signal.disconnect()
+            except TypeError:
+                # nothing connected
+                pass
+
+    def finished(self, result):
+        _runningTasks.discard(self)
+        if result:
+            self.resultReady.emit(self.result)
+        else:
+            if self.exception is None:
+                self.exception = KartCanceledException()
+            self.errorOccurred.emit(self.exception)
+
+
+def runInBackground(
+    description: str,
+    func: Callable,
+    *args,
+    onResult: Optional[Callable] = None,
+    onError: Optional[Callable] = None,
+    **kwargs,
+) -> KartTask:
+    """
+    Runs a callable in a background KartTask, without blocking the UI.
+
+    Returns the task, which can be used to track progress or cancel it
+    """
+    task = KartTask(description, func, *args, **kwargs)
+    if onResult is not None:
+        task.resultReady.connect(onResult)
+    if onError is not None:
+        task.errorOccurred.connect(onError)
+    # tasks must be kept alive on the Python side until they finish
+    _runningTasks.add(task)
+    QgsApplication.taskManager().addTask(task)
+    return task
+
+
+def iterInBackground(
+    description: str,
+    func: Callable,
+    *args,
+    onBatch: Callable,
+    onResult: Optional[Callable] = None,
+    onError: Optional[Callable] = None,
+    batchSize: int = ITER_BATCH_SIZE,
+    **kwargs,
+) -> KartTask:
+    """
+    Iterates over what a callable returns in a background KartTask, passing
+    the items read to onBatch in the main thread, as lists of up to
+    'batchSize' items, so they can be used while the rest are read.
+
+    onResult is called with the number of items once all have been read
+    """
+
+    def _read():
+        task = currentTask()
+        batch = []
+        count = 0
+        for item in func(*args, **kwargs):
+            if task.isCanceled():
+                raise KartCanceledException()
+            batch.append(item)
+            if len(batch) >= batchSize:
+                task.batchReady.emit(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            task.batchReady.emit(batch)
+            count += len(batch)
+        return count
+
+    task = KartTask(description, _read)
+    # connected before the task starts, so no batch is missed
+    task.batchReady.connect(onBatch)
+    if onResult is not None:
+        task.resultReady.connect(onResult)
+    if onError is not None:
+        task.errorOccurred.connect(onError)
+    _runningTasks.add(task)
+    QgsApplication.taskManager().addTask(task)
+    return task
+
+
+def runAndWait(description: str, func: Callable, *args, **kwargs):
+    """
+    Runs a callable in a background KartTask and waits for it to finish,
+    keeping the event loop (repaints, progress reporting) running meanwhile.
+
+    Returns the result of the callable, or raises the exception it raised
+    """
+    if not _isMainThread():
+        return func(*args, **kwargs)
+    task = runInBackground(description, func, *args, **kwargs)
+    loop = QEventLoop()
+    task.resultReady.connect(loop.quit)
+    task.errorOccurred.connect(loop.quit)
+    QApplication.setOverrideCursor(Qt.WaitCursor)
+    try:
+        if task in _runningTasks:
+            loop.exec_(flags=QEventLoop.ExcludeUserInputEvents)
     finally:
         QApplication.restoreOverrideCursor()
+    if task.exception is not None:
+        raise task.exception
+    return task.result
+
+
+def _geometryFromHexWkb(hexWkb: str) -> Dict:
+    geometry = QgsGeometry()
+    geometry.fromWkb(bytes.fromhex(hexWkb))
+    return json.loads(geometry.asJson())
+
+
+class StatusSnapshot(NamedTuple):
+    """
+    The state of a repository as reported by a single 'kart status' call.
+    'changes' has the number of changed features and the changed metadata
+    items of each dataset with working copy changes
+    """
+
+    branch: Optional[str]
+    head: Optional[str]
+    upstream: Optional[Dict]
+    merging: bool
+    changes: Dict[str, Dict]
+    spatialFilter: Optional[QgsReferencedRectangle]
+
+    def isWorkingTreeClean(self) -> bool:
+        return not self.changes
+
+    def featureChangeCounts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of inserted, updated and deleted features of each
+        dataset with feature changes in the working copy
+        """
+        counts = {}
+        for dataset, changes in self.changes.items():
+            featureChanges = changes.get("feature")
+            if featureChanges:
+                counts[dataset] = {
+                    changeType: featureChanges.get(changeType, 0)
+                    for changeType in ("inserts", "updates", "deletes")
+                }
+        return counts
+
+    def hasMetaChanges(self, dataset=None) -> bool:
+        """
+        Returns True if metadata items (e.g. the schema) of the given dataset,
+        or of any dataset, have changed in the working copy
+        """
+        datasets = [dataset] if dataset is not None else list(self.changes)
+        return any("meta" in self.changes.get(name, {}) for name in datasets)
 
 
 class Repository:
@@ -262,9 +674,15 @@ class Repository:
         self.path = path
         self.boundingBoxColor = QColor(150, 0, 0)
         self.showBoundingBox = True
+        self._stateCache = RepoStateCache(path)
 
     def executeKart(self, commands, jsonoutput=False):
-        return executeKart(commands, self.path, jsonoutput)
+        readOnly = isReadOnlyCommand(commands)
+        try:
+            return executeKart(commands, self.path, jsonoutput)
+        finally:
+            if not readOnly:
+                self._stateCache.invalidate()
 
     @staticmethod
     def supportedDbTypes():
@@ -353,21 +771,19 @@ class Repository:
         with open(os.path.join(self.path, ".kart", "description"), "w") as f:
             f.write(title)
 
-    _configDict = None
-
     def _invalidateConfigCache(self):
-        self._configDict = None
+        self._stateCache.invalidate()
 
+    @cachedbystate
     def _config(self):
-        if self._configDict is None:
-            ret = self.executeKart(["config", "-l"])
-            lines = ret.splitlines()
-            self._configDict = {}
-            for line in lines:
-                tokens = line.split("=")
-                if len(tokens) == 2:
-                    self._configDict[tokens[0]] = tokens[1]
-        return self._configDict
+        ret = self.executeKart(["config", "-l"])
+        lines = ret.splitlines()
+        configDict = {}
+        for line in lines:
+            tokens = line.split("=")
+            if len(tokens) == 2:
+                configDict[tokens[0]] = tokens[1]
+        return configDict
 
     def spatialFilter(self):
         configDict = self._config()
@@ -399,11 +815,20 @@ class Repository:
     def importIntoRepo(self, source):
         self.executeKart(["import", source])
 
+    def isUserConfigured(self, configDict=None):
+        """
+        Returns True if the user name and email are set and non-empty,
+        without asking for them
+        """
+        configDict = configDict if configDict is not None else self._config()
+        return all(configDict.get(key) for key in ("user.name", "user.email"))
+
     def checkUserConfigured(self):
         configDict = self._config()
-        # check user name/email are set and non-empty
-        if all(configDict.get(configKey) for configKey in ("user.name", "user.email")):
+        if self.isUserConfigured(configDict):
             return True
+        from kart.gui.userconfigdialog import UserConfigDialog
+
         dlg = UserConfigDialog(configDict)
         if dlg.exec() == dlg.Accepted:
             self.configureUser(dlg.username, dlg.email)
@@ -415,96 +840,253 @@ class Repository:
         self.executeKart(["config", "--global", "user.name", name])
         self.executeKart(["config", "--global", "user.email", email])
 
-    def commit(self, msg, dataset=None):
+    def commit(self, msg, datasets=None):
+        """
+        Commits the working copy changes of the given datasets, or all of
+        them if no datasets are passed
+        """
         if self.checkUserConfigured():
             commands = ["commit", "-m", msg, "--no-editor"]
-            if dataset is not None:
-                commands.append(dataset)
+            if datasets is not None:
+                commands.extend(datasets)
             self.executeKart(commands)
             return True
         else:
             return False
 
     def reset(self, ref="HEAD"):
-        self.executeKart(["reset", ref, "-f"])
-        self.updateCanvas()
+        with self._refreshingChangedDatasets(includeWorkingCopy=True):
+            self.executeKart(["reset", ref, "-f"])
+
+    def headCommit(self):
+        """
+        Returns the id of the commit HEAD points to, or None if there is
+        no commit yet. It is read from the files of the repo, without
+        calling Kart
+        """
+        kartFolder = os.path.join(self.path, ".kart")
+        try:
+            with open(os.path.join(kartFolder, "HEAD")) as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        if not head.startswith("ref:"):
+            # detached HEAD
+            return head or None
+        ref = head[4:].strip()
+        try:
+            with open(os.path.join(kartFolder, *ref.split("/"))) as f:
+                return f.read().strip() or None
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(kartFolder, "packed-refs")) as f:
+                for line in f:
+                    tokens = line.split()
+                    if len(tokens) == 2 and tokens[1] == ref:
+                        return tokens[0]
+        except OSError:
+            pass
+        return None
 
-    def log(self, ref="HEAD", dataset=None, featureid=None):
+    def changedDatasets(self, refa, refb):
+        """
+        Returns the names of the datasets with features changed between two
+        refs, only counting the changes so no feature is read
+        """
+        return set(self._changedDatasets(f"{refa}..{refb}"))
+
+    def _changedDatasets(self, revisions):
+        commands = ["diff", "--only-feature-count=exact", revisions]
+        counts = self.executeKart(commands, True)
+        # older versions wrap the counts in a versioned key
+        if len(counts) == 1 and next(iter(counts)).startswith("kart."):
+            counts = next(iter(counts.values()))
+        return sorted(dataset for dataset, count in counts.items() if count)
+
+    @contextmanager
+    def _refreshingChangedDatasets(self, includeWorkingCopy=False):
+        """
+        Refreshes the layers of the datasets changed by the Kart commands run
+        in the block, by comparing HEAD before and after them. If
+        includeWorkingCopy is True, datasets with working copy changes
+        before the block are refreshed too.
+
+        HEAD is read from the repo files and the working copy changes from
+        the status snapshot, so Kart is only called to count the changes
+        when HEAD moved.
+
+        All layers of the repo are refreshed if the changes cannot be found
+        """
+        try:
+            before = self.headCommit()
+            datasets = set(self.changes()) if includeWorkingCopy else set()
+        except KartException:
+            before = None
+        yield
+        after = self.headCommit()
+        if before is None or after is None:
+            self.updateCanvas()
+            return
+        if before != after:
+            try:
+                datasets |= self.changedDatasets(before, after)
+            except (KartException, ValueError):
+                self.updateCanvas()
+                return
+        self.updateCanvas(datasets)
+
+    def log(
+        self,
+        ref="HEAD",
+        dataset=None,
+        featureid=None,
+        limit=None,
+        skip=0,
+        graph: Optional[CommitGraph] = None,
+    ):
+        """
+        Returns the commits in the history of the given ref, newest first,
+        with the lanes of the history graph assigned.
+
+        'limit' and 'skip' restrict the result to a page of that history.
+        To read it a page at a time, pass the same CommitGraph for all pages
+        so lanes continue across them
+        """
+        page = []
+        if limit is not None:
+            page.extend(["-n", str(limit)])
+        if skip:
+            page.append(f"--skip={skip}")
         if dataset is not None:
             if featureid is not None:
                 filt = f"{dataset}:{featureid}"
             else:
                 filt = dataset
 
-            commands = ["log", "-ojson", ref, "--", filt]
+            commands = ["log", "-ojson", ref] + page + ["--", filt]
         else:
-            commands = ["log", "-ojson", ref]
+            commands = ["log", "-ojson", ref] + page
         ret = self.executeKart(commands)
-        jsonRet = json.loads(ret)
-        log = {c["commit"]: c for c in jsonRet}
-        if dataset is not None:
-            commands = [
-                "log",
-                ref,
-                "--graph",
-                "-otext:%H%n",
-                "--",
-                filt,
-            ]
+        commits = json.loads(ret)
+        if dataset is not None and commits:
+            # the parents in the JSON output are the actual parents of each
+            # commit, which might not be in a filtered history. Use the
+            # parents in the history simplified by git instead
+            commands = ["log", ref, "--parents", "-otext:%H %P"]
+            commands += page + ["--", filt]
+            parents = {}
+            for line in self.executeKart(commands).splitlines():
+                if line.strip():
+                    commitid, *commitParents = line.split()
+                    parents[commitid] = commitParents
+            graphParents = [parents.get(c["commit"], []) for c in commits]
         else:
-            commands = ["log", ref, "--graph", "-otext:%H%n"]
-        logb = self.executeKart(commands)
-        lines = logb.splitlines()
-        lines.insert(0, "")
-        lines.append("")
-        commitlinesidxs = []
-        for i, line in enumerate(lines):
-            if "*" in line:
-                commitlinesidxs.append(i)
-        commits = []
-        for commitlineidx in commitlinesidxs:
-            commitline = lines[commitlineidx]
-            commitid = commitline.split(" ")[-1]
-            log[commitid]["commitColumn"] = (commitline.index("*")) // 2
-            graph = []
-            for j in range(3):
-                graph.append({})
-                for char in [r"\|", "/", r"\\"]:
-                    line = lines[commitlineidx - 1 + j]
-                    matches = re.finditer(char, line)
-                    positions = [match.start() // 2 for match in matches]
-                    graph[j][char] = positions
-            log[commitid]["graph"] = graph
-            commits.append(log[commitid])
+            graphParents = [c["parents"] for c in commits]
+        graph = graph or CommitGraph()
+        for commit, commitParents in zip(commits, graphParents):
+            graph.addCommit(commit, commitParents)
         return commits
 
+    @cachedbystate
+    def datasetNames(self):
+        """
+        Returns the names of the datasets in the repo, without reading their
+        metadata
+        """
+        ret = self.executeKart(["data", "ls"], True)
+        if isinstance(ret, dict):
+            ret = list(ret.values())[0]
+        return [d["path"] if isinstance(d, dict) else d for d in ret]
+
+    @cachedbystate
+    def datasetMeta(self, dataset):
+        """
+        Returns all the metadata items of a single dataset
+        """
+        return self.executeKart(["meta", "get", dataset], True)[dataset]
+
+    def _workingCopyContents(self):
+        """
+        Returns the data type ('features' or 'attributes') of each table in
+        a GeoPackage working copy, or None if the working copy is not a
+        GeoPackage that can be read
+        """
+        try:
+            location = self.workingCopyLocation()
+        except KeyError:
+            return None
+        path = os.path.join(self.path, location)
+        if not location.lower().endswith(".gpkg") or not os.path.exists(path):
+            return None
+        uri = f"{pathlib.Path(path).resolve().as_uri()}?mode=ro"
+        try:
+            with closing(sqlite3.connect(uri, uri=True)) as conn:
+                rows = conn.execute(
+                    "SELECT table_name, data_type FROM gpkg_contents"
+                ).fetchall()
+        except sqlite3.Error:
+            return None
+        return dict(rows)
+
+    @cachedbystate
     def datasets(self):
-        vectorLayers = []
-        tables = []
-        meta = self.executeKart(["meta", "get"], True)
-        for name, dataset in meta.items():
-            crsProps = [k for k in dataset.keys() if k.startswith("crs/")]
-            if crsProps:
-                vectorLayers.append(name)
-            else:
-                tables.append(name)
+        """
+        Returns the names of the vector layers and of the tables in the repo.
+
+        Whether a dataset has geometries is read from a GeoPackage working
+        copy when possible, so the metadata of the datasets is not needed
+        """
+        contents = self._workingCopyContents()
+        if contents is None:
+            hasGeometry = self._datasetsHaveGeometry()
+        else:
+            hasGeometry = {}
+            missing = []
+            for name in self.datasetNames():
+                # Kart names the tables of nested datasets a__b
+                table = name.replace("/", "__")
+                if table in contents:
+                    hasGeometry[name] = contents[table] == "features"
+                else:
+                    missing.append(name)
+            if missing:
+                metaHasGeometry = self._datasetsHaveGeometry()
+                for name in missing:
+                    hasGeometry[name] = metaHasGeometry.get(name, False)
+        vectorLayers = [name for name, geom in hasGeometry.items() if geom]
+        tables = [name for name, geom in hasGeometry.items() if not geom]
         return vectorLayers, tables
 
+    def _datasetsHaveGeometry(self):
+        """
+        Returns whether each dataset has geometries, read from the metadata
+        of all datasets with a single Kart call
+        """
+        meta = self.executeKart(["meta", "get"], True)
+        return {
+            name: any(k.startswith("crs/") for k in dataset.keys())
+            for name, dataset in meta.items()
+        }
+
+    @cachedbystate
+    def _branchInfo(self):
+        return list(self.executeKart(["branch"], True).values())[0]
+
     def branches(self):
-        branches = list(self.executeKart(["branch"], True).values())[0]["branches"]
+        branches = self._branchInfo()["branches"]
         return list(b.split("->")[-1].strip() for b in branches.keys())
 
     def currentBranch(self):
-        branch = list(self.executeKart(["branch"], True).values())[0]["current"]
-        return branch
+        return self._branchInfo()["current"]
 
     def checkoutBranch(self, branch, force=False):
         if force:
             commands = ["checkout", "--force", branch]
         else:
             commands = ["checkout", branch]
-        self.executeKart(commands)
-        self.updateCanvas()
+        with self._refreshingChangedDatasets():
+            self.executeKart(commands)
 
     def createBranch(self, branch, commit="HEAD"):
         return self.executeKart(["branch", branch, commit])
@@ -520,8 +1102,8 @@ class Repository:
             commands.append("--no-ff")
         if ffonly:
             commands.append("--ff-only")
-        ret = self.executeKart(commands, True)
-        self.updateCanvas()
+        with self._refreshingChangedDatasets():
+            ret = self.executeKart(commands, True)
         return list(ret.values())[0].get("conflicts", [])
 
     def abortMerge(self):
@@ -539,7 +1121,31 @@ class Repository:
     def deleteTag(self, tag):
         return self.executeKart(["tag", "-d", tag])
 
+    def _workingCopyKey(self):
+        try:
+            location = self.workingCopyLocation()
+        except KeyError:
+            location = None
+        return workingCopyKey(self.path, location)
+
     def diffHasSchemaChanges(self, refa=None, refb=None, dataset=None):
+        """
+        Returns True if the schema of the dataset, or of any dataset, changed
+        between two refs (or the working copy). The result is cached until
+        the repo state, or the working copy when comparing to it, change
+        """
+        if refa is None and not self.statusSnapshot().hasMetaChanges(dataset):
+            return False
+        return self._stateCache.get(
+            self._schemaChangesKey(refa, refb, dataset),
+            lambda: self._diffHasSchemaChanges(refa, refb, dataset),
+        )
+
+    def _schemaChangesKey(self, refa, refb, dataset):
+        key = self._workingCopyKey() if refa is None else None
+        return ("diffHasSchemaChanges", refa, refb, dataset, key)
+
+    def _diffHasSchemaChanges(self, refa, refb, dataset):
         commands = ["diff"]
         if refa and refb:
             commands.append(f"{refb}...{refa}")
@@ -559,57 +1165,203 @@ class Repository:
         )
         return any(s is not None for s in schemaChanges)
 
+    @staticmethod
+    def _diffRevisions(refa=None, refb=None):
+        if refa and refb:
+            return f"{refb}...{refa}"
+        return refa or "HEAD"
+
+    def _diffCommands(self, refa=None, refb=None, dataset=None, featureid=None):
+        commands = [
+            "diff",
+            "--output-format=geojson:extracompact",
+            self._diffRevisions(refa, refb),
+        ]
+        if dataset is not None:
+            if featureid is not None:
+                commands.append(f"{dataset}:{featureid}")
+            else:
+                commands.append(dataset)
+        return commands
+
+    def iterDiff(
+        self, refa=None, refb=None, dataset=None, featureid=None
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        Yields (dataset, GeoJSON feature) tuples for the features changed
+        between two refs (or the working copy), parsing Kart's output
+        incrementally so memory use doesn't grow with the size of the diff.
+
+        The first features are available as soon as Kart writes them
+        """
+        if dataset is None:
+            # Kart only writes the GeoJSON diff of a single dataset to its
+            # output, so all datasets are read from its json-lines diff
+            records = self._iterDiffLines(refa, refb)
+            yield from diffLinesFeatures(records, _geometryFromHexWkb)
+            return
+        commands = self._diffCommands(refa, refb, dataset, featureid)
+        with kartOutputStream(commands, self.path) as stream:
+            for feature in iterJsonArray(stream):
+                if isTaskCanceled():
+                    raise KartCanceledException()
+                yield dataset, feature
+
+    def _iterDiffLines(self, refa=None, refb=None, dataset=None):
+        """
+        Yields the records of the json-lines diff between two refs (or the
+        working copy), as Kart writes them
+        """
+        commands = [
+            "diff",
+            "--output-format=json-lines",
+            self._diffRevisions(refa, refb),
+        ]
+        if dataset is not None:
+            commands.append(dataset)
+        with kartOutputStream(commands, self.path) as stream:
+            for record in iterJsonLines(stream):
+                if isTaskCanceled():
+                    raise KartCanceledException()
+                yield record
+
+    def diffStream(
+        self, refa=None, refb=None, dataset=None, featureid=None
+    ) -> Iterator[DiffRecord]:
+        """
+        Yields a DiffRecord (dataset, change type, feature id, old, new)
+        for each changed feature, see iterDiff
+        """
+        return diffRecords(self.iterDiff(refa, refb, dataset, featureid))
+
     def diff(self, refa=None, refb=None, dataset=None, featureid=None):
         changes = {}
         try:
-            commands = ["diff", "--output-format=geojson:extracompact"]
-            if refa and refb:
-                commands.append(f"{refb}...{refa}")
-            elif refa:
-                commands.append(refa)
-            else:
-                commands.append("HEAD")
-            if dataset is not None:
-                if featureid is not None:
-                    commands.append(f"{dataset}:{featureid}")
-                else:
-                    commands.append(dataset)
-            if dataset is not None and featureid is not None:
-                ret = self.executeKart(commands)
-                changes[dataset] = json.loads(ret)["features"]
-            else:
-                tmpdirname = tempfile.TemporaryDirectory()
-                commands.extend(["--output", tmpdirname.name])
-                self.executeKart(commands)
-                for filename in os.listdir(tmpdirname.name):
-                    path = os.path.join(tmpdirname.name, filename)
-                    name = os.path.splitext(filename)[0]
-                    with open(path) as f:
-                        changes[name] = json.load(f)["features"]
-                tmpdirname.cleanup()
+            for name, feature in self.iterDiff(refa, refb, dataset, featureid):
+                changes.setdefault(name, []).append(feature)
+        except KartCanceledException:
+            raise
         except Exception:
             pass
+        if dataset is not None:
+            changes.setdefault(dataset, [])
         return changes
 
+    def diffUnlessSchemaChanged(self, refa=None, refb=None, dataset=None):
+        """
+        Returns the same as diff(), or None if there are schema changes,
+        which the features diff cannot show.
+
+        Schema and features are read from a single json-lines diff, which is
+        stopped as soon as a schema change is found. Whether there were
+        schema changes is cached, as in diffHasSchemaChanges
+        """
+        key = self._schemaChangesKey(refa, refb, dataset)
+        changes = {}
+        if dataset is not None:
+            changes[dataset] = []
+        try:
+            with closing(self._iterDiffLines(refa, refb, dataset)) as records:
+                schemaChanged = False
+
+                def _features():
+                    nonlocal schemaChanged
+                    for record in records:
+                        if isSchemaChange(record):
+                            schemaChanged = True
+                            return
+                        yield record
+
+                features = diffLinesFeatures(_features(), _geometryFromHexWkb)
+                for name, feature in features:
+                    changes.setdefault(name, []).append(feature)
+        except KartCanceledException:
+            raise
+        except Exception:
+            # as in diff(), the changes read so far are returned
+            return changes
+        self._stateCache.put(key, schemaChanged)
+        return None if schemaChanged else changes
+
+    def featureHistory(self, dataset, featureid, commits=None):
+        """
+        Returns the versions of a feature changed by each of the commits in
+        its history, as a dict of commit id -> features, the latter being
+        the features of the diff between the commit and its first parent
+        as returned by diff(). Commits without parents have no versions.
+
+        Kart has no command to output every version of a feature, so a diff
+        is run per commit, several of them at a time
+        """
+        if commits is None:
+            commits = self.log(dataset=dataset, featureid=featureid)
+
+        def _versions(commit):
+            if not commit["parents"] or isTaskCanceled():
+                return []
+            diff = self.diff(commit["parents"][0], commit["commit"], dataset, featureid)
+            return diff[dataset]
+
+        versions = {}
+        # workers run as part of the current task, so their Kart processes
+        # are killed if it is canceled
+        worker = _inTask(currentTask(), _versions)
+        pool = ThreadPoolExecutor(MAX_CONCURRENT_COMMANDS)
+        futures = [pool.submit(worker, commit) for commit in commits]
+        try:
+            for i, future in enumerate(futures):
+                features = future.result()
+                if isTaskCanceled():
+                    raise KartCanceledException()
+                versions[commits[i]["commit"]] = features
+                setTaskProgress(100 * (i + 1) / len(commits))
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+        return versions
+
     def restore(self, ref, dataset=None):
         if dataset is not None:
             self.executeKart(["restore", "-s", ref, dataset])
+            self.updateCanvas([dataset])
         else:
             self.executeKart(["restore", "-s", ref])
-        self.updateCanvas()
+            self.updateCanvas()
 
-    def changes(self):
-        return (
-            list(self.executeKart(["status"], True).values())[0]
-            .get("workingCopy", {})
-            .get("changes")
-            or {}
+    def statusSnapshot(self) -> StatusSnapshot:
+        """
+        Returns the branch, HEAD, upstream, merge state, working copy changes
+        and spatial filter of the repo, read with a single Kart call. It is
+        reused until the repo state or the working copy change, so menus and
+        dialogs can call this as often as needed
+        """
+        return self._stateCache.get(
+            ("statusSnapshot", self._workingCopyKey()), self._readStatus
+        )
+
+    def _readStatus(self):
+        status = list(self.executeKart(["status"], True).values())[0]
+        return StatusSnapshot(
+            branch=status.get("branch"),
+            head=status.get("commit"),
+            upstream=status.get("upstream"),
+            merging=status.get("state") == "merging" or "merging" in status,
+            changes=(status.get("workingCopy") or {}).get("changes") or {},
+            spatialFilter=self.spatialFilter(),
         )
 
+    def changes(self):
+        return self.statusSnapshot().changes
+
     def isWorkingTreeClean(self):
-        return not bool(self.changes())
+        return self.statusSnapshot().isWorkingTreeClean()
 
     def isMerging(self):
+        """
+        Returns True if a merge is in progress. This only checks for a file,
+        so it is cheap enough to call when building menus
+        """
         return os.path.exists(os.path.join(self.path, ".kart", "MERGE_MSG"))
 
     def mergeMessage(self):
@@ -620,45 +1372,109 @@ class Repository:
                 msg = f.read()
         return msg
 
+    def conflictsSummary(self):
+        """
+        Returns the ids of the conflicted features of each dataset, without
+        reading the conflicted versions
+        """
+        ret = self.executeKart(["conflicts", "-s"], True)
+        summary = {}
+        for dataset, datasetConflicts in list(ret.values())[0].items():
+            fids = datasetConflicts.get("feature", [])
+            summary[dataset] = [str(fid) for fid in fids]
+        return summary
+
     def conflictsHaveSchemaChanges(self):
-        ret = self.executeKart(["conflicts"], True)
+        ret = self.executeKart(["conflicts", "-s"], True)
         for datasetConflicts in list(ret.values())[0].values():
-            schemaChanges = datasetConflicts.get("meta", {}).get("schema.json", None)
-            if schemaChanges is not None:
+            if "schema.json" in datasetConflicts.get("meta", []):
                 return True
         return False
 
-    def conflicts(self):
+    def iterConflicts(self, dataset=None) -> Iterator[Tuple[str, str, str, Dict]]:
+        """
+        Yields (dataset, feature id, version, GeoJSON feature) tuples for
+        the versions of the conflicted features, as Kart writes them.
+
+        'version' is 'ancestor', 'ours' or 'theirs'. Only the conflicts
+        of the given dataset are read, if one is passed
+        """
         commands = ["conflicts", "--output-format=geojson:extracompact"]
-        features = json.loads(self.executeKart(commands)).get("features", [])
+        if dataset is not None:
+            commands.append(dataset)
+        with kartOutputStream(commands, self.path) as stream:
+            for feature in iterJsonArray(stream):
+                if isTaskCanceled():
+                    raise KartCanceledException()
+                name, elementtype, fid, version = feature["id"].split(":")
+                if elementtype != "feature":
+                    raise KartNotSupportedOperationException()
+                yield name, fid, version, feature
+
+    def conflicts(self, dataset=None):
         conflicts = {}
-        for feature in features:
-            dataset, elementtype, fid, version = feature["id"].split(":")
-            if elementtype != "feature":
-                raise KartNotSupportedOperationException()
-            if dataset not in conflicts:
-                conflicts[dataset] = {}
-            if fid not in conflicts[dataset]:
-                conflicts[dataset][fid] = {
+        for name, fid, version, feature in self.iterConflicts(dataset):
+            if name not in conflicts:
+                conflicts[name] = {}
+            if fid not in conflicts[name]:
+                conflicts[name][fid] = {
                     "ancestor": None,
                     "theirs": None,
                     "ours": None,
                 }
-            conflicts[dataset][fid][version] = feature
+            conflicts[name][fid][version] = feature
         return conflicts
 
     def resolveConflicts(self, resolved):
-        for fid, feature in resolved.items():
-            if feature is not None:
-                fc = {"type": "FeatureCollection", "features": [feature]}
-                tmpfile = tempfile.NamedTemporaryFile("w+t", delete=False)
-                json.dump(fc, tmpfile)
-                tmpfile.close()
-                self.executeKart(["resolve", "--with-file", tmpfile.name, fid])
-                os.unlink(tmpfile.name)
+        """
+        Resolves merge conflicts. 'resolved' maps conflict labels
+        (dataset:feature:fid) to a GeoJSON feature to use as resolution, or
+        to the version to keep ('ancestor', 'ours', 'theirs' or 'delete').
+        None is the same as 'delete'.
+
+        Conflicts resolved with the same version are resolved together in
+        chunks, with a single Kart call each. Kart can only resolve one
+        conflict with a file, so features need a call each.
+
+        It can run in a background task, reporting progress and stopping
+        if the task is canceled
+        """
+        versions = {}
+        features = {}
+        for label, resolution in resolved.items():
+            if resolution is None:
+                resolution = "delete"
+            if isinstance(resolution, str):
+                versions.setdefault(resolution, []).append(label)
             else:
-                self.executeKart(["resolve", "--with", "delete", fid])
-        self.updateCanvas()
+                features[label] = resolution
+
+        total = len(resolved)
+        done = 0
+
+        def _resolved(count):
+            nonlocal done
+            done += count
+            setTaskProgress(100 * done / total)
+
+        for version, labels in versions.items():
+            for i in range(0, len(labels), RESOLVE_CHUNK_SIZE):
+                if isTaskCanceled():
+                    raise KartCanceledException()
+                chunk = labels[i : i + RESOLVE_CHUNK_SIZE]
+                self.executeKart(["resolve", "--with", version] + chunk)
+                _resolved(len(chunk))
+        if features:
+            with tempfile.TemporaryDirectory() as folder:
+                filename = os.path.join(folder, "resolved.geojson")
+                for label, feature in features.items():
+                    if isTaskCanceled():
+                        raise KartCanceledException()
+                    with open(filename, "w") as f:
+                        fc = {"type": "FeatureCollection", "features": [feature]}
+                        json.dump(fc, f)
+                    self.executeKart(["resolve", "--with-file", filename, label])
+                    _resolved(1)
 
     def remotes(self):
         remotes = {}
@@ -681,8 +1497,8 @@ class Repository:
             self.executeKart(["push", remote, branch])
 
     def pull(self, remote, branch):
-        ret = self.executeKart(["pull", remote, branch, "--no-editor"])
-        self.updateCanvas()
+        with self._refreshingChangedDatasets():
+            ret = self.executeKart(["pull", remote, branch, "--no-editor"])
         return "kart conflicts" not in ret
 
     def layerBelongsToRepo(self, layer):
@@ -719,16 +1535,15 @@ class Repository:
             layer = QgsVectorLayer(uri.uri(), dataset, "postgres")
             return layer
 
+    @cachedbystate
     def workingCopyLayerIdField(self, dataset):
-        schema = self.executeKart(["meta", "get", dataset, "schema.json"], True)[
-            dataset
-        ]["schema.json"]
+        schema = self.datasetMeta(dataset)["schema.json"]
         for attr in schema:
             if attr.get("primaryKeyIndex") == 0:
                 return attr["name"]
 
     def workingCopyLayerCrs(self, dataset):
-        meta = self.executeKart(["meta", "get", dataset], True)[dataset]
+        meta = self.datasetMeta(dataset)
         for k in meta.keys():
             if k.startswith("crs/"):
                 return k[4:-4]
@@ -750,7 +1565,39 @@ class Repository:
     def applyPatch(self, filename):
         self.executeKart(["apply", "--no-commit", filename])
 
-    def updateCanvas(self):
+    def updateCanvas(self, datasets=None, extent=None):
+        """
+        Reloads and repaints the project layers of this repo.
+
+        If 'datasets' is given, only the layers of those datasets are
+        refreshed. If 'extent' (a QgsReferencedRectangle with the area
+        that changed) is given, layers are only repainted if it is visible
+        """
+        if datasets is not None and not datasets:
+            return
+        canvas = iface.mapCanvas() if iface is not None else None
+        visible = True
+        if extent is not None and canvas is not None:
+            transform = QgsCoordinateTransform(
+                extent.crs(),
+                canvas.mapSettings().destinationCrs(),
+                QgsProject.instance(),
+            )
+            try:
+                visible = transform.transformBoundingBox(extent).intersects(
+                    canvas.extent()
+                )
+            except QgsCsException:
+                visible = True
         for layer in QgsProject.instance().mapLayers().values():
-            if self.layerBelongsToRepo(layer):
+            if not self.layerBelongsToRepo(layer):
+                continue
+            if (
+                datasets is not None
+                and self.datasetNameFromLayer(layer) not in datasets
+            ):
+                continue
+            if not layer.isEditable():
+                layer.reload()
+            if visible:
                 layer.triggerRepaint()
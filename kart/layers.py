@@ -24,10 +24,8 @@ from qgis.PyQt.QtGui import QColor, QTextDocument
 from qgis.PyQt.QtWidgets import QAction, QInputDialog
 
 from kart.gui import icons
-from kart.gui.historyviewer import HistoryDialog
-from kart.gui.diffviewer import DiffViewerDialog
-from kart.gui.featurehistorydialog import FeatureHistoryDialog
-from kart.kartapi import executeskart
+from kart.kartapi import executeskart, runAndWait
+from kart.autocommit import AutoCommitQueue
 from kart.utils import setting, AUTOCOMMIT
 from kart.core import RepoManager
 
@@ -244,7 +242,14 @@ class LayerTracker:
         try:
             feature = next(feats)
             fid = feature[idField]
-            history = self.mapToolRepo.log(dataset=dataset, featureid=fid)
+            history = runAndWait(
+                "Reading feature history",
+                self.mapToolRepo.log,
+                dataset=dataset,
+                featureid=fid,
+            )
+            from kart.gui.featurehistorydialog import FeatureHistoryDialog
+
             dlg = FeatureHistoryDialog(
                 history, self.mapToolLayer, dataset, fid, self.mapToolRepo
             )
@@ -261,6 +266,8 @@ class LayerTracker:
         layer, repo = self._kartActiveLayerAndRepo()
         if layer is not None:
             dataset = repo.datasetNameFromLayer(layer)
+            from kart.gui.historyviewer import HistoryDialog
+
             dialog = HistoryDialog(repo, dataset)
             dialog.exec()
 
@@ -269,16 +276,22 @@ class LayerTracker:
         layer, repo = self._kartActiveLayerAndRepo()
         if layer is not None:
             dataset = repo.datasetNameFromLayer(layer)
-            hasSchemaChanges = repo.diffHasSchemaChanges(dataset=dataset)
-            if hasSchemaChanges:
+            diff = {}
+            if dataset in repo.statusSnapshot().changes:
+                diff = runAndWait(
+                    "Computing working copy changes",
+                    repo.diffUnlessSchemaChanged,
+                    dataset=dataset,
+                )
+            if diff is None:
                 iface.messageBar().pushMessage(
                     "Changes",
                     "There are schema changes in the working tree and changes cannot be shown",
                     level=Qgis.Warning,
                 )
-                return
-            diff = repo.diff(dataset=dataset)
-            if diff.get(dataset):
+            elif diff.get(dataset):
+                from kart.gui.diffviewer import DiffViewerDialog
+
                 dialog = DiffViewerDialog(
                     iface.mainWindow(), diff, repo, showRecoverNewButton=False
                 )
@@ -313,7 +326,7 @@ class LayerTracker:
                     iface.mainWindow(), "Commit", "Enter commit message:"
                 )
                 if ok and msg:
-                    if repo.commit(msg, dataset=dataset):
+                    if repo.commit(msg, datasets=[dataset]):
                         iface.messageBar().pushMessage(
                             "Commit", "Changes correctly committed", level=Qgis.Info
                         )
@@ -329,6 +342,7 @@ class LayerTracker:
                 )
 
     def layerRemoved(self, layerid):
+        RepoManager.instance().forget_layer(layerid)
         self.updateRubberBands()
 
     @executeskart
@@ -338,10 +352,7 @@ class LayerTracker:
             auto = setting(AUTOCOMMIT)
             if auto:
                 dataset = repo.datasetNameFromLayer(layer)
-                repo.commit(f"Changed dataset '{dataset}'", dataset=dataset)
-                iface.messageBar().pushMessage(
-                    "Commit", "Changes correctly committed", level=Qgis.Info
-                )
+                AutoCommitQueue.instance().add(repo, dataset)
 
     def disconnectLayers(self):
         for layer, f in self.connected.items():
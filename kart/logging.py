@@ -1,24 +1,112 @@
+import logging
+import logging.handlers
+
 from qgis.core import QgsMessageLog, Qgis
 
-DEBUG = True
+from kart.utils import setting, DEBUGLOGGING, LOGFILE
+
 MAX_LINES = 20
+# Longest text written to the log for a single message
+MAX_CHARS = 4000
+# Size and number of the files kept by the rotating log file
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+ERROR = logging.ERROR
+
+_QGIS_LEVELS = {DEBUG: Qgis.Info, INFO: Qgis.Info, ERROR: Qgis.Critical}
+
+_level = None
+_fileLogger = logging.getLogger("kart")
+_fileLogger.propagate = False
+_fileHandler = None
+
+
+def configure():
+    """
+    Applies the logging settings. Called on first use, and again whenever
+    the settings change
+    """
+    global _level, _fileHandler
+    _level = DEBUG if setting(DEBUGLOGGING) else INFO
+    filename = setting(LOGFILE) or None
+    if _fileHandler is not None and _fileHandler.baseFilename != filename:
+        _fileLogger.removeHandler(_fileHandler)
+        _fileHandler.close()
+        _fileHandler = None
+    if filename and _fileHandler is None:
+        try:
+            _fileHandler = logging.handlers.RotatingFileHandler(
+                filename,
+                maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUPS,
+                encoding="utf-8",
+            )
+        except OSError as e:
+            QgsMessageLog.logMessage(
+                f"Cannot write Kart log file '{filename}': {e}", "Kart", Qgis.Warning
+            )
+        else:
+            _fileHandler.setFormatter(
+                logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+            )
+            _fileLogger.addHandler(_fileHandler)
+    _fileLogger.setLevel(_level)
+
+
+def isEnabledFor(level) -> bool:
+    if _level is None:
+        configure()
+    return level >= _level
+
+
+def _preview(text, maxLines=MAX_LINES, maxChars=MAX_CHARS):
+    """
+    Returns the beginning of a possibly large text, scanning only that part
+    of it
+    """
+    end = -1
+    for _ in range(maxLines):
+        end = text.find("\n", end + 1, maxChars)
+        if end == -1:
+            break
+    if end == -1:
+        if len(text) <= maxChars:
+            return text
+        end = maxChars
+    elif end + 1 >= len(text):
+        return text
+    return text[:end] + f"\n[Showing only the first {end} of {len(text)} characters]"
 
 
-def _log(msg, level=Qgis.Info):
-    lines = msg.splitlines()
-    if len(lines) > 20:
-        msg = "\n".join(lines[:20]) + f"\n[Showing only the first {MAX_LINES} lines]"
-    QgsMessageLog.logMessage(msg, "Kart", level)
+def _log(level, msg, *args):
+    if not isEnabledFor(level):
+        return
+    # long values are shortened before formatting, so large outputs are not
+    # copied into the message
+    if args:
+        msg = msg % tuple(_preview(a) if isinstance(a, str) else a for a in args)
+    else:
+        msg = _preview(msg)
+    QgsMessageLog.logMessage(msg, "Kart", _QGIS_LEVELS[level])
+    if _fileHandler is not None:
+        _fileLogger.log(level, msg)
 
 
-def info(msg):
-    _log(msg, Qgis.Info)
+def info(msg, *args):
+    _log(INFO, msg, *args)
 
 
-def error(msg):
-    _log(msg, Qgis.Critical)
+def error(msg, *args):
+    _log(ERROR, msg, *args)
 
 
-def debug(msg):
-    if DEBUG:
-        info(msg)
+def debug(msg, *args):
+    """
+    Logs a debug message, if enabled in the settings. Pass the values in
+    'args' to only format the message (%-style) when it is logged, as a
+    shortened version of them
+    """
+    _log(DEBUG, msg, *args)
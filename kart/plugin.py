@@ -5,12 +5,13 @@ import platform
 from qgis.core import QgsProject, Qgis, QgsMessageOutput
 
 from qgis.PyQt.QtCore import Qt
-from qgis.PyQt.QtWidgets import QAction
+from qgis.PyQt.QtWidgets import QAction, QFileDialog
 
-from kart.gui.dockwidget import KartDockWidget
-from kart.gui.settingsdialog import SettingsDialog
+from kart.autocommit import AutoCommitQueue
 from kart.kartapi import checkKartInstalled, kartVersionDetails
 from kart.layers import LayerTracker
+from kart.profiling import KartCallLog
+from kart.commandlimiter import KartCommandLimiter
 
 
 pluginPath = os.path.dirname(__file__)
@@ -21,14 +22,13 @@ class KartPlugin(object):
         self.iface = iface
 
     def initGui(self):
-
-        self.dock = KartDockWidget()
-        self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock)
+        # the dock is created when first shown, so Kart is not called and
+        # its dialogs are not loaded while QGIS starts
+        self.dock = None
 
         self.explorerAction = QAction("Repositories...", self.iface.mainWindow())
         self.iface.addPluginToMenu("Kart", self.explorerAction)
         self.explorerAction.triggered.connect(self.showDock)
-        self.dock.hide()
 
         self.settingsAction = QAction("Settings...", self.iface.mainWindow())
         self.iface.addPluginToMenu("Kart", self.settingsAction)
@@ -38,6 +38,16 @@ class KartPlugin(object):
         self.iface.addPluginToMenu("Kart", self.aboutAction)
         self.aboutAction.triggered.connect(self.openAbout)
 
+        self.performanceAction = QAction("Kart performance...", self.iface.mainWindow())
+        self.iface.addPluginToMenu("Kart", self.performanceAction)
+        self.performanceAction.triggered.connect(self.openPerformance)
+
+        self.exportPerformanceAction = QAction(
+            "Export Kart performance data...", self.iface.mainWindow()
+        )
+        self.iface.addPluginToMenu("Kart", self.exportPerformanceAction)
+        self.exportPerformanceAction.triggered.connect(self.exportPerformance)
+
         self.tracker = LayerTracker.instance()
         QgsProject.instance().layerRemoved.connect(self.tracker.layerRemoved)
         QgsProject.instance().layerWasAdded.connect(self.tracker.layerAdded)
@@ -45,9 +55,16 @@ class KartPlugin(object):
 
     def showDock(self):
         if checkKartInstalled():
+            if self.dock is None:
+                from kart.gui.dockwidget import KartDockWidget
+
+                self.dock = KartDockWidget()
+                self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock)
             self.dock.show()
 
     def openSettings(self):
+        from kart.gui.settingsdialog import SettingsDialog
+
         dlg = SettingsDialog()
         dlg.exec()
 
@@ -78,12 +95,35 @@ class KartPlugin(object):
         dlg.setMessage(html, QgsMessageOutput.MessageHtml)
         dlg.showMessage()
 
+    def openPerformance(self):
+        dlg = QgsMessageOutput.createMessageOutput()
+        dlg.setTitle("Kart performance")
+        dlg.setMessage(KartCallLog.instance().toHtml(), QgsMessageOutput.MessageHtml)
+        dlg.showMessage()
+
+    def exportPerformance(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(),
+            "Export Kart performance data",
+            "",
+            "JSON files (*.json)",
+        )
+        if filename:
+            with open(filename, "w") as f:
+                f.write(KartCallLog.instance().toJson())
+
     def unload(self):
-        self.iface.removeDockWidget(self.dock)
-        self.dock = None
+        if self.dock is not None:
+            self.iface.removeDockWidget(self.dock)
+            self.dock = None
         self.iface.removePluginMenu("Kart", self.explorerAction)
         self.iface.removePluginMenu("Kart", self.settingsAction)
         self.iface.removePluginMenu("Kart", self.aboutAction)
+        self.iface.removePluginMenu("Kart", self.performanceAction)
+        self.iface.removePluginMenu("Kart", self.exportPerformanceAction)
 
         QgsProject.instance().layerRemoved.disconnect(self.tracker.layerRemoved)
         QgsProject.instance().layerWasAdded.disconnect(self.tracker.layerAdded)
+
+        AutoCommitQueue.instance().stop()
+        KartCommandLimiter.instance().clear()
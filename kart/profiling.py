@@ -0,0 +1,179 @@
+import html
+import json
+import sys
+import threading
+import time
+
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional
+
+# Number of Kart calls kept in memory
+MAX_RECORDS = 1000
+# Number of calls listed as the slowest ones in the stats
+SLOWEST_COUNT = 10
+
+
+class KartCallRecord(NamedTuple):
+    """
+    A single call to Kart. Output sizes are in characters of the decoded
+    output, and None if it was not read (e.g. the call failed to start)
+    """
+
+    command: List[str]
+    repo: Optional[str]
+    action: Optional[str]
+    started: float
+    duration: float
+    stdoutSize: Optional[int]
+    stderrSize: Optional[int]
+    exitCode: Optional[int]
+
+
+def callingAction() -> Optional[str]:
+    """
+    Returns the name of the outermost Repository method in the stack of the
+    current thread, which is the closest to the user action that caused a
+    Kart call
+    """
+    action = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if (
+            frame.f_globals.get("__name__") == "kart.kartapi"
+            and code.co_name != "executeKart"
+        ):
+            instance = frame.f_locals.get("self")
+            if type(instance).__name__ == "Repository":
+                action = code.co_name
+        frame = frame.f_back
+    return action
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Returns the value below which the given fraction of the sorted values
+    fall, using the nearest rank
+    """
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[rank]
+
+
+class KartCallLog:
+    """
+    Keeps the most recent Kart calls, so the commands run by each action
+    and their cost can be inspected
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        """
+        Returns the call log instance
+        """
+        if KartCallLog._instance is None:
+            KartCallLog._instance = KartCallLog()
+
+        return KartCallLog._instance
+
+    def __init__(self, maxRecords: int = MAX_RECORDS):
+        self._records = deque(maxlen=maxRecords)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        command: List[str],
+        repo: Optional[str],
+        started: float,
+        stdout: Optional[str] = None,
+        stderr: Optional[str] = None,
+        exitCode: Optional[int] = None,
+        stdoutSize: Optional[int] = None,
+    ):
+        """
+        Adds a call which started at 'started' (a time.perf_counter() value)
+        and just finished
+        """
+        if stdoutSize is None and stdout is not None:
+            stdoutSize = len(stdout)
+        duration = time.perf_counter() - started
+        record = KartCallRecord(
+            command=list(command),
+            repo=repo,
+            action=callingAction(),
+            started=time.time() - duration,
+            duration=duration,
+            stdoutSize=stdoutSize,
+            stderrSize=None if stderr is None else len(stderr),
+            exitCode=exitCode,
+        )
+        with self._lock:
+            self._records.append(record)
+
+    def records(self) -> List[KartCallRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self) -> Dict:
+        """
+        Returns the number of calls and the median (p50) and p95 duration
+        for each action, and the slowest calls
+        """
+        records = self.records()
+        byAction = {}
+        for record in records:
+            byAction.setdefault(record.action or "", []).append(record.duration)
+        actions = {}
+        for action, durations in byAction.items():
+            durations.sort()
+            actions[action] = {
+                "calls": len(durations),
+                "total": sum(durations),
+                "p50": percentile(durations, 0.5),
+                "p95": percentile(durations, 0.95),
+            }
+        slowest = sorted(records, key=lambda r: r.duration, reverse=True)
+        return {
+            "calls": len(records),
+            "actions": actions,
+            "slowest": [r._asdict() for r in slowest[:SLOWEST_COUNT]],
+        }
+
+    def toJson(self) -> str:
+        return json.dumps(
+            {"stats": self.stats(), "calls": [r._asdict() for r in self.records()]},
+            indent=2,
+        )
+
+    def toHtml(self) -> str:
+        stats = self.stats()
+        rows = "".join(
+            f"<tr><td>{html.escape(action or '(other)')}</td><td>{s['calls']}</td>"
+            f"<td>{s['p50']:.3f}</td><td>{s['p95']:.3f}</td>"
+            f"<td>{s['total']:.3f}</td></tr>"
+            for action, s in sorted(
+                stats["actions"].items(), key=lambda a: a[1]["total"], reverse=True
+            )
+        )
+        slowest = "".join(
+            f"<tr><td>{c['duration']:.3f}</td>"
+            f"<td>{html.escape(c['action'] or '')}</td>"
+            f"<td>{html.escape(' '.join(c['command']))}</td></tr>"
+            for c in stats["slowest"]
+        )
+        return (
+            "<html><body>"
+            f"<h4>Kart calls: {stats['calls']}</h4>"
+            "<table border='1' cellpadding='3'>"
+            "<tr><th>Action</th><th>Calls</th><th>p50 (s)</th><th>p95 (s)</th>"
+            f"<th>Total (s)</th></tr>{rows}</table>"
+            "<h4>Slowest calls</h4>"
+            "<table border='1' cellpadding='3'>"
+            f"<tr><th>Time (s)</th><th>Action</th><th>Command</th></tr>{slowest}"
+            "</table></body></html>"
+        )
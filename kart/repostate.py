@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+from functools import wraps
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+# Files inside the .kart folder that change whenever refs, the index or
+# the repository configuration change
+STATE_FILES = ("HEAD", "packed-refs", "config", "index", "MERGE_HEAD")
+STATE_FOLDERS = ("refs",)
+# Small files whose content is part of the key, so changes are detected
+# even on filesystems with a coarse mtime resolution
+CONTENT_FILES = ("HEAD",)
+
+GLOBAL_CONFIG = os.path.expanduser("~/.gitconfig")
+
+# Seconds the state of a working copy in a database is assumed not to
+# change, since there are no files telling when it does
+DATABASE_WORKING_COPY_TTL = 2
+
+# Kart commands that do not modify the repository state
+READONLY_COMMANDS = ("log", "diff", "show", "status", "conflicts")
+READONLY_SUBCOMMANDS = {
+    "meta": "get",
+    "data": "ls",
+    "config": "-l",
+    "remote": "-v",
+}
+
+
+def isReadOnlyCommand(commands) -> bool:
+    """
+    Returns True if the kart command cannot change refs, index or config
+    """
+    if not commands:
+        return True
+    name = commands[0]
+    if name in READONLY_COMMANDS:
+        return True
+    if name in ("branch", "tag"):
+        return len(commands) == 1
+    return len(commands) > 1 and READONLY_SUBCOMMANDS.get(name) == commands[1]
+
+
+def _fileKey(path, withContent=False):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if withContent:
+        try:
+            with open(path, "rb") as f:
+                return stat.st_mtime_ns, stat.st_size, f.read()
+        except OSError:
+            return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def repoStateKey(path: str) -> Tuple:
+    """
+    Returns a key that changes whenever the refs, index or configuration of
+    the repository at the given path change. Computing it only takes a few
+    file stats, much cheaper than calling Kart.
+    """
+    kartFolder = os.path.join(path, ".kart")
+    key = [
+        (name, _fileKey(os.path.join(kartFolder, name), name in CONTENT_FILES))
+        for name in STATE_FILES
+    ]
+    for folder in STATE_FOLDERS:
+        for root, dirs, files in os.walk(os.path.join(kartFolder, folder)):
+            dirs.sort()
+            for name in sorted(files):
+                filepath = os.path.join(root, name)
+                key.append((filepath, _fileKey(filepath)))
+    key.append((GLOBAL_CONFIG, _fileKey(GLOBAL_CONFIG)))
+    return tuple(key)
+
+
+def workingCopyKey(path: str, location: Optional[str]) -> Hashable:
+    """
+    Returns a key that changes whenever the working copy of the repository
+    at the given path is edited. For a working copy in a database it only
+    changes every DATABASE_WORKING_COPY_TTL seconds
+    """
+    if not location:
+        return None
+    filepath = os.path.join(path, location)
+    if os.path.exists(filepath):
+        # edits to a GeoPackage may only be in the write-ahead log so far
+        return _fileKey(filepath), _fileKey(filepath + "-wal")
+    return int(time.monotonic() // DATABASE_WORKING_COPY_TTL)
+
+
+class RepoStateCache:
+    """
+    Caches values computed from the state of a repository, which are
+    dropped as soon as the state key of the repository changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._key = None
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: Hashable, compute: Callable[[], Any]) -> Any:
+        key = repoStateKey(self.path)
+        with self._lock:
+            if key != self._key:
+                self._key = key
+                self._values = {}
+            if name in self._values:
+                return self._values[name]
+        value = compute()
+        with self._lock:
+            # do not store values if the state changed while computing them
+            if self._key == key:
+                self._values[name] = value
+        return value
+
+    def put(self, name: Hashable, value: Any):
+        """
+        Stores a value that was computed as a side result of something else
+        """
+        key = repoStateKey(self.path)
+        with self._lock:
+            if key != self._key:
+                self._key = key
+                self._values = {}
+            self._values[name] = value
+
+    def invalidate(self):
+        with self._lock:
+            self._key = None
+            self._values = {}
+
+
+def cachedbystate(f):
+    """
+    Caches the result of a Repository method (per arguments) until the
+    state of the repository changes
+    """
+
+    @wraps(f)
+    def inner(self, *args):
+        return self._stateCache.get((f.__name__,) + args, lambda: f(self, *args))
+
+    return inner
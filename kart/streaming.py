@@ -0,0 +1,233 @@
+import json
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+CHUNK_SIZE = 64 * 1024
+_SEPARATORS = " \t\r\n,"
+
+
+def iterJsonArray(stream: TextIO, key: str = "features") -> Iterator[Any]:
+    """
+    Incrementally parses the elements of the array stored under the given
+    key of a JSON document (e.g. the features of a GeoJSON FeatureCollection)
+    read from a text stream.
+
+    Only the element being parsed is kept in memory, so arbitrarily large
+    documents can be processed, and the first elements are available as
+    soon as they are written to the stream.
+    """
+    decoder = json.JSONDecoder()
+    marker = f'"{key}"'
+    buffer = ""
+    while True:
+        idx = buffer.find(marker)
+        if idx != -1:
+            start = buffer.find("[", idx + len(marker))
+            if start != -1:
+                buffer = buffer[start + 1 :]
+                break
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+
+    pos = 0
+    chunkSize = CHUNK_SIZE
+    while True:
+        while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+            pos += 1
+        if pos == len(buffer):
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the element is not complete yet. Read more, increasing the size
+            # of the reads so very large elements are not parsed many times
+            chunk = stream.read(chunkSize)
+            if not chunk:
+                raise
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            chunkSize *= 2
+            continue
+        chunkSize = CHUNK_SIZE
+        yield element
+        pos = end
+        if pos > CHUNK_SIZE:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def iterJsonLines(stream: TextIO) -> Iterator[Any]:
+    """
+    Parses the JSON documents written one per line to a text stream (e.g. a
+    Kart diff in json-lines format) as they are read
+    """
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def isSchemaChange(record: Dict) -> bool:
+    """
+    Returns True if a record of a json-lines diff is a change of the schema
+    of a dataset. Unchanged schemas are written with a 'value' instead
+    """
+    return (
+        record.get("type") in ("metaInfo", "meta")
+        and record.get("key") == "schema.json"
+        and "change" in record
+    )
+
+
+def _diffFeature(
+    dataset: str,
+    changeType: str,
+    row: Dict,
+    schema: List[Dict],
+    toGeometry: Callable[[str], Optional[Dict]],
+) -> Dict:
+    geometryColumns = {c["name"] for c in schema if c.get("dataType") == "geometry"}
+    pk = next(
+        (c["name"] for c in schema if c.get("primaryKeyIndex") == 0),
+        next(iter(row)),
+    )
+    geometry = None
+    properties = {}
+    for name, value in row.items():
+        if name in geometryColumns:
+            geometry = toGeometry(value) if value else None
+        else:
+            properties[name] = value
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": properties,
+        "id": f"{dataset}:feature:{row[pk]}:{changeType}",
+    }
+
+
+def diffLinesFeatures(
+    records: Iterable[Dict], toGeometry: Callable[[str], Optional[Dict]]
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    Turns the records of a Kart diff in json-lines format into the same
+    (dataset, GeoJSON diff feature) tuples as the GeoJSON diff, so all the
+    changed datasets can be read from a single Kart call.
+
+    Geometries are written as hex WKB, which 'toGeometry' converts to
+    GeoJSON. The schema of each dataset, written before its features, tells
+    which columns are geometries and which one is the primary key
+    """
+    schemas = {}
+    for record in records:
+        recordType = record.get("type")
+        if recordType in ("metaInfo", "meta") and record.get("key") == "schema.json":
+            change = record.get("change", {})
+            schema = record.get("value") or change.get("+") or change.get("-")
+            schemas[record["dataset"]] = schema or []
+        elif recordType == "feature":
+            dataset = record["dataset"]
+            schema = schemas.get(dataset, [])
+            old = record["change"].get("-")
+            new = record["change"].get("+")
+            if old and new:
+                versions = [("U-", old), ("U+", new)]
+            elif new:
+                versions = [("I", new)]
+            else:
+                versions = [("D", old)]
+            for changeType, row in versions:
+                yield dataset, _diffFeature(
+                    dataset, changeType, row, schema, toGeometry
+                )
+
+
+class DiffRecord(NamedTuple):
+    """
+    A single feature change. 'old' and 'new' are GeoJSON features, or an
+    empty dict for inserts and deletes respectively
+    """
+
+    dataset: str
+    changeType: str
+    fid: str
+    old: Dict
+    new: Dict
+
+
+def parseDiffFeatureId(featureId: str) -> Tuple[str, str]:
+    """
+    Returns the change type ('I', 'U-', 'U+' or 'D') and the feature id
+    encoded in the id of a GeoJSON diff feature.
+
+    The old format is the change type and numeric id, eg. 'U-::49'
+    whereas the new format additionally includes the dataset name
+    and element type eg. 'nz_pipelines:feature:49:U-'
+    """
+    # TODO - remove support for 'old' format, requires users to have upgraded
+    #  this plugin first
+    try:
+        changetype, featid = featureId.split("::")
+    except ValueError:
+        _, _, featid, changetype = featureId.rsplit(":", 3)
+    return changetype, featid
+
+
+def diffRecords(features: Iterable[Tuple[str, Dict]]) -> Iterator[DiffRecord]:
+    """
+    Turns a stream of (dataset, GeoJSON diff feature) tuples into DiffRecords,
+    pairing the old and new versions of updated features.
+
+    Kart writes both versions of an update next to each other, so only a
+    handful of unpaired versions are held at any time
+    """
+    pending = {}
+    for dataset, feature in features:
+        changetype, featid = parseDiffFeatureId(feature["id"])
+        if changetype == "I":
+            yield DiffRecord(dataset, "I", featid, {}, feature)
+        elif changetype == "D":
+            yield DiffRecord(dataset, "D", featid, feature, {})
+        else:
+            other = pending.pop((dataset, featid), None)
+            if other is None:
+                pending[(dataset, featid)] = feature
+            elif changetype == "U+":
+                yield DiffRecord(dataset, "U", featid, other, feature)
+            else:
+                yield DiffRecord(dataset, "U", featid, feature, other)
+    for (dataset, featid), feature in pending.items():
+        # an update with a single version should not happen. Show it anyway
+        changetype, _ = parseDiffFeatureId(feature["id"])
+        if changetype == "U-":
+            yield DiffRecord(dataset, "U", featid, feature, {})
+        else:
+            yield DiffRecord(dataset, "U", featid, {}, feature)
+
+
+def diffRecordsFromDict(diff: Dict[str, list]) -> Iterator[DiffRecord]:
+    """
+    Returns the DiffRecords of a diff as returned by Repository.diff()
+    """
+    return diffRecords(
+        (dataset, feature) for dataset, features in diff.items() for feature in features
+    )
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from qgis.testing import start_app
+
+from kart import utils
+from kart.kartapi import _kartEnvironment
+from kart.commandlimiter import KartCommandLimiter
+from kart.utils import HELPERMODE, KARTPATH, setSetting
+from kart.tests.benchmarks.utils import FakeKart, LATENCY
+
+start_app()
+
+
+def pytest_collection_modifyitems(config, items):
+    # the benchmarks are slow, so they only run when asked for
+    if os.environ.get("KART_BENCHMARKS"):
+        return
+    folder = os.path.dirname(__file__)
+    skip = pytest.mark.skip(reason="set KART_BENCHMARKS to run the benchmarks")
+    for item in items:
+        if str(item.fspath).startswith(folder):
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def fakeKart(tmp_path, monkeypatch):
+    if os.name == "nt":
+        pytest.skip("The stand-in kart executable is a shell script")
+    fake = FakeKart(str(tmp_path))
+    setSetting(KARTPATH, fake.binFolder)
+    setSetting(HELPERMODE, False)
+    env = _kartEnvironment()
+    monkeypatch.setitem(env, "FAKE_KART_SCENARIO", fake.scenarioFile)
+    monkeypatch.setitem(env, "FAKE_KART_CALLS", fake.callsFile)
+    monkeypatch.setitem(env, "FAKE_KART_LATENCY", LATENCY)
+    # dialogs need a main window, which the mocked iface provides
+    for module in ("conflictsdialog", "historyviewer", "diffviewer"):
+        monkeypatch.setattr(f"kart.gui.{module}.iface", utils.iface)
+    yield fake
+    setSetting(KARTPATH, "")
+    KartCommandLimiter.instance().clear()
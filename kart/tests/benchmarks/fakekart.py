@@ -0,0 +1,242 @@
+"""
+A stand-in for the kart executable, used by the benchmarks.
+
+It replays the contents of a scenario file (see synthetic.scenario) in the
+format Kart writes them, for the commands the plugin uses. It is configured
+through these environment variables:
+
+FAKE_KART_SCENARIO: path to the scenario JSON file
+FAKE_KART_CALLS: file where a line is appended for each call, with the
+    arguments and the time it took
+FAKE_KART_LATENCY: seconds to wait before answering, to simulate the
+    startup time of Kart
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+
+VERSION = "Kart v0.15.0, Copyright (c) Kart Contributors"
+
+
+def _options(args):
+    """
+    Splits the arguments of a command into positional arguments and the
+    output format
+    """
+    positional = []
+    outputFormat = None
+    for arg in args:
+        if arg == "-ojson":
+            outputFormat = "json"
+        elif arg.startswith("-o"):
+            outputFormat = arg[2:]
+        elif arg.startswith("--output-format="):
+            outputFormat = arg.split("=", 1)[1]
+        else:
+            positional.append(arg)
+    return positional, outputFormat
+
+
+def _featureCollection(features):
+    return json.dumps({"type": "FeatureCollection", "features": features})
+
+
+def _hexWkb(geometry):
+    # the synthetic features only have points
+    x, y = geometry["coordinates"]
+    return struct.pack("<BIdd", 1, 1, x, y).hex().upper()
+
+
+def _row(feature):
+    return {**feature["properties"], "geom": _hexWkb(feature["geometry"])}
+
+
+def _jsonLines(scenario, changes):
+    """
+    Writes a diff in json-lines format: the schema of each dataset followed
+    by its features, with both versions of an update in a single record
+    """
+    print(json.dumps({"type": "version", "version": "kart.diff/v2"}))
+    for name, features in changes.items():
+        print(json.dumps({"type": "datasetInfo", "path": name, "value": {}}))
+        schema = scenario["datasets"][name]["schema.json"]
+        record = {"type": "metaInfo", "dataset": name, "key": "schema.json"}
+        print(json.dumps({**record, "value": schema}))
+        old = None
+        for feature in features:
+            changeType = feature["id"].rsplit(":", 1)[1]
+            if changeType == "U-":
+                old = feature
+                continue
+            change = {}
+            if changeType == "U+":
+                change["-"] = _row(old)
+            if changeType == "D":
+                change["-"] = _row(feature)
+            else:
+                change["+"] = _row(feature)
+            print(json.dumps({"type": "feature", "dataset": name, "change": change}))
+
+
+def log(scenario, args):
+    positional, outputFormat = _options(args)
+    commits = scenario["commits"]
+    if "-n" in positional:
+        limit = int(positional[positional.index("-n") + 1])
+    else:
+        limit = len(commits)
+    skip = 0
+    for arg in positional:
+        if arg.startswith("--skip="):
+            skip = int(arg.split("=", 1)[1])
+    page = commits[skip : skip + limit]
+    if outputFormat == "json":
+        print(json.dumps(page))
+    else:
+        for commit in page:
+            print(" ".join([commit["commit"]] + commit["parents"]))
+
+
+def diff(scenario, args):
+    positional, outputFormat = _options(args)
+    changes = scenario["diff"]
+    if "--only-feature-count=exact" in positional:
+        # updates are written as two features
+        counts = {
+            name: sum(1 for f in features if not f["id"].endswith(":U-"))
+            for name, features in changes.items()
+        }
+        print(json.dumps(counts))
+        return
+    if any(arg.endswith(":meta") for arg in positional):
+        print(json.dumps({"kart.diff/v1+hexwkb": {}}))
+        return
+    if "--output" in positional:
+        folder = positional[positional.index("--output") + 1]
+        for name, features in changes.items():
+            with open(os.path.join(folder, f"{name}.geojson"), "w") as f:
+                f.write(_featureCollection(features))
+        return
+    if outputFormat == "json-lines":
+        if len(positional) > 1:
+            changes = {positional[-1]: changes.get(positional[-1], [])}
+        _jsonLines(scenario, changes)
+        return
+    # diff [refs] dataset[:fid]
+    dataset, _, fid = positional[-1].partition(":")
+    features = changes.get(dataset, [])
+    if fid:
+        features = [f for f in features if f["id"].split(":")[2] == fid]
+    print(_featureCollection(features))
+
+
+def conflicts(scenario, args):
+    positional, outputFormat = _options(args)
+    conflicted = scenario["conflicts"]
+    if "-s" in positional:
+        summary = {
+            name: {"feature": [int(fid) for fid in features]}
+            for name, features in conflicted.items()
+            if features
+        }
+        print(json.dumps({"kart.conflicts/v1": summary}))
+        return
+    if positional:
+        conflicted = {positional[0]: conflicted.get(positional[0], {})}
+    print(
+        _featureCollection(
+            [
+                feature
+                for features in conflicted.values()
+                for versions in features.values()
+                for feature in versions.values()
+                if feature is not None
+            ]
+        )
+    )
+
+
+def meta(scenario, args):
+    positional, outputFormat = _options(args)
+    datasets = scenario["datasets"]
+    # meta get [dataset [item]]
+    if len(positional) > 1:
+        datasets = {positional[1]: datasets[positional[1]]}
+    if len(positional) > 2:
+        datasets = {
+            name: {positional[2]: values[positional[2]]}
+            for name, values in datasets.items()
+        }
+    print(json.dumps(datasets))
+
+
+def data(scenario, args):
+    # data ls
+    datasets = [
+        {"path": name, "type": "table", "version": 3} for name in scenario["datasets"]
+    ]
+    print(json.dumps({"kart.data.ls/v2": datasets}))
+
+
+def status(scenario, args):
+    head = scenario["commits"][0]["commit"] if scenario["commits"] else None
+    status = {
+        "commit": head,
+        "branch": "main",
+        "upstream": None,
+        "workingCopy": {"changes": {}},
+    }
+    print(json.dumps({"kart.status/v1": status}))
+
+
+def branch(scenario, args):
+    head = scenario["commits"][0]["commit"] if scenario["commits"] else None
+    branches = {"main": {"commit": head, "branch": "main", "upstream": None}}
+    print(json.dumps({"kart.branch/v1": {"current": "main", "branches": branches}}))
+
+
+COMMANDS = {
+    "log": log,
+    "diff": diff,
+    "conflicts": conflicts,
+    "meta": meta,
+    "data": data,
+    "status": status,
+    "branch": branch,
+}
+
+
+def run(args):
+    if args == ["--version"]:
+        print(VERSION)
+        return 0
+    command = COMMANDS.get(args[0])
+    if command is None:
+        # commands changing the repo don't output anything the plugin reads
+        return 0
+    with open(os.environ["FAKE_KART_SCENARIO"]) as f:
+        scenario = json.load(f)
+    command(scenario, args[1:])
+    return 0
+
+
+def main(args):
+    started = time.perf_counter()
+    latency = float(os.environ.get("FAKE_KART_LATENCY") or 0)
+    if latency:
+        time.sleep(latency)
+    try:
+        return run(args)
+    finally:
+        calls = os.environ.get("FAKE_KART_CALLS")
+        if calls:
+            with open(calls, "a") as f:
+                elapsed = time.perf_counter() - started
+                f.write(json.dumps({"args": args, "time": elapsed}) + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+"""
+Generators of synthetic repository contents for the benchmarks, in the
+same format Kart outputs them
+"""
+
+import hashlib
+
+from datetime import datetime, timedelta, timezone
+
+CRS = "EPSG:4326"
+SCHEMA = [
+    {"id": "fid", "name": "fid", "dataType": "integer", "primaryKeyIndex": 0},
+    {"id": "geom", "name": "geom", "dataType": "geometry", "geometryType": "POINT"},
+    {"id": "name", "name": "name", "dataType": "text"},
+    {"id": "value", "name": "value", "dataType": "integer"},
+]
+
+
+def commitId(n):
+    return hashlib.sha1(str(n).encode()).hexdigest()
+
+
+def commits(count, mergeEvery=10):
+    """
+    Returns a history of 'count' commits, newest first. Every 'mergeEvery'
+    commits there is a merge of a two commits long side branch
+    """
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    history = []
+    for n in range(count, 0, -1):
+        parents = [commitId(n - 1)] if n > 1 else []
+        if mergeEvery and n % mergeEvery == 0 and n > 3:
+            # n-1 and n-2 are a side branch forked from n-3
+            parents = [commitId(n - 3), commitId(n - 1)]
+        history.append(
+            {
+                "commit": commitId(n),
+                "abbrevCommit": commitId(n)[:7],
+                "message": f"Commit number {n}",
+                "refs": ["HEAD -> main"] if n == count else [],
+                "authorName": "Benchmark",
+                "authorEmail": "benchmark@example.com",
+                "authorTime": (start + timedelta(hours=n)).isoformat(),
+                "authorTimeOffset": "+00:00",
+                "parents": parents,
+            }
+        )
+    return history
+
+
+def feature(dataset, fid, changeType, value=0):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [fid % 360 - 180, value % 90]},
+        "properties": {"fid": fid, "name": f"Feature {fid}", "value": value},
+        "id": f"{dataset}:feature:{fid}:{changeType}",
+    }
+
+
+def diff(datasets, count):
+    """
+    Returns a diff with 'count' changes in each dataset, as returned by
+    Repository.diff(): a third of them inserts, updates and deletes
+    """
+    changes = {}
+    for dataset in datasets:
+        features = []
+        for fid in range(count):
+            kind = fid % 3
+            if kind == 0:
+                features.append(feature(dataset, fid, "I"))
+            elif kind == 1:
+                features.append(feature(dataset, fid, "U-"))
+                features.append(feature(dataset, fid, "U+", value=1))
+            else:
+                features.append(feature(dataset, fid, "D"))
+        changes[dataset] = features
+    return changes
+
+
+def conflicts(datasets, count):
+    """
+    Returns 'count' conflicted features in each dataset, as returned by
+    Repository.conflicts()
+    """
+    ret = {}
+    for dataset in datasets:
+        ret[dataset] = {
+            str(fid): {
+                version: feature(dataset, fid, version, value)
+                for value, version in enumerate(("ancestor", "ours", "theirs"))
+            }
+            for fid in range(count)
+        }
+    return ret
+
+
+def scenario(datasets=("points",), commitCount=0, diffCount=0, conflictCount=0):
+    """
+    Returns the contents replayed by the stand-in kart executable
+    """
+    return {
+        "datasets": {
+            dataset: {f"crs/{CRS}.wkt": "", "schema.json": SCHEMA}
+            for dataset in datasets
+        },
+        "commits": commits(commitCount),
+        "diff": diff(datasets, diffCount),
+        "conflicts": conflicts(datasets, conflictCount),
+    }
@@ -0,0 +1,116 @@
+"""
+Benchmarks of the plugin against a stand-in kart executable replaying
+synthetic repos, so they run offline and only measure the plugin.
+
+They are skipped unless KART_BENCHMARKS is set. Run them with
+'KART_BENCHMARKS=1 pytest kart/tests/benchmarks', which needs pytest-benchmark.
+Use --benchmark-json to store the results and compare runs, see the
+variables in kart/tests/benchmarks/utils.py to change the sizes.
+Besides timings, each benchmark records the number of kart calls and the
+peak memory allocated in a run
+"""
+
+import pytest
+
+from qgis.PyQt.QtTest import QSignalSpy
+
+from kart.commitgraph import CommitGraph
+from kart.gui.conflictsdialog import ConflictsDialog
+from kart.gui.diffviewer import DiffViewerWidget
+from kart.gui.historyviewer import HistoryTree, LOG_PAGE_SIZE
+from kart.tests.benchmarks import synthetic
+from kart.tests.benchmarks.utils import SIZES, measure
+
+DATASETS = ("points", "more_points")
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testLog(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(commitCount=size))
+    commits, calls = measure(benchmark, fakeKart, repo.log)
+    assert len(commits) == size
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testLogPage(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(commitCount=size))
+
+    def logPage():
+        return repo.log(limit=LOG_PAGE_SIZE, skip=size // 2, graph=CommitGraph())
+
+    commits, calls = measure(benchmark, fakeKart, logPage)
+    assert len(commits) == min(LOG_PAGE_SIZE, size - size // 2)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testDiff(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(DATASETS, diffCount=size))
+    diff, calls = measure(benchmark, fakeKart, repo.diff, "HEAD~1", "HEAD")
+    assert set(diff) == set(DATASETS)
+    # all datasets are read from a single json-lines diff
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testDiffStreamForDataset(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(DATASETS, diffCount=size))
+
+    def readStream():
+        return sum(1 for _ in repo.diffStream("HEAD~1", "HEAD", "points"))
+
+    count, calls = measure(benchmark, fakeKart, readStream)
+    assert count == size
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testConflicts(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(DATASETS, conflictCount=size))
+    conflicts, calls = measure(benchmark, fakeKart, repo.conflicts)
+    assert all(len(conflicts[dataset]) == size for dataset in DATASETS)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testDiffViewerFillTree(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(DATASETS, diffCount=size))
+    diff = synthetic.diff(DATASETS, size)
+    widget = DiffViewerWidget({}, repo, False)
+
+    def fillTree():
+        widget.diff = diff
+        widget.layerDiffLayers = {}
+        widget.fillTree()
+
+    _, calls = measure(benchmark, fakeKart, fillTree)
+    assert widget.featuresModel.rowCount() == len(DATASETS)
+    # the CRS of the datasets is only read once
+    assert not calls
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testHistoryTreePopulate(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(commitCount=size))
+    tree = HistoryTree(repo, None, None)
+    _, calls = measure(benchmark, fakeKart, tree.populate)
+    assert tree.topLevelItemCount() == min(size, LOG_PAGE_SIZE)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def testConflictsDialog(benchmark, fakeKart, size):
+    repo = fakeKart.load(synthetic.scenario(DATASETS, conflictCount=size))
+
+    def openDialog():
+        dialog = ConflictsDialog(repo, repo.conflictsSummary())
+        # the conflicts of the first dataset are read in the background
+        spy = QSignalSpy(dialog.conflictsModel.conflictsRead)
+        assert spy.wait(60000)
+        return dialog
+
+    dialog, calls = measure(benchmark, fakeKart, openDialog)
+    assert dialog.conflictsModel.rowCount() == len(DATASETS)
+    # the summary and the conflicts of the first dataset
+    assert len(calls) == 2
@@ -0,0 +1,85 @@
+import json
+import os
+import stat
+import sys
+import tracemalloc
+
+from kart.kartapi import Repository
+
+FAKE_KART = os.path.join(os.path.dirname(__file__), "fakekart.py")
+
+# Sizes of the synthetic repos and diffs, e.g. KART_BENCHMARK_SIZES=100,100000
+SIZES = [
+    int(size) for size in os.environ.get("KART_BENCHMARK_SIZES", "100,10000").split(",")
+]
+ROUNDS = int(os.environ.get("KART_BENCHMARK_ROUNDS", "3"))
+# Seconds each call to the stand-in kart takes, on top of starting Python
+LATENCY = os.environ.get("KART_BENCHMARK_LATENCY", "0")
+
+
+class FakeKart:
+    """
+    Sets up the stand-in kart executable and keeps track of the calls to it
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.scenarioFile = os.path.join(folder, "scenario.json")
+        self.callsFile = os.path.join(folder, "calls.jsonl")
+        self.binFolder = os.path.join(folder, "bin")
+        os.makedirs(self.binFolder)
+        executable = os.path.join(self.binFolder, "kart")
+        with open(executable, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_KART}" "$@"\n')
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+
+    def load(self, scenario):
+        """
+        Writes the contents to be replayed and returns a repo to read them
+        """
+        with open(self.scenarioFile, "w") as f:
+            json.dump(scenario, f)
+        path = os.path.join(self.folder, "repo")
+        os.makedirs(os.path.join(path, ".kart"), exist_ok=True)
+        with open(os.path.join(path, ".kart", "HEAD"), "w") as f:
+            f.write("ref: refs/heads/main")
+        return Repository(path)
+
+    def calls(self):
+        if not os.path.exists(self.callsFile):
+            return []
+        with open(self.callsFile) as f:
+            return [json.loads(line) for line in f]
+
+    def resetCalls(self):
+        if os.path.exists(self.callsFile):
+            os.remove(self.callsFile)
+
+
+def measure(benchmark, fakeKart, func, *args, **kwargs):
+    """
+    Benchmarks a callable, adding the number of kart calls of a run, the
+    time spent in them and the peak memory allocated by the callable to the
+    extra info of the benchmark.
+
+    Returns the result of the callable and the kart calls of its last run
+    """
+
+    def setup():
+        fakeKart.resetCalls()
+        return args, kwargs
+
+    result = benchmark.pedantic(func, setup=setup, rounds=ROUNDS)
+    calls = fakeKart.calls()
+
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    benchmark.extra_info["kartCalls"] = len(calls)
+    benchmark.extra_info["kartTime"] = sum(call["time"] for call in calls)
+    benchmark.extra_info["peakMemory"] = peak
+    return result, calls
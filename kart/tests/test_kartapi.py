@@ -2,6 +2,9 @@ import os
 import re
 import shutil
 import tempfile
+import threading
+
+from unittest.mock import patch
 
 from qgis.core import (
     edit,
@@ -11,9 +14,11 @@ from qgis.core import (
     QgsFeature,
     QgsGeometry,
     QgsPointXY,
+    QgsVectorLayer,
 )
 from qgis.testing import unittest, start_app
 
+from qgis.PyQt.QtCore import QEventLoop
 from qgis.PyQt.QtTest import QSignalSpy
 
 from kart.kartapi import (
@@ -22,8 +27,22 @@ from kart.kartapi import (
     installedVersion,
     KartException,
     executeKart,
+    iterInBackground,
+    runAndWait,
+    runInBackground,
 )
 from kart.core import RepoManager
+from kart.commandlimiter import KartCommandLimiter
+from kart.profiling import KartCallLog
+from kart.commitgraph import CommitGraph
+from kart.streaming import parseDiffFeatureId
+from kart.conflicts import (
+    solveAllWithVersion,
+    solveAllMerged,
+    solveMerged,
+    groupConflicts,
+)
+from kart.autocommit import AutoCommitQueue, autoCommitMessage
 
 from kart.utils import HELPERMODE, setSetting, KARTPATH
 from kart.tests.utils import patch_iface
@@ -44,6 +63,36 @@ def createRepoCopy():
     return tempFolder, repoCopy
 
 
+def createMergeConflict(count=1):
+    """
+    Returns a copy of the test repo in the middle of a merge, with 'count'
+    features of the test layer modified differently in both branches.
+    Features are added to the layer first if it has fewer
+    """
+    folder, repo = createRepoCopy()
+    layer = repo.workingCopyLayer("testlayer")
+    missing = count - layer.featureCount()
+    if missing > 0:
+        with edit(layer):
+            for i in range(missing):
+                feature = QgsFeature(layer.fields())
+                feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(i, i)))
+                feature.setAttributes([100 + i, 0])
+                layer.addFeatures([feature])
+        repo.commit("Added features")
+    repo.createBranch("newbranch")
+    for branch, value in [("newbranch", 1000), ("main", 2000)]:
+        repo.checkoutBranch(branch)
+        layer = repo.workingCopyLayer("testlayer")
+        features = list(layer.getFeatures())[:count]
+        with edit(layer):
+            for feature in features:
+                layer.changeAttributeValue(feature.id(), 1, value)
+        repo.commit(f"Modified features in {branch}")
+    repo.mergeBranch("newbranch", "")
+    return folder, repo
+
+
 class TestKartapi(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -78,6 +127,83 @@ class TestKartapi(unittest.TestCase):
         kartVersionDetails()  # called to set up environment var
         assert executeKart.env['KART_USE_HELPER'] == '', "Helper mode was not disabled"
 
+    def testCommandLimiterCountsCommands(self):
+        # a new repo, so nothing is cached yet
+        folder, repo = createRepoCopy()
+        limiter = KartCommandLimiter.instance()
+        limiter.clear()
+        repo.branches()
+        repo.tags()
+        assert limiter.commandCount(repo.path) == 2
+        folder.cleanup()
+
+    def testCommandLimiterDoesNotBlockMainThread(self):
+        limiter = KartCommandLimiter(maxConcurrent=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def _background():
+            with limiter.slot(None):
+                started.set()
+                release.wait(10)
+
+        thread = threading.Thread(target=_background)
+        thread.start()
+        try:
+            assert started.wait(10)
+            # all slots are taken, but the main thread does not wait
+            with limiter.slot(None):
+                pass
+            assert limiter.commandCount(None) == 1
+        finally:
+            release.set()
+            thread.join()
+        assert limiter.commandCount(None) == 2
+
+    def testCommandsWithHelperMode(self):
+        setSetting(HELPERMODE, True)
+        KartCommandLimiter.instance().clear()
+        assert len(self.testRepo.branches()) == 2
+        setSetting(HELPERMODE, False)
+
+    def _commandCount(self, repo):
+        return KartCommandLimiter.instance().commandCount(repo.path)
+
+    def testStateCacheAvoidsCommands(self):
+        folder, repo = createRepoCopy()
+        repo.branches()
+        repo.datasets()
+        repo.workingCopyLocation()
+        count = self._commandCount(repo)
+        assert repo.currentBranch() == "main"
+        repo.branches()
+        repo.datasets()
+        repo.workingCopyLocation()
+        assert self._commandCount(repo) == count
+        folder.cleanup()
+
+    def testStateCacheInvalidation(self):
+        folder, repo = createRepoCopy()
+        assert "cachebranch" not in repo.branches()
+        repo.createBranch("cachebranch")
+        assert "cachebranch" in repo.branches()
+        # changes made outside of the plugin are detected too
+        Repository(repo.path).deleteBranch("cachebranch")
+        assert "cachebranch" not in repo.branches()
+        folder.cleanup()
+
+    def testCallLogRecordsAction(self):
+        callLog = KartCallLog.instance()
+        callLog.clear()
+        self.testRepo.log()
+        records = callLog.records()
+        assert len(records) == 1
+        assert records[0].action == "log"
+        assert records[0].command[0] == "log"
+        assert records[0].exitCode == 0
+        assert records[0].stdoutSize > 0
+        assert callLog.stats()["actions"]["log"]["calls"] == 1
+
     def testKartVersion(self):
         version = installedVersion()
         assert re.match(r'\d+\.\d+\.\d+', version)
@@ -108,6 +234,16 @@ class TestKartapi(unittest.TestCase):
         manager3 = RepoManager()
         self.assertEqual(len(manager3.repos()), 0)
 
+    def testRepoForLayer(self):
+        manager = RepoManager()
+        manager.add_repo(self.testRepo)
+        layer = self.testRepo.workingCopyLayer("testlayer")
+        assert manager.repo_for_layer(layer) == self.testRepo
+        otherLayer = QgsVectorLayer("Point?crs=EPSG:4326", "other", "memory")
+        assert manager.repo_for_layer(otherLayer) is None
+        manager.remove_repo(self.testRepo)
+        assert manager.repo_for_layer(layer) is None
+
     def testInit(self):
         with tempfile.TemporaryDirectory() as folder:
             repo = Repository(folder)
@@ -133,6 +269,16 @@ class TestKartapi(unittest.TestCase):
         assert vectorLayers == ["testlayer"]
         assert tables == []
 
+    def testDatasetsWithoutMetadata(self):
+        callLog = KartCallLog.instance()
+        callLog.clear()
+        folder, repo = createRepoCopy()
+        assert repo.datasets() == (["testlayer"], [])
+        # the GeoPackage working copy tells which datasets have geometries
+        assert not [r for r in callLog.records() if r.command[0] == "meta"]
+        assert repo.workingCopyLayerCrs("testlayer") == "EPSG:4326"
+        folder.cleanup()
+
     def testClone(self):
         with tempfile.TemporaryDirectory() as folder:
             clone = Repository.clone(self.testRepo.path, folder)
@@ -158,6 +304,42 @@ class TestKartapi(unittest.TestCase):
         assert "Modified" in log[2]["message"]
         assert "Added" in log[3]["message"]
 
+    def testLogPages(self):
+        log = self.testRepo.log()
+        firstPage = self.testRepo.log(limit=2)
+        secondPage = self.testRepo.log(limit=2, skip=2)
+        lastPage = self.testRepo.log(limit=2, skip=4)
+        assert [c["commit"] for c in firstPage] == [c["commit"] for c in log[:2]]
+        assert [c["commit"] for c in secondPage] == [c["commit"] for c in log[2:4]]
+        assert len(lastPage) == 1
+
+    def testLogGraph(self):
+        log = self.testRepo.log()
+        assert all(c["commitColumn"] == 0 for c in log)
+        assert log[0]["graph"] == {"up": [], "down": [(0, 0)]}
+        assert log[-1]["graph"] == {"up": [(0, 0)], "down": []}
+
+    def testLogGraphAcrossPages(self):
+        graph = CommitGraph()
+        pages = self.testRepo.log(limit=3, graph=graph)
+        pages.extend(self.testRepo.log(limit=3, skip=3, graph=graph))
+        assert [c["graph"] for c in pages] == [c["graph"] for c in self.testRepo.log()]
+
+    def testCommitGraphMerge(self):
+        commits = [
+            {"commit": "M", "parents": ["A", "B"]},
+            {"commit": "B", "parents": ["C"]},
+            {"commit": "A", "parents": ["C"]},
+            {"commit": "C", "parents": []},
+        ]
+        graph = CommitGraph()
+        graph.add(commits)
+        assert [c["commitColumn"] for c in commits] == [0, 1, 0, 1]
+        assert commits[0]["graph"]["down"] == [(0, 0), (0, 1)]
+        assert commits[2]["graph"]["down"] == [(1, 1), (0, 1)]
+        assert graph.lanes == []
+        assert graph.maxColumn == 1
+
     def testLogForMissingDataset(self):
         log = self.testRepo.log(dataset="wronglayer")
         assert len(log) == 0
@@ -175,6 +357,61 @@ class TestKartapi(unittest.TestCase):
         assert len(features) == 2
         assert features[0]["geometry"] == features[1]["geometry"]
 
+    def testDiffUnlessSchemaChanged(self):
+        count = self._commandCount(self.testRepo)
+        diff = self.testRepo.diffUnlessSchemaChanged("HEAD", "HEAD~1")
+        # schema and features are read with a single call
+        assert self._commandCount(self.testRepo) == count + 1
+        assert diff == self.testRepo.diff("HEAD", "HEAD~1")
+        count = self._commandCount(self.testRepo)
+        # whether the schema changed is cached
+        assert not self.testRepo.diffHasSchemaChanges("HEAD", "HEAD~1")
+        assert self._commandCount(self.testRepo) == count
+
+    def testDiffStream(self):
+        records = list(self.testRepo.diffStream("HEAD", "HEAD~1"))
+        assert len(records) == 1
+        assert records[0].dataset == "testlayer"
+        assert records[0].changeType == "D"
+        assert records[0].old and not records[0].new
+
+        records = list(self.testRepo.diffStream("HEAD~1", "HEAD~2"))
+        assert len(records) == 1
+        assert records[0].changeType == "U"
+        assert records[0].old["geometry"] == records[0].new["geometry"]
+
+    def testDiffStreamForDataset(self):
+        features = [
+            feature
+            for dataset, feature in self.testRepo.iterDiff(
+                "HEAD~1", "HEAD~2", dataset="testlayer"
+            )
+        ]
+        assert features == self.testRepo.diff("HEAD~1", "HEAD~2")["testlayer"]
+
+    def testFeatureHistory(self):
+        feature = self.testRepo.diff("HEAD~1", "HEAD~2")["testlayer"][0]
+        _, fid = parseDiffFeatureId(feature["id"])
+        history = self.testRepo.log(dataset="testlayer", featureid=fid)
+        versions = self.testRepo.featureHistory("testlayer", fid, history)
+        assert list(versions) == [c["commit"] for c in history]
+        for commit in history:
+            if commit["parents"]:
+                diff = self.testRepo.diff(
+                    commit["parents"][0], commit["commit"], "testlayer", fid
+                )
+                assert versions[commit["commit"]] == diff["testlayer"]
+
+    def testChangedDatasets(self):
+        head = self.testRepo.headCommit()
+        assert head == self.testRepo.log()[0]["commit"]
+        datasets = self.testRepo.changedDatasets("HEAD~1", head)
+        assert datasets == set(self.testRepo.diff("HEAD~1", "HEAD"))
+        # HEAD is read without calling Kart
+        count = self._commandCount(self.testRepo)
+        assert self.testRepo.headCommit() == head
+        assert self._commandCount(self.testRepo) == count
+
     def testCreateAndDeleteBranch(self):
         self.testRepo.createBranch("mynewbranch")
         branches = self.testRepo.branches()
@@ -207,6 +444,37 @@ class TestKartapi(unittest.TestCase):
         assert not bool(diff.get("testlayer", []))
         folder.cleanup()
 
+    def testStatusSnapshot(self):
+        folder, repo = createRepoCopy()
+        status = repo.statusSnapshot()
+        assert status.branch == "main"
+        assert status.head == repo.log()[0]["commit"]
+        assert not status.merging
+        assert status.isWorkingTreeClean()
+        count = self._commandCount(repo)
+        assert repo.statusSnapshot() == status
+        assert self._commandCount(repo) == count
+        layer = repo.workingCopyLayer("testlayer")
+        feature = list(layer.getFeatures())[0]
+        with edit(layer):
+            layer.deleteFeatures([feature.id()])
+        # edits to the working copy are detected without a commit
+        assert "testlayer" in repo.statusSnapshot().changes
+        folder.cleanup()
+
+    def testFeatureChangeCounts(self):
+        folder, repo = createRepoCopy()
+        layer = repo.workingCopyLayer("testlayer")
+        feature = list(layer.getFeatures())[0]
+        with edit(layer):
+            layer.deleteFeatures([feature.id()])
+        status = repo.statusSnapshot()
+        assert status.featureChangeCounts() == {
+            "testlayer": {"inserts": 0, "updates": 0, "deletes": 1}
+        }
+        assert not status.hasMetaChanges("testlayer")
+        folder.cleanup()
+
     def testCommit(self):
         folder, repo = createRepoCopy()
         layer = repo.workingCopyLayer("testlayer")
@@ -223,6 +491,29 @@ class TestKartapi(unittest.TestCase):
         assert features[0]["id"].endswith(":D")
         folder.cleanup()
 
+    def testAutoCommitQueueCoalescesDatasets(self):
+        folder, repo = createRepoCopy()
+        gkpgPath = os.path.join(
+            os.path.dirname(__file__), "data", "layers", "testlayer.gpkg"
+        )
+        repo.executeKart(["import", gkpgPath, "testlayer:otherlayer"])
+        ncommits = len(repo.log())
+        queue = AutoCommitQueue.instance()
+        for dataset in ["testlayer", "otherlayer"]:
+            layer = repo.workingCopyLayer(dataset)
+            feature = list(layer.getFeatures())[0]
+            with edit(layer):
+                layer.changeAttributeValue(feature.id(), 1, 1000)
+            queue.add(repo, dataset)
+        # commits right away, waiting for it to finish
+        queue.stop()
+        log = repo.log()
+        assert ncommits + 1 == len(log)
+        message = autoCommitMessage({"testlayer", "otherlayer"})
+        assert log[0]["message"] == message
+        assert repo.changedDatasets("HEAD~1", "HEAD") == {"testlayer", "otherlayer"}
+        folder.cleanup()
+
     def testSetSpatialFilter(self):
         folder, repo = createRepoCopy()
         assert repo.spatialFilter() is None
@@ -298,6 +589,103 @@ class TestKartapi(unittest.TestCase):
         folder.cleanup()
     """
 
+    def testResolveConflicts(self):
+        folder, repo = createMergeConflict()
+        assert repo.isMerging()
+        conflicts = repo.conflicts()
+        resolved = {
+            f"{dataset}:feature:{fid}": "theirs"
+            for dataset, features in conflicts.items()
+            for fid in features
+        }
+        assert resolved
+        repo.resolveConflicts(resolved)
+        assert repo.conflicts() == {}
+        repo.continueMerge()
+        assert not repo.isMerging()
+        folder.cleanup()
+
+    def testResolveConflictsInChunks(self):
+        folder, repo = createMergeConflict(count=3)
+        conflicts = repo.conflicts()
+        assert len(conflicts["testlayer"]) == 3
+        resolved = solveAllWithVersion(conflicts, "ours")
+        count = self._commandCount(repo)
+        # chunks of two labels, so there is a full chunk and a partial one
+        with patch("kart.kartapi.RESOLVE_CHUNK_SIZE", 2):
+            repo.resolveConflicts(resolved)
+        assert self._commandCount(repo) == count + 2
+        assert repo.conflicts() == {}
+        folder.cleanup()
+
+    def testConflictsSummary(self):
+        folder, repo = createMergeConflict()
+        conflicts = repo.conflicts()
+        summary = repo.conflictsSummary()
+        assert list(summary) == ["testlayer"]
+        assert summary["testlayer"] == list(conflicts["testlayer"])
+        assert repo.conflicts("testlayer") == conflicts
+        assert not repo.conflictsHaveSchemaChanges()
+        folder.cleanup()
+
+    def testResolveConflictsWithFeature(self):
+        folder, repo = createMergeConflict()
+        conflicts = repo.conflicts()
+        resolved = {}
+        for dataset, features in conflicts.items():
+            for fid, conflict in features.items():
+                label = f"{dataset}:feature:{fid}"
+                resolved[label] = dict(conflict["ancestor"], id=label)
+        repo.resolveConflicts(resolved)
+        assert repo.conflicts() == {}
+        folder.cleanup()
+
+    def testResolveAllConflictsWithVersion(self):
+        folder, repo = createMergeConflict()
+        repo.resolveConflicts(solveAllWithVersion(repo.conflicts(), "ours"))
+        assert repo.conflicts() == {}
+        folder.cleanup()
+
+    def testMergeConflictFields(self):
+        def feature(geometry, **properties):
+            return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+        conflicts = {
+            "layer": {
+                "1": {
+                    "ancestor": feature(None, a=1, b=1),
+                    "ours": feature(None, a=2, b=1),
+                    "theirs": feature(None, a=1, b=3),
+                },
+                "2": {
+                    "ancestor": feature(None, a=1),
+                    "ours": feature(None, a=2),
+                    "theirs": feature(None, a=1),
+                },
+                "3": {
+                    "ancestor": feature(None, a=1),
+                    "ours": feature(None, a=2),
+                    "theirs": feature(None, a=3),
+                },
+                "4": {
+                    "ancestor": feature(None, a=1),
+                    "ours": None,
+                    "theirs": feature(None, a=3),
+                },
+            }
+        }
+        resolved, unresolved = solveAllMerged(conflicts)
+        assert resolved["layer:feature:1"]["properties"] == {"a": 2, "b": 3}
+        assert resolved["layer:feature:2"] == "ours"
+        assert unresolved == ["layer:feature:3", "layer:feature:4"]
+
+    def testMergeConflictsStream(self):
+        folder, repo = createMergeConflict()
+        assert solveMerged(groupConflicts(repo.iterConflicts())) == solveAllMerged(
+            repo.conflicts()
+        )
+        folder.cleanup()
+
     def testTags(self):
         folder, repo = createRepoCopy()
         assert repo.tags() == []
@@ -307,6 +695,57 @@ class TestKartapi(unittest.TestCase):
         assert repo.tags() == []
         folder.cleanup()
 
+    def testRunAndWait(self):
+        log = runAndWait("Reading log", self.testRepo.log)
+        assert len(log) == len(self.testRepo.log())
+
+    def testRunAndWaitRaisesErrors(self):
+        with self.assertRaises(KartException):
+            runAndWait("Creating branch", self.testRepo.createBranch, "main")
+
+    def testRunInBackground(self):
+        results = []
+        task = runInBackground("Reading branches", self.testRepo.branches)
+        task.resultReady.connect(results.append)
+        spy = QSignalSpy(task.resultReady)
+        assert spy.wait(10000)
+        assert results[0] == self.testRepo.branches()
+
+    def testIterInBackground(self):
+        count = sum(1 for _ in self.testRepo.diffStream("HEAD~1", "HEAD~2"))
+        batches = []
+        task = iterInBackground(
+            "Reading changes",
+            self.testRepo.diffStream,
+            "HEAD~1",
+            "HEAD~2",
+            onBatch=batches.append,
+            batchSize=1,
+        )
+        spy = QSignalSpy(task.resultReady)
+        assert spy.wait(10000)
+        assert spy[0][0] == count
+        assert [len(batch) for batch in batches] == [1] * count
+
+    def testStopTask(self):
+        delivered = []
+        task = iterInBackground(
+            "Reading changes",
+            self.testRepo.diffStream,
+            "HEAD~1",
+            "HEAD~2",
+            onBatch=delivered.append,
+            onResult=delivered.append,
+            onError=delivered.append,
+            batchSize=1,
+        )
+        task.stop()
+        loop = QEventLoop()
+        task.taskCompleted.connect(loop.quit)
+        task.taskTerminated.connect(loop.quit)
+        loop.exec_()
+        assert delivered == []
+
     def testCloneAuthFailed(self):
         with tempfile.TemporaryDirectory() as folder:
             with self.assertRaises(KartException):
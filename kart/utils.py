@@ -82,10 +82,18 @@ NAMESPACE = "kart"
 KARTPATH = "KartPath"
 HELPERMODE = "HelperMode"
 AUTOCOMMIT = "AutoCommit"
+AUTOCOMMITDELAY = "AutoCommitDelay"
 DIFFSTYLES = "DiffStyles"
 LASTREPO = "LastRepo"
+DEBUGLOGGING = "DebugLogging"
+LOGFILE = "LogFile"
 
-setting_types = {HELPERMODE: bool, AUTOCOMMIT: bool}
+setting_types = {
+    HELPERMODE: bool,
+    AUTOCOMMIT: bool,
+    AUTOCOMMITDELAY: float,
+    DEBUGLOGGING: bool,
+}
 
 
 def setSetting(name, value):
@@ -96,5 +104,10 @@ def setting(name):
     v = QSettings().value(f"{NAMESPACE}/{name}", None)
     if setting_types.get(name, str) == bool:
         return str(v).lower() == str(True).lower()
+    elif setting_types.get(name) == float:
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return None
     else:
         return v